@@ -27,6 +27,22 @@ from sgtk.platform.qt import QtCore, QtGui
 from .ui.dialog import Ui_Dialog
 from .framework_qtwidgets import *
 from .upload_shotgun import *
+from .host_budget import get_host_budget
+from .nuke_service import NukeRenderService
+from .rez_env import g_rez_cache
+from .media_info import g_media_info
+from .shotgun_cache import g_shotgun_cache
+from .transcode_cache import TranscodeCache
+from .scratch import ScratchSpace
+from .shotgun_pool import ShotgunConnectionPool
+from .version_batch import VersionBatch
+from .plate_colorspaces import PlateColorspaces
+from .timecards import Timecards
+from .task_contexts import TaskContexts
+from .job_journal import JobJournal
+from .retry import RetryPolicy
+from .upload_settings import UploadSettings, UploadServices
+from .upload_job import UploadJob, UploadJobEngine, JOB_RUNNING, JOB_DONE, JOB_FAILED
 
 MOV_COLORSPACE = [
     "NONE",
@@ -44,6 +60,14 @@ SEQ_COLORSPACE =[
     "raw"
 ]
 
+# background task groups of the dialog
+TASK_CONTEXT_GROUP = "task_context"
+TASK_STATUS_GROUP = "task_status"
+
+# tasks selected by the user are resolved before the ones warmed up
+SELECTED_TASK_PRIORITY = 10
+WARMED_TASK_PRIORITY = 0
+
 
 # There are two loggers
 # logger is shotgun logger
@@ -79,8 +103,64 @@ class AppDialog(QtGui.QWidget):
         )
         monitor_qobject_lifetime(self._task_manager, "Main task manager")
         self._task_manager.start_processing()
+        # the schema is loaded in the background from the on-disk cache of
+        # the framework, and refreshed from the site once per session
+        shotgun_globals.register_bg_task_manager(self._task_manager)
+        self._task_manager.task_completed.connect(self._on_task_completed)
+        self._task_manager.task_failed.connect(self._on_task_failed)
+
+        # context and initial folder of the tasks selected in My Tasks
+        self._task_contexts = TaskContexts(
+            max_entries=self._app.get_setting("task_context_cache_entries"))
+        self._selected_task = None
+
+        # upload jobs run on their own engine so a long batch doesn't
+        # starve the main task manager
+        self._upload_engine = UploadJobEngine(
+            self,
+            max_jobs=self._app.get_setting("max_parallel_uploads")
+        )
+        monitor_qobject_lifetime(self._upload_engine, "Upload job engine")
+        self._upload_engine.stage_changed.connect(self._on_upload_stage_changed)
+        self._upload_engine.job_finished.connect(self._on_upload_job_finished)
+        self._upload_engine.batch_finished.connect(self._on_upload_batch_finished)
+
+        g_rez_cache.enabled = self._app.get_setting("rez_context_cache")
+        g_shotgun_cache.ttl = self._app.get_setting("shotgun_cache_ttl")
+
+        # warm Nuke processes reused by the renders of every upload
+        self._nuke_service = None
+        if self._app.get_setting("nuke_render_service"):
+            self._nuke_service = NukeRenderService(
+                max_jobs=self._app.get_setting("nuke_worker_max_jobs"))
+
+        # media of items submitted again with the same frames and settings
+        self._transcode_cache = None
+        if self._app.get_setting("transcode_cache_entries"):
+            self._transcode_cache = TranscodeCache(
+                root=self._app.get_setting("transcode_cache_dir") or None,
+                max_entries=self._app.get_setting("transcode_cache_entries"))
+
+        # Shotgun connections shared by the uploads of every job
+        self._sg_connections = None
+        if self._app.get_setting("shotgun_connections"):
+            self._sg_connections = ShotgunConnectionPool(
+                max_connections=self._app.get_setting("shotgun_connections"))
+
+        # stages completed by failed uploads, skipped when they're resubmitted
+        self._journal = None
+        if self._app.get_setting("resume_uploads"):
+            self._journal = JobJournal(root=self._app.get_setting("job_journal_dir") or None)
+
+        # local folder for the intermediate files of the uploads
+        self._scratch = None
+        if self._app.get_setting("use_scratch"):
+            self._scratch = ScratchSpace(
+                root=self._app.get_setting("scratch_dir") or None,
+                min_free_space=self._app.get_setting("scratch_min_free_space"))
 
         self.selected_file_dict  = {}
+        self._running_stages = {}
 
         # lastly, set up our very basic UI
         self.user = sgtk.util.get_current_user(self._app.sgtk)
@@ -107,66 +187,123 @@ class AppDialog(QtGui.QWidget):
         self.status_init = 0
         self.ui.delete_btn.clicked.connect(self.delete_selected_item)
         self.ui.upload_btn.clicked.connect(self._upload)
+        self.ui.cancel_btn.clicked.connect(self._cancel_upload)
         self.selected_ui.widget.clicked.connect( self.update_from_selected_ui_click )
 
     def _upload(self):
-        selected_item_list = self.get_selected_item_list()
+        # rows without an item have nothing to upload
+        selected_item_list = [row for row in self.get_selected_item_list() or [] if row[1]]
         if not selected_item_list:
             return
 
+        qc_bool = True if self.qc_chk.isChecked() else False
+        settings = UploadSettings.from_app(self._app)
+        budget = get_host_budget(self._app.get_setting("host_cpu_budget"),
+                                 self._app.get_setting("host_memory_budget"))
+        retry_policy = RetryPolicy(retries=self._app.get_setting("stage_retries"),
+                                   backoff=self._app.get_setting("retry_backoff"),
+                                   process_retries=self._app.get_setting("process_retries"))
+        # the Versions of the batch are looked up and created together
+        version_batch = None
+        if self._app.get_setting("batch_versions"):
+            version_batch = VersionBatch(window=self._app.get_setting("version_batch_window"))
+        # the plates of every shot of the batch are fetched together
+        plate_colorspaces = PlateColorspaces()
+        plate_colorspaces.add_candidates([row[2].entity for row in selected_item_list])
+        services = UploadServices(budget=budget,
+                                  nuke_service=self._nuke_service,
+                                  transcode_cache=self._transcode_cache,
+                                  scratch=self._scratch,
+                                  connections=self._sg_connections,
+                                  version_batch=version_batch,
+                                  journal=self._journal,
+                                  retry_policy=retry_policy,
+                                  plate_colorspaces=plate_colorspaces,
+                                  timecards=Timecards())
+        jobs = []
         for selected_type, item, context, seq_colorspace ,desc, mov_colorspace, fps_is_checked in selected_item_list:
-            if not item:
-                return
-            print(seq_colorspace)
-            print(mov_colorspace)
-            # desc = self.ui.desc_widget.toPlainText()
-            qc_bool = True if self.qc_chk.isChecked() else False
-
-            trascoding = Transcoding(item,context,selected_type,seq_colorspace, desc,mov_colorspace,fps_is_checked)
-            version = UploadVersion(item,context,selected_type)
-            # trascoding = Transcoding(item,self.context,selected_type,desc)
-            # version = UploadVersion(item,self.context,selected_type)
-            trascoding.create_nuke_script()
-            try:
-                trascoding.create_mov()
-                trascoding.create_hdr_mov()
-                trascoding.create_mp4()
-                trascoding.create_webm()
-                trascoding.create_thumbnail()
-                trascoding.create_thumbnail_for_image()
-
-                if qc_bool:
-                    trascoding.create_nuke_script( qc = qc_bool )
-                    trascoding.create_mov( qc = qc_bool )
-                    trascoding.create_hdr_mov( qc = qc_bool )
-                    trascoding.create_mp4( qc = qc_bool )
-                    trascoding.create_webm( qc = qc_bool )
-                    trascoding.create_thumbnail( qc = qc_bool )
-                    trascoding.create_thumbnail_for_image( qc = qc_bool )
-
-                    version.create_version(trascoding.read_path,trascoding.qc_mov_path,desc,trascoding.qc_hdr_path, qc = qc_bool )
-                    version.upload_thumbnail(trascoding.qc_thumbnail_file)
-                    version.upload_filmstrip_thumbnail(trascoding.qc_filmstream_file)
-                    version.upload_mp4(trascoding.qc_mp4_path)
-                    version.upload_webm(trascoding.qc_webm_path,trascoding.qc_mov_webm_path)
-
-                version.create_version(trascoding.read_path,trascoding.mov_path,desc,trascoding.hdr_path)
-                version.upload_thumbnail(trascoding.thumbnail_file)
-                version.upload_filmstrip_thumbnail(trascoding.filmstream_file)
-                version.upload_mp4(trascoding.mp4_path)
-                version.upload_webm(trascoding.webm_path,trascoding.mov_webm_path)
-
-            except Exception as e:
-                msg = QtGui.QMessageBox()
-                msg.setIcon(QtGui.QMessageBox.Critical)
-                msg.setText("Error.")
-                msg.setInformativeText(str(e))
-                msg.setWindowTitle("Version Error")
-                msg.exec_()
-                return
-            
+            name = item.text() if selected_type == "seq" else item.fileName()
+            jobs.append(UploadJob(name, selected_type, item, context, seq_colorspace,
+                                  desc, mov_colorspace, fps_is_checked, qc = qc_bool,
+                                  settings = settings, services = services))
+            if version_batch:
+                version_batch.add_candidates(context.project, context.task,
+                                             jobs[-1].version_codes())
+
+        self._running_stages = {}
+        self._set_upload_running(True)
+        self._upload_engine.submit(jobs)
+
+    def _cancel_upload(self):
+        """
+        Cancel the upload jobs of the selected rows, or the whole batch if
+        no row is selected.
+        """
+        names = [item.text() for item in self.selected_ui.widget.selectedItems()
+                 if item.column() == 1]
+        jobs = [job for job in self._upload_engine.jobs if job.name in names]
+        self._upload_engine.cancel(jobs or None)
+
+    def _set_upload_running(self, running):
+        """
+        Enable or disable the controls that can't be used while uploading.
+        """
+        self.ui.upload_btn.setEnabled(not running)
+        self.ui.delete_btn.setEnabled(not running)
+        self.ui.cancel_btn.setEnabled(running)
+
+    def _set_upload_status(self, name, text):
+        """
+        Display the upload status of an item in the Upload Lists.
+        """
+        selected_item = self.selected_ui.widget.findItems(name, QtCore.Qt.MatchExactly)
+        if not selected_item:
+            return
+        row = selected_item[0].row()
+        status_item = QtGui.QTableWidgetItem( text )
+        status_item.setFlags( QtCore.Qt.ItemIsSelectable | QtCore.Qt.ItemIsEnabled )
+        self.selected_ui.widget.setItem( row, 6, status_item )
+
+    def _on_upload_stage_changed(self, job, stage, state):
+        """
+        Slot triggered when an upload job enters or leaves a stage.
+        """
+        if not stage:
+            self._set_upload_status(job.name, state)
+            return
+        # several stages of a job can run at the same time
+        running = self._running_stages.setdefault(job.name, [])
+        if state == JOB_RUNNING:
+            running.append(stage)
+        elif stage in running:
+            running.remove(stage)
+        if running:
+            self._set_upload_status(job.name, "%s..." % ", ".join(running))
+
+    def _on_upload_job_finished(self, job):
+        """
+        Slot triggered when an upload job is finished. A failed job doesn't
+        stop the rest of the batch, failures are reported once the batch is
+        finished.
+        """
+        if job.state == JOB_FAILED:
+            self._set_upload_status(job.name, "failed: %s" % job.error)
+
+    def _on_upload_batch_finished(self, jobs):
+        """
+        Slot triggered when every upload job of the batch is finished.
+        """
+        self._set_upload_running(False)
+        failed = [job for job in jobs if job.state == JOB_FAILED]
+        if failed:
+            self._show_upload_failures(jobs, failed)
+            return
+        if any(job.state != JOB_DONE for job in jobs):
+            return
+
         text = []
-        if len(selected_item_list) == 1:
+        if len(jobs) == 1:
+            context = jobs[0].context
             text.append(context.entity['name'])
             text.append('<a href="{0}">{0}</a>'.format(context.shotgun_url))
         else :
@@ -178,65 +315,130 @@ class AppDialog(QtGui.QWidget):
         #msg.setInformativeText("\n".join(text))
         msg.setWindowTitle("Done")
         msg.exec_()
+
+    def _show_upload_failures(self, jobs, failed):
+        """
+        Show a summary of the failed uploads of a batch.
+
+        :param jobs:    Every UploadJob of the batch
+        :param failed:  The failed jobs
+        """
+        done = len([job for job in jobs if job.state == JOB_DONE])
+        msg = QtGui.QMessageBox()
+        msg.setIcon(QtGui.QMessageBox.Critical)
+        msg.setText("%d of %d uploads failed." % (len(failed), len(jobs)))
+        msg.setInformativeText("%d uploaded. Upload the failed items again to resume them.\n\n%s"
+                               % (done, "\n".join(job.name for job in failed)))
+        msg.setDetailedText("\n\n".join("%s:\n%s" % (job.name, job.error) for job in failed))
+        msg.setWindowTitle("Version Error")
+        msg.exec_()
         
     def create_file_form(self,selection_detail,breadcrumb_trail):
+        """
+        Slot triggered when a task is selected in My Tasks. Its context is
+        resolved in the background, unless it was already.
+        """
+        entity = selection_detail.get('entity') if selection_detail else None
+        self._selected_task = entity
+        if not entity:
+            return
+        cached = self._task_contexts.get(entity)
+        if cached:
+            self._show_task_context(*cached)
+            return
+        self._task_manager.add_task(
+            self._resolve_task_context,
+            priority=SELECTED_TASK_PRIORITY,
+            group=TASK_CONTEXT_GROUP,
+            task_args=[entity])
+
+    def _show_task_context(self, context, init_path):
+        """
+        Show the files of the selected task.
+
+        :param context:     The context of the task
+        :param init_path:   The folder its files are browsed from
+        """
         count = self.ui.source_widget.count()
         for index in range(0,count):
             widget = self.ui.source_widget.widget(index)
             widget.close()
             self.ui.source_widget.removeTab(index)
 
-        self.context = self._app.sgtk.context_from_entity_dictionary(selection_detail['entity'])
-        # pprint(self.context)
-        root_path = [x for x in self.context.filesystem_locations if x.find("_3d") == -1 ]
-        print('root_path', root_path)
-        # print(root_path)
-        init_path = " "
-        if not root_path:
-            entity_type = "Task"
-            entity_query = [['entity','is',self.context.entity],
-                            ['id','is',self.context.task['id']]]
-            fields = sorted(self._app.shotgun.schema_field_read(entity_type).keys())
-            # entity = self._app.shotgun.find_one(entity_type, entity_query, fields=fields) 
-            entity = self._app.shotgun.find_one(entity_type, entity_query, ['entity']) 
-            if self.context.entity['type'] == 'Asset':
-                entity_type = 'Asset'
-                entity_query = [['code','is',self.context.entity['name']],
-                                ['id','is',self.context.entity['id']]]
-                # print(entity_query) # [['code', 'is', 'audiR8'], ['id', 'is', 8462]]
-                asset = self._app.shotgun.find_one( entity_type , entity_query, ['sg_asset_type','code'] ) 
-                # print(asset) # {'sg_asset_type': 'vehicle', 'type': 'Asset', 'id': 8462}
-                init_path = os.path.join(
-                    self._app.sgtk.project_path,
-                    "assets",
-                    asset['sg_asset_type'],
-                    asset['code']
-                )
-            else :
-                entity_type = 'Shot'
-                entity_query = [['code','is',self.context.entity['name']],
-                                ['id','is',self.context.entity['id']]]
-                shot = self._app.shotgun.find_one( entity_type , entity_query, ['sg_sequence','code'] ) 
-                init_path = os.path.join(
-                    self._app.sgtk.project_path,
-                    "seq",
-                    shot['sg_sequence']['name'],
-                    shot['code']
-                )
-        else:
-            init_path = os.path.join(
-                # self.context.filesystem_locations[0],
-                root_path[0],
-                self.context.step['name']
-                )
-            print(init_path)
+        self.context = context
         self.file_form = FilesForm(init_path)
         self.ui.source_widget.addTab(self.file_form,"Select")
         self._context_widget.set_context(self.context)
         self.file_form.ui.file_view.doubleClicked.connect( self.update_from_list_click )
-        self.get_task_status()
+        # the status is set once the context is, as setting it updates the
+        # task of the context
+        self._task_manager.add_task(
+            self._fetch_task_status,
+            priority=SELECTED_TASK_PRIORITY,
+            group=TASK_STATUS_GROUP,
+            task_args=[self.context.task])
         self.get_comp_task4qc()
 
+    def _resolve_task_context(self, entity):
+        """
+        Resolve the context of a task. Called from a background thread.
+
+        :param entity:  The task entity dictionary
+        :returns:       Tuple (entity, context, init_path)
+        """
+        context, init_path = self._task_contexts.resolve(
+            self._app.sgtk, self._app.shotgun, entity)
+        return entity, context, init_path
+
+    def _warm_task_contexts(self, *args):
+        """
+        Slot triggered when My Tasks is refreshed, resolving the context of
+        the listed tasks in the background before they're selected.
+        """
+        if not self._my_tasks_model or not self._task_contexts.max_entries:
+            return
+        root = self._my_tasks_model.invisibleRootItem()
+        for row in range(min(root.rowCount(), self._task_contexts.max_entries)):
+            entity = self._my_tasks_model.get_entity(root.child(row))
+            if not entity or entity.get("type") != "Task":
+                continue
+            if self._task_contexts.get(entity):
+                continue
+            self._task_manager.add_task(
+                self._resolve_task_context,
+                priority=WARMED_TASK_PRIORITY,
+                group=TASK_CONTEXT_GROUP,
+                task_args=[entity])
+
+    def _on_task_completed(self, task_id, group, result):
+        """
+        Slot triggered when a background task of the dialog is completed.
+        """
+        if group == TASK_CONTEXT_GROUP:
+            entity, context, init_path = result
+            if self._is_selected_task(entity):
+                self._show_task_context(context, init_path)
+        elif group == TASK_STATUS_GROUP:
+            entity, status = result
+            task = self.context.task if self.context else None
+            if task and task["id"] == entity["id"]:
+                self.editable_field_widget.set_value(status)
+
+    def _on_task_failed(self, task_id, group, msg, stack_trace):
+        """
+        Slot triggered when a background task of the dialog raised an exception.
+        """
+        if group in (TASK_CONTEXT_GROUP, TASK_STATUS_GROUP):
+            logger.error("Can't resolve the selected task: %s\n%s" % (msg, stack_trace))
+
+    def _is_selected_task(self, entity):
+        """
+        :returns: True if an entity is the task currently selected
+        """
+        return (self._selected_task is not None and
+                self._selected_task["type"] == entity["type"] and
+                self._selected_task["id"] == entity["id"])
+
     def create_context_form(self):
         self._context_widget = context_selector.ContextWidget(self)
         self._context_widget.set_up(self._task_manager)
@@ -312,14 +514,17 @@ class AppDialog(QtGui.QWidget):
             self.qc_chk.setChecked( False )
             self.qc_chk.setHidden( True )
 
-    def get_task_status(self):
-        entity_type = "Task"
-        entity_query = [["entity",'is',self.context.entity],
-                        ['id','is',self.context.task['id']]]
-        fields = sorted(self._app.shotgun.schema_field_read(entity_type).keys())
-        #entities = self._app.shotgun.find(entity_type, entity_query, fields=fields)
-        entity = self._app.shotgun.find_one(entity_type, entity_query, fields=fields)
-        self.editable_field_widget.set_value(entity['sg_status_list'])
+    def _fetch_task_status(self, entity):
+        """
+        Fetch the status of a task, never cached as it's edited from the
+        dialog. Called from a background thread.
+
+        :param entity:  The task entity dictionary
+        :returns:       Tuple (entity, status)
+        """
+        task = self._app.shotgun.find_one(
+            "Task", [['id', 'is', entity['id']]], fields=['sg_status_list'])
+        return entity, task['sg_status_list'] if task else None
 
     def closeEvent(self, event):
         """
@@ -331,6 +536,11 @@ class AppDialog(QtGui.QWidget):
         # register the data fetcher with the global schema manager
         shotgun_globals.unregister_bg_task_manager(self._task_manager)
         try:
+            self._upload_engine.shut_down()
+            if self._nuke_service:
+                self._nuke_service.shut_down()
+            if self._sg_connections:
+                self._sg_connections.clear()
             if self._my_tasks_model:
                 self._my_tasks_model.destroy()
             self._task_manager.shut_down()
@@ -352,6 +562,8 @@ class AppDialog(QtGui.QWidget):
             # refresh tab
             self.ui.tasks_widget.addTab(self._my_tasks_form, "My Tasks")
             self._my_tasks_form.entity_selected.connect(self.create_file_form)
+            if self._my_tasks_model:
+                self._my_tasks_model.data_refreshed.connect(self._warm_task_contexts)
             
         except Exception as e:
             logger.exception("Failed to Load my tasks, because %s \n %s"
@@ -392,6 +604,11 @@ class AppDialog(QtGui.QWidget):
         self._app.log_debug("Synchronizing remote path cache...")
         self._app.sgtk.synchronize_filesystem_structure()
         self._app.log_debug("Path cache up to date!")
+        g_rez_cache.clear()
+        g_shotgun_cache.clear()
+        g_media_info.clear()
+        # the folders of the tasks may have changed with the path cache
+        self._task_contexts.clear()
         if self._my_tasks_model:
             self._my_tasks_model.async_refresh()
 
@@ -430,6 +647,7 @@ class AppDialog(QtGui.QWidget):
         self.selected_ui.widget.setCellWidget(row_count, 2, seq_color_combobox)
         self.selected_ui.widget.setCellWidget(row_count, 4, combobox)
         self.selected_ui.widget.setCellWidget(row_count, 5, checkbox)
+        self.selected_ui.widget.setItem( row_count, 6, QtGui.QTableWidgetItem( "" ) )
         # self.selected_ui.widget.cellWidget(row_count, 5).setAlignment(QtGui.QWidget.Qt.AlignCenter)
         # self.selected_ui.widget.resizeRowsToContents( )
         desc_editor = QtGui.QPlainTextEdit()
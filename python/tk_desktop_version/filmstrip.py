@@ -0,0 +1,136 @@
+# -*- coding: utf-8 -*-
+# Copyright (c) 2015 Shotgun Software Inc.
+#
+# CONFIDENTIAL AND PROPRIETARY
+#
+# This work is provided "AS IS" and subject to the Shotgun Pipeline Toolkit
+# Source Code License included in this distribution package. See LICENSE.
+# By accessing, using, copying or modifying this work you indicate your
+# agreement to the Shotgun Pipeline Toolkit Source Code License. All rights
+# not expressly granted therein are reserved by Shotgun Software Inc.
+
+"""
+Builds the filmstrip and the poster thumbnail of a Version in memory, from
+frames decoded by ffmpeg and piped as PPM images.
+"""
+from sgtk.platform.qt import QtCore, QtGui
+
+
+def read_ppm_frames(stream):
+    """
+    Read the frames written by ffmpeg with '-f image2pipe -vcodec ppm'.
+
+    :param stream:  File object to read the frames from
+    :returns:       A generator of QImages
+    """
+    while True:
+        header = _read_ppm_header(stream)
+        if header is None:
+            return
+        width, height = header
+        data = _read_exactly(stream, width * height * 3)
+        if data is None:
+            return
+        # copy, the QImage doesn't own the buffer it is created from
+        yield QtGui.QImage(data, width, height, width * 3,
+                           QtGui.QImage.Format_RGB888).copy()
+
+
+def _read_ppm_header(stream):
+    """
+    :returns: The (width, height) of the next PPM image, or None at the end
+              of the stream
+    """
+    fields = []
+    token = b""
+    while len(fields) < 4:
+        char = stream.read(1)
+        if not char:
+            return None
+        if char.isspace():
+            if token:
+                fields.append(token)
+                token = b""
+        else:
+            token += char
+    if fields[0] != b"P6" or fields[3] != b"255":
+        raise ValueError("Unsupported image in the ffmpeg output: %r" % fields)
+    return int(fields[1]), int(fields[2])
+
+
+def _read_exactly(stream, size):
+    """
+    :returns: size bytes read from the stream, or None if it ended before
+    """
+    chunks = []
+    while size:
+        chunk = stream.read(size)
+        if not chunk:
+            return None
+        chunks.append(chunk)
+        size -= len(chunk)
+    return b"".join(chunks)
+
+
+class FilmstripBuilder(object):
+    """
+    Collects sampled frames, scaled to the width of a filmstrip tile, and
+    keeps a single full resolution frame as the poster thumbnail.
+    """
+
+    def __init__(self, poster_index=0, tile_width=240):
+        """
+        Construction
+
+        :param poster_index:    Index of the sample used as the poster, the
+                                last sample is used if there are fewer
+        :param tile_width:      Width of the filmstrip tiles
+        """
+        self.poster_index = poster_index
+        self.tile_width = tile_width
+        self.poster = None
+        self._tiles = []
+
+    def add_frame(self, image):
+        """
+        Add the next sampled frame.
+
+        :param image: The frame as a QImage
+        """
+        if self.poster is None or len(self._tiles) <= self.poster_index:
+            self.poster = image
+        self._tiles.append(image.scaledToWidth(self.tile_width,
+                                               QtCore.Qt.SmoothTransformation))
+
+    def filmstrip(self):
+        """
+        :returns: A QImage with the tiles side by side, as montage -tile x1
+        """
+        width = sum(tile.width() for tile in self._tiles)
+        height = max([tile.height() for tile in self._tiles] or [0])
+        strip = QtGui.QImage(width, height, QtGui.QImage.Format_RGB888)
+        strip.fill(QtGui.QColor(QtCore.Qt.black))
+        painter = QtGui.QPainter(strip)
+        try:
+            x = 0
+            for tile in self._tiles:
+                painter.drawImage(x, 0, tile)
+                x += tile.width()
+        finally:
+            painter.end()
+        return strip
+
+    def save(self, filmstrip_file, thumbnail_file, quality=92):
+        """
+        Write the filmstrip and the poster thumbnail as jpegs.
+
+        :param filmstrip_file:  Path to the filmstrip
+        :param thumbnail_file:  Path to the poster thumbnail
+        :param quality:         Jpeg quality
+        """
+        if not self._tiles:
+            raise ValueError("No frame was decoded")
+        if not self.filmstrip().save(filmstrip_file, "JPG", quality):
+            raise IOError("Can't write %s" % filmstrip_file)
+        if not self.poster.save(thumbnail_file, "JPG", quality):
+            raise IOError("Can't write %s" % thumbnail_file)
@@ -0,0 +1,134 @@
+# -*- coding: utf-8 -*-
+# Copyright (c) 2015 Shotgun Software Inc.
+#
+# CONFIDENTIAL AND PROPRIETARY
+#
+# This work is provided "AS IS" and subject to the Shotgun Pipeline Toolkit
+# Source Code License included in this distribution package. See LICENSE.
+# By accessing, using, copying or modifying this work you indicate your
+# agreement to the Shotgun Pipeline Toolkit Source Code License. All rights
+# not expressly granted therein are reserved by Shotgun Software Inc.
+
+"""
+Frames handed from a Nuke render to the ffmpeg encoding the review media
+while the render is still running.
+"""
+import os
+import time
+import shutil
+import tempfile
+import threading
+
+
+class FrameStream(object):
+    """
+    A local folder Nuke writes uncompressed 16 bit frames to, logging every
+    finished frame to a progress file. feed() pipes the frames to ffmpeg as
+    soon as they are logged and removes them, so at most the frames ffmpeg is
+    behind the render are on disk.
+    """
+
+    def __init__(self, root=None):
+        """
+        Construction
+
+        :param root: Folder the stream folder is created in, the system
+                     temporary folder by default
+        """
+        self.path = tempfile.mkdtemp(prefix="tk_desktop_version_stream_", dir=root)
+        self.progress_file = os.path.join(self.path, "progress")
+        self.frame_template = os.path.join(self.path, "frame.%06d.tif")
+        self._render_finished = threading.Event()
+
+    def nuke_write(self, input_node, colorspace, name="stream"):
+        """
+        :param input_node:  Name of the node variable the Write reads from
+        :param colorspace:  The colorspace the frames are written in
+        :param name:        Name of the variable of the Write, its node being
+                            named after it
+        :returns:           The lines of a Nuke script creating the Write,
+                            logging every frame it writes
+        """
+        frame_template = self.frame_template.replace("\\", "/")
+        progress_file = self.progress_file.replace("\\", "/")
+        on_frame = 'open(%r, "a").write("%%d\\n" %% nuke.frame())' % progress_file
+
+        nk = ''
+        nk += '{0} = nuke.nodes.Write(name="{0}_write", inputs = [{1}],file={2!r} )\n'.format(
+            name, input_node, frame_template)
+        nk += '{}["file_type"].setValue( "tiff" )\n'.format(name)
+        # 16 bit, the review media aren't encoded from frames already
+        # quantized to 8 bit
+        nk += '{}["datatype"].setValue( "16 bit" )\n'.format(name)
+        nk += '{}["compression"].setValue( "none" )\n'.format(name)
+        nk += '{0}["colorspace"].setValue( "{1}")\n'.format(name, colorspace)
+        nk += '{0}["afterFrameRender"].setValue( {1!r} )\n'.format(name, on_frame)
+        return nk
+
+    def nuke_done(self):
+        """
+        :returns: The line of a Nuke script logging the end of the render
+        """
+        return 'open({!r}, "a").write("done\\n")\n'.format(
+            self.progress_file.replace("\\", "/"))
+
+    @property
+    def ffmpeg_input(self):
+        """
+        :returns: The ffmpeg arguments reading the frames from stdin
+        """
+        return ["-f", "image2pipe", "-vcodec", "tiff", "-i", "-"]
+
+    def render_finished(self):
+        """
+        Tell feed() that the render process is over, whether it succeeded
+        or not.
+        """
+        self._render_finished.set()
+
+    def feed(self, stdin, check_cancelled=None, poll_interval=0.1):
+        """
+        Write the rendered frames to a process stdin as they are logged,
+        until the render logs its end.
+
+        :param stdin:           File object to write the frames to
+        :param check_cancelled: Optional callable raising an exception if
+                                the work was cancelled
+        :param poll_interval:   Seconds to wait for the next frame
+        :raises:                Exception if the render finished without
+                                logging its end
+        """
+        offset = 0
+        while True:
+            if check_cancelled:
+                check_cancelled()
+            # read after checking, so a finished render's log is complete
+            finished = self._render_finished.is_set()
+            lines = []
+            if os.path.exists(self.progress_file):
+                with open(self.progress_file, "rb") as f:
+                    f.seek(offset)
+                    data = f.read()
+                # a line is only complete once its newline is written
+                end = data.rfind(b"\n") + 1
+                offset += end
+                lines = data[:end].decode("utf-8").split()
+
+            for line in lines:
+                if line == "done":
+                    return
+                frame_file = self.frame_template % int(line)
+                with open(frame_file, "rb") as f:
+                    stdin.write(f.read())
+                os.remove(frame_file)
+
+            if not lines:
+                if finished:
+                    raise Exception("the render stopped before its last frame")
+                time.sleep(poll_interval)
+
+    def remove(self):
+        """
+        Remove the stream folder and any frame left in it.
+        """
+        shutil.rmtree(self.path, ignore_errors=True)
@@ -0,0 +1,257 @@
+# -*- coding: utf-8 -*-
+# Copyright (c) 2015 Shotgun Software Inc.
+#
+# CONFIDENTIAL AND PROPRIETARY
+#
+# This work is provided "AS IS" and subject to the Shotgun Pipeline Toolkit
+# Source Code License included in this distribution package. See LICENSE.
+# By accessing, using, copying or modifying this work you indicate your
+# agreement to the Shotgun Pipeline Toolkit Source Code License. All rights
+# not expressly granted therein are reserved by Shotgun Software Inc.
+
+"""
+Host-wide budget of cores and memory shared by every upload a user runs on the
+machine, so that concurrent Nuke and ffmpeg processes started by one or several
+dialogs don't oversubscribe it.
+"""
+import os
+import json
+import time
+import uuid
+import getpass
+import tempfile
+import threading
+import contextlib
+import multiprocessing
+
+try:
+    import fcntl
+except ImportError:
+    # Windows: the lock file is locked with msvcrt instead
+    fcntl = None
+    import msvcrt
+
+from .process import pid_is_alive
+
+
+class HostBudget(object):
+    """
+    Cores and memory (in MB) which can be reserved by the stages of upload
+    jobs. Reservations are stored in a json file next to a lock file in a
+    folder of the temp folder only the user can write to, so they are shared
+    by every process of the user on the host. Reservations of processes which
+    died are discarded.
+    """
+
+    # seconds between two attempts to reserve resources
+    poll_interval = 0.5
+    # seconds to wait for the lock of the reservations on Windows
+    lock_timeout = 60
+
+    def __init__(self, cores=0, memory=0, path=None):
+        """
+        Construction
+
+        :param cores:   Number of cores in the budget, all the cores if 0
+        :param memory:  Memory in MB in the budget, 80% of the physical memory
+                        if 0
+        :param path:    Path to the file storing the reservations, in a
+                        folder of the user in the temp folder by default
+        """
+        self.configure(cores, memory)
+        self.path = path or os.path.join(
+            tempfile.gettempdir(), "tk_desktop_version_%s" % getpass.getuser(), "budget.json")
+        self._lock = threading.Lock()
+
+    def configure(self, cores=0, memory=0):
+        """
+        Set the size of the budget. Reservations already held are kept.
+
+        :param cores:   Number of cores in the budget, all the cores if 0
+        :param memory:  Memory in MB in the budget, 80% of the physical memory
+                        if 0
+        """
+        self.cores = cores or multiprocessing.cpu_count()
+        self.memory = memory or int(_physical_memory() * 0.8)
+
+    @contextlib.contextmanager
+    def reserve(self, cores, memory, check_cancelled=None):
+        """
+        Context manager blocking until the requested resources are available
+        and holding them until it exits.
+
+        Requests larger than the budget are clamped to the budget, so a
+        single expensive stage always gets to run eventually.
+
+        :param cores:           Number of cores to reserve
+        :param memory:          Memory in MB to reserve
+        :param check_cancelled: Optional callable raising an exception if the
+                                work was cancelled while waiting
+        """
+        cores = min(cores, self.cores)
+        memory = min(memory, self.memory)
+        key = "%d:%s" % (os.getpid(), uuid.uuid4().hex)
+        while not self._try_reserve(key, cores, memory):
+            if check_cancelled:
+                check_cancelled()
+            time.sleep(self.poll_interval)
+        try:
+            yield
+        finally:
+            self._release(key)
+
+    def _try_reserve(self, key, cores, memory):
+        """
+        Reserve resources if they are available.
+
+        :returns: True if the resources were reserved
+        """
+        with self._reservations() as reservations:
+            used_cores = sum(r["cores"] for r in reservations.values())
+            used_memory = sum(r["memory"] for r in reservations.values())
+            if reservations and (used_cores + cores > self.cores or
+                                 used_memory + memory > self.memory):
+                return False
+            reservations[key] = {"cores": cores, "memory": memory}
+            return True
+
+    def _release(self, key):
+        """
+        Release the resources held by a reservation.
+        """
+        with self._reservations() as reservations:
+            reservations.pop(key, None)
+
+    @contextlib.contextmanager
+    def _reservations(self):
+        """
+        Context manager giving exclusive access to the reservations of the
+        host, saving them back when it exits.
+        """
+        self._lock.acquire()
+        try:
+            lock_file = _open_private(self.path + ".lock")
+            try:
+                _lock(lock_file, self.lock_timeout)
+                try:
+                    reservations = self._read()
+                    yield reservations
+                    self._write(reservations)
+                finally:
+                    _unlock(lock_file)
+            finally:
+                lock_file.close()
+        finally:
+            self._lock.release()
+
+    def _read(self):
+        """
+        :returns: The reservations of live processes, by reservation key
+        """
+        try:
+            with open(self.path) as f:
+                reservations = json.load(f)
+        except (IOError, OSError, ValueError):
+            return {}
+        return dict(
+            (key, value) for key, value in reservations.items()
+            if pid_is_alive(int(key.split(":")[0]))
+        )
+
+    def _write(self, reservations):
+        """
+        Save the reservations of the host.
+        """
+        f = _open_private(self.path, "w")
+        try:
+            json.dump(reservations, f)
+        finally:
+            f.close()
+
+
+def _open_private(path, mode="a"):
+    """
+    Open a file only the user can read and write, in a folder only the user
+    can write to, creating them if needed.
+    """
+    folder = os.path.dirname(path)
+    if not os.path.isdir(folder):
+        try:
+            os.makedirs(folder, 0o700)
+        except OSError:
+            # created by another process in the meantime
+            if not os.path.isdir(folder):
+                raise
+    fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o600)
+    if mode == "w":
+        os.ftruncate(fd, 0)
+    return os.fdopen(fd, mode)
+
+
+def _lock(f, timeout):
+    """
+    Block until the exclusive lock of a file is acquired, by any process of
+    the host.
+
+    :param f:       The open lock file
+    :param timeout: Seconds after which waiting for the lock fails on
+                    Windows, flock waits as long as it takes
+    :raises:        IOError if the lock can't be acquired in time
+    """
+    if fcntl:
+        fcntl.flock(f, fcntl.LOCK_EX)
+        return
+    # msvcrt locks a range of bytes from the current position. LK_LOCK
+    # raises after 10 attempts a second apart, so it's called again until
+    # the timeout
+    f.seek(0)
+    end = time.time() + timeout
+    while True:
+        try:
+            msvcrt.locking(f.fileno(), msvcrt.LK_LOCK, 1)
+            return
+        except (IOError, OSError):
+            if time.time() >= end:
+                raise IOError("Timed out waiting for the lock of the host budget")
+
+
+def _unlock(f):
+    """
+    Release the lock of a file acquired with _lock.
+    """
+    if fcntl:
+        fcntl.flock(f, fcntl.LOCK_UN)
+        return
+    f.seek(0)
+    msvcrt.locking(f.fileno(), msvcrt.LK_UNLCK, 1)
+
+
+def _physical_memory():
+    """
+    :returns: The physical memory of the host in MB
+    """
+    try:
+        return os.sysconf("SC_PAGE_SIZE") * os.sysconf("SC_PHYS_PAGES") // (1024 * 1024)
+    except (AttributeError, ValueError, OSError):
+        # no sysconf on Windows, assume a workstation sized host
+        return 32 * 1024
+
+
+# single global instance of the host budget, configured by the app
+_g_host_budget = None
+
+def get_host_budget(cores=0, memory=0):
+    """
+    Return the host budget of this process, creating it on first use and
+    resizing it to the current settings afterwards.
+
+    :param cores:   Number of cores in the budget, all the cores if 0
+    :param memory:  Memory in MB in the budget, 80% of the physical memory if 0
+    :returns:       A HostBudget instance
+    """
+    global _g_host_budget
+    if _g_host_budget is None:
+        _g_host_budget = HostBudget(cores, memory)
+    else:
+        _g_host_budget.configure(cores, memory)
+    return _g_host_budget
@@ -0,0 +1,234 @@
+# -*- coding: utf-8 -*-
+# Copyright (c) 2015 Shotgun Software Inc.
+#
+# CONFIDENTIAL AND PROPRIETARY
+#
+# This work is provided "AS IS" and subject to the Shotgun Pipeline Toolkit
+# Source Code License included in this distribution package. See LICENSE.
+# By accessing, using, copying or modifying this work you indicate your
+# agreement to the Shotgun Pipeline Toolkit Source Code License. All rights
+# not expressly granted therein are reserved by Shotgun Software Inc.
+
+"""
+Frames of a sequence copied to a local folder by parallel threads ahead of
+the Nuke render reading them, so the render isn't bound by the latency of
+sequential reads from shared storage.
+"""
+import os
+import shutil
+import tempfile
+import threading
+
+
+class InputStaging(object):
+    """
+    A local folder the frames of a sequence are copied to, in order, by a
+    pool of threads staying at most lookahead frames ahead of the render.
+
+    The render script waits for each frame to be staged before rendering it
+    and logs every rendered frame to a progress file, the frames it is done
+    with being removed.
+    """
+
+    def __init__(self, read_path, first, last, root=None, threads=8,
+                 lookahead=32, poll_interval=0.05):
+        """
+        Construction
+
+        :param read_path:       Path of the sequence, with a printf style
+                                frame number
+        :param first:           First frame of the sequence
+        :param last:            Last frame of the sequence
+        :param root:            Folder the staging folder is created in, the
+                                system temporary folder by default
+        :param threads:         Number of frames copied at the same time
+        :param lookahead:       Maximum number of frames staged ahead of the
+                                last rendered one
+        :param poll_interval:   Seconds between two reads of the progress
+        """
+        self.read_path = read_path
+        self.path = tempfile.mkdtemp(prefix="tk_desktop_version_input_", dir=root)
+        self.staged_read_path = os.path.join(self.path, os.path.basename(read_path))
+        self.progress_file = os.path.join(self.path, "progress")
+        self.failed_file = os.path.join(self.path, "failed")
+        self.error = None
+        self._frames = list(range(first, last + 1))
+        self._threads = max(1, threads)
+        self._lookahead = max(1, lookahead)
+        self._poll_interval = poll_interval
+        self._condition = threading.Condition()
+        self._workers = []
+        self._next = 0
+        self._rendered = first - 1
+        self._removed = 0
+        self._progress_offset = 0
+        self._stopped = False
+
+    def nuke_wait_first_frame(self):
+        """
+        :returns: The lines of a Nuke script waiting for the first frame to
+                  be staged, so the Read created on the staged sequence gets
+                  its format from it
+        """
+        return self._wait_code(repr(self._frames[0] if self._frames else 0))
+
+    def nuke_callbacks(self, writes="writes"):
+        """
+        The callbacks are set on the knobs of the Writes rather than added
+        globally, so they don't outlive the script in a reused Nuke session.
+
+        :param writes:  Name of the list variable of the Writes to render
+        :returns:       The lines of a Nuke script making every Write wait for
+                        its frame to be staged, and log it once rendered
+        """
+        progress_file = self.progress_file.replace("\\", "/")
+        on_frame = 'open(%r, "a").write("%%d\\n" %% nuke.frame())' % progress_file
+
+        nk = ''
+        nk += 'for staged_write in {}:\n'.format(writes)
+        nk += '    staged_write["beforeFrameRender"].setValue( {!r} )\n'.format(
+            self._wait_code("nuke.frame()"))
+        # the stream Write already logs its frames for the encoder
+        nk += '    after = staged_write["afterFrameRender"].value()\n'
+        nk += '    staged_write["afterFrameRender"].setValue( "\\n".join( [x for x in [after, {!r}] if x] ) )\n'.format(
+            on_frame)
+        return nk
+
+    def _wait_code(self, frame):
+        """
+        :param frame:   Python expression of the frame to wait for
+        :returns:       Python code waiting for a frame to be staged, raising
+                        an error if staging failed
+        """
+        staged_read_path = self.staged_read_path.replace("\\", "/")
+        failed_file = self.failed_file.replace("\\", "/")
+
+        code = ''
+        code += 'import os, time\n'
+        code += 'staged_path = {!r} % {}\n'.format(staged_read_path, frame)
+        code += 'while not os.path.exists( staged_path ):\n'
+        code += '    if os.path.exists( {!r} ):\n'.format(failed_file)
+        code += '        raise RuntimeError( open( {!r} ).read() )\n'.format(failed_file)
+        code += '    time.sleep( {} )\n'.format(self._poll_interval)
+        return code
+
+    def start(self, check_cancelled=None):
+        """
+        Start staging the frames in background threads, from the first
+        frame if the render is run again.
+
+        :param check_cancelled: Optional callable raising an exception if
+                                the work was cancelled
+        """
+        self.remove()
+        os.makedirs(self.path)
+        self.error = None
+        self._next = 0
+        self._rendered = self._frames[0] - 1 if self._frames else 0
+        self._removed = 0
+        self._progress_offset = 0
+        self._stopped = False
+        for index in range(min(self._threads, len(self._frames))):
+            worker = threading.Thread(target=self._stage_frames,
+                                      args=(check_cancelled,),
+                                      name="input staging %d" % index)
+            worker.daemon = True
+            worker.start()
+            self._workers.append(worker)
+
+    def stop(self):
+        """
+        Stop staging and wait for the threads to finish.
+        """
+        with self._condition:
+            self._stopped = True
+            self._condition.notify_all()
+        for worker in self._workers:
+            worker.join()
+        self._workers = []
+
+    def remove(self):
+        """
+        Remove the staging folder and every frame left in it.
+        """
+        shutil.rmtree(self.path, ignore_errors=True)
+
+    def _stage_frames(self, check_cancelled):
+        """
+        Copy frames until every frame is staged or staging is stopped. Run
+        by each staging thread.
+        """
+        while True:
+            with self._condition:
+                frame = self._next_frame()
+                if frame is None:
+                    return
+            try:
+                if check_cancelled:
+                    check_cancelled()
+                self._stage_frame(frame)
+            except Exception as e:
+                with self._condition:
+                    if self.error is None:
+                        self.error = "Can't stage frame %d: %s" % (frame, e)
+                        with open(self.failed_file, "w") as f:
+                            f.write(self.error)
+                    self._stopped = True
+                    self._condition.notify_all()
+                return
+
+    def _next_frame(self):
+        """
+        Wait until the next frame can be staged without getting more than
+        lookahead frames ahead of the render. Called with the condition
+        acquired.
+
+        :returns: The frame to stage, or None if there's none left
+        """
+        while True:
+            if self._stopped or self._next >= len(self._frames):
+                return None
+            frame = self._frames[self._next]
+            if frame <= self._rendered + self._lookahead:
+                self._next += 1
+                return frame
+            self._read_progress()
+            if frame > self._rendered + self._lookahead:
+                self._condition.wait(self._poll_interval)
+
+    def _read_progress(self):
+        """
+        Read the frames logged by the render since the last read, and remove
+        the staged frames it is done with. Called with the condition
+        acquired.
+        """
+        if not os.path.exists(self.progress_file):
+            return
+        with open(self.progress_file, "rb") as f:
+            f.seek(self._progress_offset)
+            data = f.read()
+        # a line is only complete once its newline is written
+        end = data.rfind(b"\n") + 1
+        self._progress_offset += end
+        for line in data[:end].decode("utf-8").split():
+            self._rendered = max(self._rendered, int(line))
+
+        # every Write renders the current frame, only the previous ones are
+        # done with
+        while (self._removed < self._next and
+               self._frames[self._removed] < self._rendered):
+            try:
+                os.remove(self.staged_read_path % self._frames[self._removed])
+            except OSError:
+                pass
+            self._removed += 1
+
+    def _stage_frame(self, frame):
+        """
+        Copy a frame to the staging folder. The copy is renamed once
+        complete, so the render never reads a partial frame.
+        """
+        staged_file = self.staged_read_path % frame
+        partial_file = staged_file + ".part"
+        shutil.copyfile(self.read_path % frame, partial_file)
+        os.rename(partial_file, staged_file)
@@ -0,0 +1,172 @@
+# -*- coding: utf-8 -*-
+# Copyright (c) 2015 Shotgun Software Inc.
+#
+# CONFIDENTIAL AND PROPRIETARY
+#
+# This work is provided "AS IS" and subject to the Shotgun Pipeline Toolkit
+# Source Code License included in this distribution package. See LICENSE.
+# By accessing, using, copying or modifying this work you indicate your
+# agreement to the Shotgun Pipeline Toolkit Source Code License. All rights
+# not expressly granted therein are reserved by Shotgun Software Inc.
+
+"""
+On-disk journal of the stages completed by the upload jobs, so that an item
+submitted again after a failed or cancelled upload resumes where it stopped
+instead of rendering and uploading everything again.
+"""
+import os
+import json
+import time
+import getpass
+import hashlib
+import tempfile
+
+import sgtk
+
+from .util import Threaded
+
+logger = sgtk.platform.get_logger(__name__)
+
+
+def journal_key(paths, settings):
+    """
+    Compute the key of the journal of an item.
+
+    :param paths:       The source files of the item
+    :param settings:    Dictionary of every setting of the upload
+    :returns:           A hexadecimal digest, changing when a source file
+                        is written again
+    """
+    digest = hashlib.sha1()
+    for path in paths:
+        stat = os.stat(path)
+        digest.update(("%s %d %r\n" % (path, stat.st_size, stat.st_mtime)).encode("utf-8"))
+    digest.update(json.dumps(settings, sort_keys=True, default=str).encode("utf-8"))
+    return digest.hexdigest()
+
+
+def file_records(paths):
+    """
+    :param paths:   List of file paths, empty ones are skipped
+    :returns:       Dictionary of path to (size, modification time), for
+                    the files which exist
+    """
+    records = {}
+    for path in paths:
+        if path and os.path.isfile(path):
+            stat = os.stat(path)
+            records[path] = [stat.st_size, stat.st_mtime]
+    return records
+
+
+def files_unchanged(records):
+    """
+    :param records: Dictionary returned by file_records()
+    :returns:       True if every file still exists as it was recorded
+    """
+    for path, (size, mtime) in records.items():
+        try:
+            stat = os.stat(path)
+        except OSError:
+            return False
+        if stat.st_size != size or stat.st_mtime != mtime:
+            return False
+    return True
+
+
+class JobJournal(Threaded):
+    """
+    One json file per item, recording the completed stages of its upload.
+    The journal of an item is removed once its upload succeeds, and
+    journals older than max_age seconds are discarded.
+    """
+
+    # a week
+    max_age = 7 * 24 * 3600
+
+    def __init__(self, root=None):
+        """
+        Construction
+
+        :param root: Folder the journals are kept in, a folder in the system
+                     temp folder if None
+        """
+        Threaded.__init__(self)
+        self.root = root or os.path.join(
+            tempfile.gettempdir(), "tk_desktop_version_journal_%s" % getpass.getuser())
+
+    @Threaded.exclusive
+    def load(self, key):
+        """
+        :param key: The journal key of the item
+        :returns:   Dictionary of stage name to the record of the completed
+                    stages, empty if the item has no journal
+        """
+        self._remove_expired()
+        try:
+            with open(self._path(key)) as f:
+                return json.load(f)
+        except (IOError, OSError, ValueError):
+            return {}
+
+    @Threaded.exclusive
+    def record(self, key, stage, record):
+        """
+        Record a completed stage.
+
+        :param key:     The journal key of the item
+        :param stage:   The stage name
+        :param record:  Json serializable dictionary describing the stage
+                        outputs
+        """
+        path = self._path(key)
+        try:
+            with open(path) as f:
+                stages = json.load(f)
+        except (IOError, OSError, ValueError):
+            stages = {}
+        stages[stage] = record
+        tmp_path = "%s.%d.tmp" % (path, os.getpid())
+        try:
+            if not os.path.exists(self.root):
+                os.makedirs(self.root)
+            with open(tmp_path, "w") as f:
+                json.dump(stages, f, default=str)
+            if os.path.exists(path) and os.name == "nt":
+                os.remove(path)
+            os.rename(tmp_path, path)
+        except (IOError, OSError) as e:
+            logger.warning("Can't write upload journal %s: %s" % (path, e))
+
+    @Threaded.exclusive
+    def remove(self, key):
+        """
+        Remove the journal of an item.
+
+        :param key: The journal key of the item
+        """
+        try:
+            os.remove(self._path(key))
+        except OSError:
+            pass
+
+    def _path(self, key):
+        """
+        :returns: The path of the journal of an item
+        """
+        return os.path.join(self.root, key + ".json")
+
+    def _remove_expired(self):
+        """
+        Remove the journals older than max_age.
+        """
+        if not os.path.isdir(self.root):
+            return
+        now = time.time()
+        for name in os.listdir(self.root):
+            path = os.path.join(self.root, name)
+            try:
+                if now - os.path.getmtime(path) > self.max_age:
+                    os.remove(path)
+            except OSError:
+                pass
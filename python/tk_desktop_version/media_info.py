@@ -0,0 +1,141 @@
+# -*- coding: utf-8 -*-
+# Copyright (c) 2015 Shotgun Software Inc.
+#
+# CONFIDENTIAL AND PROPRIETARY
+#
+# This work is provided "AS IS" and subject to the Shotgun Pipeline Toolkit
+# Source Code License included in this distribution package. See LICENSE.
+# By accessing, using, copying or modifying this work you indicate your
+# agreement to the Shotgun Pipeline Toolkit Source Code License. All rights
+# not expressly granted therein are reserved by Shotgun Software Inc.
+
+"""
+Cache of the metadata of the movies read while transcoding, probed with
+ffprobe once per file version.
+"""
+import os
+import json
+import subprocess
+
+from .util import Threaded
+from .rez_env import rez_command
+
+
+class MediaInfoCache(Threaded):
+    """
+    Frame count, codec, resolution and frame rate of movie files, keyed by
+    path, modification time and size so a file written again is probed
+    again.
+    """
+
+    def __init__(self):
+        """
+        Construction
+        """
+        Threaded.__init__(self)
+        self._media_info = {}
+
+    def get(self, path, processes=None):
+        """
+        Return the metadata of a movie, probing it if it wasn't yet.
+
+        :param path:        Path to the movie
+        :param processes:   Optional ProcessGroup ffprobe is run in
+        :returns:           Dictionary with the "frames", "codec", "width",
+                            "height" and "fps" of the first video stream.
+                            The frames are computed from the duration, or
+                            counted, when the container doesn't store them
+        """
+        key = self._key(path)
+        info = self._get_cached(key)
+        if info is None:
+            info = self._probe(path, processes)
+            self._set_cached(key, info)
+        return dict(info)
+
+    def clear(self):
+        """
+        Forget every probed movie, e.g. when the user refreshes the dialog.
+        """
+        self._clear()
+
+    def _probe(self, path, processes):
+        """
+        :returns: The metadata of a movie, read with ffprobe
+        """
+        result = _ffprobe(path, processes,
+                          ["-show_entries",
+                           "stream=nb_frames,codec_name,width,height,r_frame_rate,duration"
+                           ":format=duration"])
+        stream = (result.get("streams") or [{}])[0]
+        fps = None
+        if stream.get("r_frame_rate"):
+            num, _, den = stream["r_frame_rate"].partition("/")
+            if float(den or 1):
+                fps = float(num) / float(den or 1)
+
+        # webm, mkv and some movs don't store the frame count
+        frames = _number(stream.get("nb_frames"), int)
+        if frames is None:
+            duration = (_number(stream.get("duration"), float) or
+                        _number(result.get("format", {}).get("duration"), float))
+            if duration and fps:
+                frames = int(round(duration * fps))
+        if frames is None:
+            counted = _ffprobe(path, processes,
+                               ["-count_frames", "-show_entries", "stream=nb_read_frames"])
+            frames = _number((counted.get("streams") or [{}])[0].get("nb_read_frames"), int)
+        return {
+            "frames": frames,
+            "codec": stream.get("codec_name"),
+            "width": stream.get("width"),
+            "height": stream.get("height"),
+            "fps": fps,
+        }
+
+    def _key(self, path):
+        """
+        :returns: The cache key of a file version
+        """
+        stat = os.stat(path)
+        return (os.path.abspath(path), stat.st_mtime, stat.st_size)
+
+    @Threaded.exclusive
+    def _get_cached(self, key):
+        return self._media_info.get(key)
+
+    @Threaded.exclusive
+    def _set_cached(self, key, info):
+        self._media_info[key] = info
+
+    @Threaded.exclusive
+    def _clear(self):
+        self._media_info = {}
+
+
+def _ffprobe(path, processes, arguments):
+    """
+    :returns: The json output of ffprobe on the first video stream of a movie
+    """
+    command = rez_command(["ffmpeg"], ["ffprobe"], processes)
+    command.append(path)
+    command.extend(["-select_streams", "v:0"] + arguments + ["-of", "json", "-v", "quiet"])
+    if processes:
+        output = processes.check_output(command)
+    else:
+        output = subprocess.check_output(command)
+    return json.loads(output.decode("utf-8"))
+
+
+def _number(value, cast):
+    """
+    :returns: A value reported by ffprobe, or None if it's missing or N/A
+    """
+    try:
+        return cast(value)
+    except (TypeError, ValueError):
+        return None
+
+
+# single global instance of the media info cache
+g_media_info = MediaInfoCache()
@@ -0,0 +1,92 @@
+# -*- coding: utf-8 -*-
+# Copyright (c) 2015 Shotgun Software Inc.
+#
+# CONFIDENTIAL AND PROPRIETARY
+#
+# This work is provided "AS IS" and subject to the Shotgun Pipeline Toolkit
+# Source Code License included in this distribution package. See LICENSE.
+# By accessing, using, copying or modifying this work you indicate your
+# agreement to the Shotgun Pipeline Toolkit Source Code License. All rights
+# not expressly granted therein are reserved by Shotgun Software Inc.
+
+"""
+Render server running inside a long-lived Nuke process started by the
+NukeRenderService. It is not imported by the app: Nuke runs it as a script.
+
+It listens on a local socket and runs the render scripts written by
+Transcoding, one per connection. Requests and replies are single json lines:
+
+    {"token": "...", "script": "/path/to/script.py"}
+    {"ok": true, "recycle": false}
+
+The server exits after NUKE_RENDER_SERVER_MAX_JOBS jobs so the service starts
+a fresh Nuke.
+"""
+import os
+import sys
+import json
+import socket
+import traceback
+
+import nuke
+
+# line printed on stdout once the server listens, followed by its port
+READY_TAG = "NUKE_RENDER_SERVER_PORT"
+
+
+def run_script(path):
+    """
+    Run a render script in a clean Nuke session.
+
+    :param path: Path to the script to run
+    """
+    try:
+        with open(path) as f:
+            code = compile(f.read(), path, "exec")
+        try:
+            exec(code, {"__name__": "__main__", "__file__": path})
+        except SystemExit:
+            # the scripts exit() when they are done
+            pass
+    finally:
+        nuke.scriptClear()
+
+
+def main():
+    token = os.environ.get("NUKE_RENDER_SERVER_TOKEN", "")
+    max_jobs = int(os.environ.get("NUKE_RENDER_SERVER_MAX_JOBS", "0"))
+
+    server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    server.bind(("127.0.0.1", 0))
+    server.listen(1)
+    print("%s %d" % (READY_TAG, server.getsockname()[1]))
+    sys.stdout.flush()
+
+    jobs = 0
+    while not max_jobs or jobs < max_jobs:
+        conn, _ = server.accept()
+        stream = conn.makefile("rw")
+        try:
+            request = json.loads(stream.readline())
+            if request.get("token") != token:
+                continue
+            if request.get("quit"):
+                break
+            jobs += 1
+            reply = {"ok": True}
+            try:
+                run_script(request["script"])
+            except Exception:
+                reply = {"ok": False, "error": traceback.format_exc()}
+            reply["recycle"] = bool(max_jobs and jobs >= max_jobs)
+            stream.write(json.dumps(reply) + "\n")
+            stream.flush()
+        finally:
+            stream.close()
+            conn.close()
+
+    server.close()
+
+
+main()
+exit()
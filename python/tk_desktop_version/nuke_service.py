@@ -0,0 +1,253 @@
+# -*- coding: utf-8 -*-
+# Copyright (c) 2015 Shotgun Software Inc.
+#
+# CONFIDENTIAL AND PROPRIETARY
+#
+# This work is provided "AS IS" and subject to the Shotgun Pipeline Toolkit
+# Source Code License included in this distribution package. See LICENSE.
+# By accessing, using, copying or modifying this work you indicate your
+# agreement to the Shotgun Pipeline Toolkit Source Code License. All rights
+# not expressly granted therein are reserved by Shotgun Software Inc.
+
+"""
+Pool of warm Nuke processes, one set per rez environment (Nuke version and
+OCIO config package), running the render scripts written by Transcoding
+without paying for the rez resolve and Nuke startup of every render.
+"""
+import os
+import sys
+import json
+import time
+import uuid
+import socket
+import threading
+import subprocess
+
+from .process import ProcessError, new_process_group_kwargs, kill_process_tree
+from .rez_env import rez_command
+
+# the script run by the Nuke workers
+SERVER_SCRIPT = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                             "nuke_render_server.py")
+
+# must match nuke_render_server.READY_TAG, which can't be imported outside Nuke
+READY_TAG = "NUKE_RENDER_SERVER_PORT"
+
+
+class NukeWorker(object):
+    """
+    A single Nuke process running the render server.
+    """
+
+    def __init__(self, packages, max_jobs):
+        """
+        Construction
+
+        :param packages:    The rez packages of the Nuke environment,
+                            e.g. ['nuke-12.2.2', 'ocio_config']
+        :param max_jobs:    Number of renders after which the Nuke process
+                            exits, 0 to never recycle it
+        """
+        self.packages = list(packages)
+        self.max_jobs = max_jobs
+        self.port = None
+        self.retired = False
+        self.process = None
+        self._token = uuid.uuid4().hex
+        self._ready = threading.Event()
+
+    @property
+    def alive(self):
+        """
+        :returns: True if the worker can accept render jobs
+        """
+        return (self.process is not None and self.process.poll() is None
+                and not self.retired)
+
+    def start(self, timeout, check_cancelled=None):
+        """
+        Start the Nuke process and wait for its server to listen.
+
+        :param timeout:         Seconds to wait for Nuke to start
+        :param check_cancelled: Optional callable raising an exception if the
+                                work was cancelled while waiting
+        """
+        env = dict(os.environ)
+        env["NUKE_RENDER_SERVER_TOKEN"] = self._token
+        env["NUKE_RENDER_SERVER_MAX_JOBS"] = str(self.max_jobs)
+        command = rez_command(self.packages, ['nuke', '-ix', SERVER_SCRIPT])
+        kwargs = new_process_group_kwargs()
+        self.process = subprocess.Popen(command, stdout=subprocess.PIPE,
+                                        stderr=subprocess.STDOUT, env=env, **kwargs)
+        thread = threading.Thread(target=self._read_output, name="nuke worker output")
+        thread.daemon = True
+        thread.start()
+
+        deadline = time.time() + timeout
+        try:
+            while not self._ready.wait(0.5):
+                if check_cancelled:
+                    check_cancelled()
+                if time.time() > deadline:
+                    raise ProcessError("nuke render service didn't start in %ds" % timeout)
+            if self.port is None:
+                returncode = self.process.wait()
+                raise ProcessError("nuke render service exited with code %s"
+                                   % returncode, returncode)
+        except Exception:
+            self.kill()
+            raise
+
+    def render(self, script, check_cancelled=None):
+        """
+        Run a render script and wait for it to finish.
+
+        :param script:          Path to the render script
+        :param check_cancelled: Optional callable raising an exception if the
+                                work was cancelled, in which case the Nuke
+                                process is killed
+        """
+        request = json.dumps({"token": self._token, "script": script}) + "\n"
+        sock = socket.create_connection(("127.0.0.1", self.port))
+        try:
+            sock.sendall(request.encode("utf-8"))
+            sock.settimeout(0.5)
+            data = b""
+            while not data.endswith(b"\n"):
+                try:
+                    if check_cancelled:
+                        check_cancelled()
+                except Exception:
+                    self.kill()
+                    raise
+                try:
+                    chunk = sock.recv(4096)
+                except socket.timeout:
+                    continue
+                if not chunk:
+                    self.retired = True
+                    raise ProcessError("nuke render service exited while rendering %s"
+                                       % script, self.process.poll())
+                data += chunk
+        finally:
+            sock.close()
+
+        reply = json.loads(data.decode("utf-8"))
+        if reply.get("recycle"):
+            self.retired = True
+        if not reply.get("ok"):
+            # the equivalent of a Nuke exiting with an error
+            raise ProcessError(reply.get("error"), 1)
+
+    def kill(self):
+        """
+        Kill the Nuke process.
+        """
+        self.retired = True
+        if self.process:
+            kill_process_tree(self.process)
+
+    def _read_output(self):
+        """
+        Forward the Nuke output to ours, catching the port the server
+        listens on. Running until Nuke exits also keeps its stdout pipe from
+        filling up.
+        """
+        for line in iter(self.process.stdout.readline, b""):
+            text = line.decode("utf-8", "replace")
+            if self.port is None and text.startswith(READY_TAG):
+                self.port = int(text.split()[1])
+                self._ready.set()
+            else:
+                sys.stdout.write(text)
+        self._ready.set()
+
+
+class NukeRenderService(object):
+    """
+    Keeps idle NukeWorkers per rez environment and hands them render jobs,
+    starting new workers when all of them are busy.
+    """
+
+    def __init__(self, max_jobs=20, startup_timeout=300):
+        """
+        Construction
+
+        :param max_jobs:        Number of renders after which a worker is
+                                recycled, 0 to never recycle them
+        :param startup_timeout: Seconds to wait for a worker to start
+        """
+        self.max_jobs = max_jobs
+        self.startup_timeout = startup_timeout
+        self._lock = threading.Lock()
+        self._idle_workers = {}
+        self._workers = set()
+
+    def render(self, packages, script, check_cancelled=None):
+        """
+        Run a render script in a warm Nuke of the given environment.
+
+        :param packages:        The rez packages of the Nuke environment
+        :param script:          Path to the render script
+        :param check_cancelled: Optional callable raising an exception if the
+                                work was cancelled
+        """
+        worker = self._acquire(packages, check_cancelled)
+        try:
+            worker.render(script, check_cancelled)
+        finally:
+            self._release(worker)
+
+    def shut_down(self):
+        """
+        Kill every worker.
+        """
+        self._lock.acquire()
+        try:
+            workers = list(self._workers)
+            self._workers = set()
+            self._idle_workers = {}
+        finally:
+            self._lock.release()
+        for worker in workers:
+            worker.kill()
+
+    def _acquire(self, packages, check_cancelled):
+        """
+        :returns: An idle worker for the environment, started if needed
+        """
+        key = tuple(packages)
+        self._lock.acquire()
+        try:
+            idle = self._idle_workers.get(key, [])
+            while idle:
+                worker = idle.pop()
+                if worker.alive:
+                    return worker
+                self._workers.discard(worker)
+        finally:
+            self._lock.release()
+
+        # starting Nuke takes a while, don't hold the lock
+        worker = NukeWorker(packages, self.max_jobs)
+        worker.start(self.startup_timeout, check_cancelled)
+        self._lock.acquire()
+        try:
+            self._workers.add(worker)
+        finally:
+            self._lock.release()
+        return worker
+
+    def _release(self, worker):
+        """
+        Make a worker available again, or get rid of it if it was retired.
+        """
+        self._lock.acquire()
+        try:
+            if worker.alive and worker in self._workers:
+                self._idle_workers.setdefault(tuple(worker.packages), []).append(worker)
+                return
+            self._workers.discard(worker)
+        finally:
+            self._lock.release()
+        worker.kill()
@@ -0,0 +1,105 @@
+# -*- coding: utf-8 -*-
+# Copyright (c) 2015 Shotgun Software Inc.
+#
+# CONFIDENTIAL AND PROPRIETARY
+#
+# This work is provided "AS IS" and subject to the Shotgun Pipeline Toolkit
+# Source Code License included in this distribution package. See LICENSE.
+# By accessing, using, copying or modifying this work you indicate your
+# agreement to the Shotgun Pipeline Toolkit Source Code License. All rights
+# not expressly granted therein are reserved by Shotgun Software Inc.
+
+"""
+Latest plate of the shots of an upload batch, fetched for every shot of the
+batch with a single query.
+"""
+import copy
+
+from .util import Threaded
+
+
+class PlateColorspaces(Threaded):
+    """
+    Latest Plate PublishedFile, with its sg_colorspace, of each shot of an
+    upload batch. The first lookup fetches the plates of every candidate
+    shot of the batch.
+    """
+
+    def __init__(self):
+        """
+        Construction
+        """
+        Threaded.__init__(self)
+        self._candidates = set()
+        # latest plate of each looked up shot id, None if it has none
+        self._plates = {}
+
+    def add_candidates(self, entities):
+        """
+        Add shots whose plate may be looked up, so they're fetched with the
+        first lookup.
+
+        :param entities: List of entity dictionaries, only shots are kept
+        """
+        self._add_candidates([
+            entity["id"] for entity in entities
+            if entity and entity.get("type") == "Shot"
+        ])
+
+    def get(self, sg, shot, plate_type):
+        """
+        Return the latest plate of a shot. The query runs outside of the
+        lock, so the lookups of other threads don't wait for it.
+
+        :param sg:          The Shotgun connection queried on a miss
+        :param shot:        The shot entity dictionary
+        :param plate_type:  The Plate PublishedFileType entity dictionary
+        :returns:           A copy of the PublishedFile dictionary, with its
+                            sg_colorspace, or None if the shot has no plate
+        """
+        found, plate = self._get(shot["id"])
+        if found:
+            return plate
+        shot_ids = self._take_candidates(shot["id"])
+        try:
+            published_files = sg.find(
+                "PublishedFile",
+                [["entity", "in", [{"type": "Shot", "id": shot_id} for shot_id in sorted(shot_ids)]],
+                 ["published_file_type", "is", plate_type]],
+                ["sg_colorspace", "entity"],
+                order=[{"field_name": "id", "direction": "asc"}])
+        except Exception:
+            # the other shots are fetched by the next lookup
+            self._add_candidates(shot_ids - set([shot["id"]]))
+            raise
+        self._set_plates(shot_ids, published_files)
+        return self._get(shot["id"])[1]
+
+    @Threaded.exclusive
+    def _get(self, shot_id):
+        if shot_id not in self._plates:
+            return False, None
+        return True, copy.deepcopy(self._plates[shot_id])
+
+    @Threaded.exclusive
+    def _take_candidates(self, shot_id):
+        shot_ids = set(self._candidates) | set([shot_id])
+        shot_ids.difference_update(self._plates)
+        self._candidates.difference_update(shot_ids)
+        return shot_ids
+
+    @Threaded.exclusive
+    def _set_plates(self, shot_ids, published_files):
+        plates = dict((shot_id, None) for shot_id in shot_ids)
+        for published_file in published_files:
+            # the last one of each shot wins, as with a find per shot
+            plates[published_file["entity"]["id"]] = {
+                "type": published_file["type"],
+                "id": published_file["id"],
+                "sg_colorspace": published_file.get("sg_colorspace"),
+            }
+        self._plates.update(plates)
+
+    @Threaded.exclusive
+    def _add_candidates(self, shot_ids):
+        self._candidates.update(shot_ids)
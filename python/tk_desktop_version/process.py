@@ -0,0 +1,277 @@
+# -*- coding: utf-8 -*-
+# Copyright (c) 2015 Shotgun Software Inc.
+#
+# CONFIDENTIAL AND PROPRIETARY
+#
+# This work is provided "AS IS" and subject to the Shotgun Pipeline Toolkit
+# Source Code License included in this distribution package. See LICENSE.
+# By accessing, using, copying or modifying this work you indicate your
+# agreement to the Shotgun Pipeline Toolkit Source Code License. All rights
+# not expressly granted therein are reserved by Shotgun Software Inc.
+
+"""
+Cancellable execution of the external processes (rez-env, nuke, ffmpeg...)
+spawned while transcoding.
+"""
+import os
+import errno
+import signal
+import platform
+import subprocess
+import threading
+import time
+
+
+class CancelledError(Exception):
+    """
+    Raised when work is interrupted because its job was cancelled.
+    """
+
+
+class ProcessError(Exception):
+    """
+    Raised when a child process, or a render of the Nuke render service,
+    failed. Keeps the return code of the process, so the stages wrapping the
+    error in their own message can still be retried.
+    """
+
+    def __init__(self, message, returncode=None):
+        """
+        Construction
+
+        :param message:     Description of the failure
+        :param returncode:  Return code of the process, None if unknown
+        """
+        Exception.__init__(self, message)
+        self.returncode = returncode
+
+
+def stage_error(message, error):
+    """
+    Build the exception a stage raises when its work failed.
+
+    :param message: Description of the failed work
+    :param error:   The exception the work failed with
+    :returns:       A ProcessError keeping the return code if the error comes
+                    from a child process, the error itself if the job was
+                    cancelled, an Exception otherwise
+    """
+    if isinstance(error, CancelledError):
+        return error
+    if isinstance(error, (ProcessError, subprocess.CalledProcessError)):
+        return ProcessError("{0} {1}".format(message, error), error.returncode)
+    return Exception("{0} {1}".format(message, error))
+
+
+class ProcessGroup(object):
+    """
+    Keeps track of every child process spawned for a single upload job so that
+    the whole process tree can be killed when the job is cancelled.
+
+    Each child is started as the leader of its own process group (session on
+    Linux, process group on Windows) so that killing it also kills whatever
+    rez-env spawned underneath it.
+    """
+
+    # seconds to wait after SIGTERM before sending SIGKILL
+    kill_timeout = 5.0
+
+    def __init__(self):
+        """
+        Construction
+        """
+        self._lock = threading.Lock()
+        self._processes = set()
+        self._cancelled = False
+
+    @property
+    def cancelled(self):
+        """
+        :returns: True if cancel() has been called on this group
+        """
+        return self._cancelled
+
+    def check_cancelled(self):
+        """
+        Raise a CancelledError if the group was cancelled.
+        """
+        if self._cancelled:
+            raise CancelledError("Cancelled")
+
+    def popen(self, command, **kwargs):
+        """
+        Start a child process registered with this group.
+
+        :param command: The command to run as a list of arguments
+        :param kwargs:  Extra keyword arguments passed to subprocess.Popen
+        :returns:       The subprocess.Popen instance
+        """
+        for key, value in new_process_group_kwargs().items():
+            kwargs.setdefault(key, value)
+
+        self._lock.acquire()
+        try:
+            self.check_cancelled()
+            process = subprocess.Popen(command, **kwargs)
+            self._processes.add(process)
+        finally:
+            self._lock.release()
+        return process
+
+    def wait(self, process, input=None):
+        """
+        Wait for a process started with popen() to finish.
+
+        :param process: The subprocess.Popen instance to wait for
+        :param input:   Optional data sent to the process stdin
+        :returns:       The (stdout, stderr) tuple returned by communicate()
+        """
+        try:
+            output = process.communicate(input)
+        finally:
+            self._lock.acquire()
+            try:
+                self._processes.discard(process)
+            finally:
+                self._lock.release()
+        self.check_cancelled()
+        return output
+
+    def check_call(self, command, **kwargs):
+        """
+        Cancellable equivalent of subprocess.check_call
+
+        :param command: The command to run as a list of arguments
+        :param kwargs:  Extra keyword arguments passed to subprocess.Popen
+        :raises:        CancelledError if the group was cancelled while running,
+                        subprocess.CalledProcessError if the command failed.
+        """
+        process = self.popen(command, **kwargs)
+        self.wait(process)
+        if process.returncode:
+            raise subprocess.CalledProcessError(process.returncode, command)
+        return 0
+
+    def check_output(self, command, **kwargs):
+        """
+        Cancellable equivalent of subprocess.check_output
+
+        :param command: The command to run as a list of arguments
+        :param kwargs:  Extra keyword arguments passed to subprocess.Popen
+        :returns:       The command stdout
+        """
+        kwargs["stdout"] = subprocess.PIPE
+        process = self.popen(command, **kwargs)
+        output, _ = self.wait(process)
+        if process.returncode:
+            raise subprocess.CalledProcessError(process.returncode, command)
+        return output
+
+    def cancel(self):
+        """
+        Cancel the group: kill every running child process tree and refuse
+        to start any new one.
+        """
+        self._lock.acquire()
+        try:
+            self._cancelled = True
+            processes = list(self._processes)
+        finally:
+            self._lock.release()
+
+        for process in processes:
+            kill_process_tree(process, self.kill_timeout)
+
+
+def _is_windows():
+    """
+    :returns: True if running on Windows
+    """
+    return platform.system() in ("Windows", "Microsoft")
+
+
+def pid_is_alive(pid):
+    """
+    :returns: True if a process with the given pid is running
+    """
+    if pid == os.getpid():
+        return True
+    if _is_windows():
+        return _windows_pid_is_alive(pid)
+    if os.name != "posix":
+        return True
+    try:
+        os.kill(pid, 0)
+    except OSError as e:
+        return e.errno == errno.EPERM
+    return True
+
+
+def _windows_pid_is_alive(pid):
+    """
+    :returns: True if a process with the given pid is running, on Windows
+    """
+    import ctypes
+    from ctypes import wintypes
+
+    PROCESS_QUERY_LIMITED_INFORMATION = 0x1000
+    ERROR_ACCESS_DENIED = 5
+    STILL_ACTIVE = 259
+
+    kernel32 = ctypes.WinDLL("kernel32", use_last_error=True)
+    kernel32.OpenProcess.restype = wintypes.HANDLE
+    kernel32.OpenProcess.argtypes = (wintypes.DWORD, wintypes.BOOL, wintypes.DWORD)
+    kernel32.GetExitCodeProcess.argtypes = (wintypes.HANDLE, ctypes.POINTER(wintypes.DWORD))
+    kernel32.CloseHandle.argtypes = (wintypes.HANDLE,)
+
+    handle = kernel32.OpenProcess(PROCESS_QUERY_LIMITED_INFORMATION, False, pid)
+    if not handle:
+        # the process exists but belongs to another user
+        return ctypes.get_last_error() == ERROR_ACCESS_DENIED
+    try:
+        exit_code = wintypes.DWORD()
+        if not kernel32.GetExitCodeProcess(handle, ctypes.byref(exit_code)):
+            return True
+        return exit_code.value == STILL_ACTIVE
+    finally:
+        kernel32.CloseHandle(handle)
+
+
+def new_process_group_kwargs():
+    """
+    :returns: The subprocess.Popen keyword arguments starting the child as
+              the leader of a new process group
+    """
+    if _is_windows():
+        return {"creationflags": subprocess.CREATE_NEW_PROCESS_GROUP}
+    return {"preexec_fn": os.setsid}
+
+
+def kill_process_tree(process, timeout=5.0):
+    """
+    Kill a process started as a process group leader and all its children.
+
+    :param process: The subprocess.Popen instance to kill
+    :param timeout: Seconds to wait for a graceful exit before killing it
+    """
+    if process.poll() is not None:
+        return
+
+    if _is_windows():
+        subprocess.call(["taskkill", "/F", "/T", "/PID", str(process.pid)])
+        return
+
+    try:
+        os.killpg(process.pid, signal.SIGTERM)
+    except OSError:
+        return
+
+    deadline = time.time() + timeout
+    while process.poll() is None and time.time() < deadline:
+        time.sleep(0.1)
+
+    if process.poll() is None:
+        try:
+            os.killpg(process.pid, signal.SIGKILL)
+        except OSError:
+            pass
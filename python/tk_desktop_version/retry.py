@@ -0,0 +1,163 @@
+# -*- coding: utf-8 -*-
+# Copyright (c) 2015 Shotgun Software Inc.
+#
+# CONFIDENTIAL AND PROPRIETARY
+#
+# This work is provided "AS IS" and subject to the Shotgun Pipeline Toolkit
+# Source Code License included in this distribution package. See LICENSE.
+# By accessing, using, copying or modifying this work you indicate your
+# agreement to the Shotgun Pipeline Toolkit Source Code License. All rights
+# not expressly granted therein are reserved by Shotgun Software Inc.
+
+"""
+Retry policy of the stages of the upload jobs: transient Shotgun and network
+errors are retried with an exponential backoff, and crashed child processes
+are run again once.
+"""
+import ssl
+import time
+import socket
+import subprocess
+
+try:
+    import http.client as httplib
+    import urllib.error as urlerror
+except ImportError:
+    import httplib
+    import urllib2 as urlerror
+
+import sgtk
+from tank_vendor import shotgun_api3
+
+from .process import CancelledError, ProcessError
+
+logger = sgtk.platform.get_logger(__name__)
+
+# errors of requests which may succeed if they're sent again
+TRANSIENT_ERRORS = (
+    shotgun_api3.ProtocolError,
+    socket.timeout,
+    socket.gaierror,
+    ssl.SSLError,
+    httplib.HTTPException,
+    urlerror.URLError,
+)
+try:
+    TRANSIENT_ERRORS += (ConnectionError,)
+except NameError:
+    # python 2, connection errors are socket.error
+    TRANSIENT_ERRORS += (socket.error,)
+
+
+def _causes(error):
+    """
+    :returns: A generator of an exception and the exceptions it was raised
+              from on Python 3, where they are chained
+    """
+    seen = set()
+    while error is not None and id(error) not in seen:
+        seen.add(id(error))
+        yield error
+        error = getattr(error, "__cause__", None) or getattr(error, "__context__", None)
+
+
+def is_transient(error):
+    """
+    :returns: True if an exception is a transient Shotgun or network error
+    """
+    for cause in _causes(error):
+        if isinstance(cause, urlerror.HTTPError) and cause.code < 500:
+            # the request itself was refused, sending it again won't help
+            return False
+        if isinstance(cause, TRANSIENT_ERRORS):
+            return True
+    return False
+
+
+def is_process_crash(error):
+    """
+    :returns: True if an exception comes from a child process which failed
+    """
+    # the stages wrap the errors of their processes in a ProcessError, which
+    # keeps the return code on Python 2 too, where exceptions aren't chained
+    return any(isinstance(cause, (ProcessError, subprocess.CalledProcessError))
+               for cause in _causes(error))
+
+
+class RetryPolicy(object):
+    """
+    Number of attempts and delays between them of a stage, depending on the
+    error it failed with.
+    """
+
+    # seconds between two checks for cancellation while waiting
+    poll_interval = 0.5
+
+    def __init__(self, retries=3, backoff=2.0, max_delay=60.0, process_retries=1):
+        """
+        Construction
+
+        :param retries:         Number of times a stage failing with a
+                                transient error is retried
+        :param backoff:         Seconds before the first retry, doubled for
+                                every following one
+        :param max_delay:       Maximum number of seconds between two attempts
+        :param process_retries: Number of times a stage whose child process
+                                failed is retried
+        """
+        self.retries = retries
+        self.backoff = backoff
+        self.max_delay = max_delay
+        self.process_retries = process_retries
+
+    def call(self, name, func, args=None, kwargs=None, check_cancelled=None):
+        """
+        Call a function, retrying it as long as the policy allows.
+
+        :param name:            Name of the work, for logging
+        :param func:            The callable to call
+        :param args:            Positional arguments for func
+        :param kwargs:          Keyword arguments for func
+        :param check_cancelled: Optional callable raising an exception if the
+                                work was cancelled while waiting
+        :returns:               The result of func
+        :raises:                The last error if every attempt failed
+        """
+        attempt = 0
+        while True:
+            try:
+                return func(*(args or []), **(kwargs or {}))
+            except CancelledError:
+                raise
+            except Exception as e:
+                if check_cancelled:
+                    check_cancelled()
+                attempt += 1
+                if attempt > self._retries_for(e):
+                    raise
+                delay = 0
+                if is_transient(e):
+                    delay = min(self.backoff * 2 ** (attempt - 1), self.max_delay)
+                logger.warning("%s failed, retrying in %.1fs (%d/%d): %s"
+                               % (name, delay, attempt, self._retries_for(e), e))
+                self._wait(delay, check_cancelled)
+
+    def _retries_for(self, error):
+        """
+        :returns: The number of retries allowed for an error
+        """
+        if is_transient(error):
+            return self.retries
+        if is_process_crash(error):
+            return self.process_retries
+        return 0
+
+    def _wait(self, delay, check_cancelled):
+        """
+        Sleep, checking for cancellation.
+        """
+        end = time.time() + delay
+        while time.time() < end:
+            if check_cancelled:
+                check_cancelled()
+            time.sleep(min(self.poll_interval, max(0, end - time.time())))
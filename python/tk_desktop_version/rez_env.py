@@ -0,0 +1,225 @@
+# -*- coding: utf-8 -*-
+# Copyright (c) 2015 Shotgun Software Inc.
+#
+# CONFIDENTIAL AND PROPRIETARY
+#
+# This work is provided "AS IS" and subject to the Shotgun Pipeline Toolkit
+# Source Code License included in this distribution package. See LICENSE.
+# By accessing, using, copying or modifying this work you indicate your
+# agreement to the Shotgun Pipeline Toolkit Source Code License. All rights
+# not expressly granted therein are reserved by Shotgun Software Inc.
+
+"""
+Cache of resolved rez contexts, so that the external commands run while
+transcoding don't pay for a full package resolve every time.
+"""
+import os
+import getpass
+import hashlib
+import tempfile
+import threading
+import subprocess
+
+import sgtk
+
+from .util import Threaded
+from .process import CancelledError
+
+logger = sgtk.platform.get_logger(__name__)
+
+
+class RezContextCache(Threaded):
+    """
+    Resolved contexts saved with `rez-env <packages> --output <file>` and
+    reused with `rez-env --input <file>`, which skips the resolve.
+
+    Contexts are keyed by the package request and by the modification times
+    of the package families in the package repositories, of their versions
+    and of their package definitions, so a new release of a requested
+    package, or an edit of a released one, invalidates the saved context.
+    """
+
+    def __init__(self, cache_dir=None):
+        """
+        Construction
+
+        :param cache_dir: Folder the contexts are saved to
+        """
+        Threaded.__init__(self)
+        self.enabled = True
+        self.cache_dir = cache_dir or os.path.join(
+            tempfile.gettempdir(), "tk_desktop_version_rez_%s" % getpass.getuser())
+        self._packages_paths = None
+        self._key_locks = {}
+
+    def command(self, packages, command, processes=None):
+        """
+        Build the command running a program in a rez environment.
+
+        :param packages:    List of rez package requests, e.g. ['ffmpeg']
+        :param command:     The command to run in the environment
+        :param processes:   Optional ProcessGroup the resolve runs in
+        :returns:           The full command as a list of arguments
+        """
+        if self.enabled:
+            context_file = self.context_file(packages, processes)
+            if context_file:
+                return ['rez-env', '--input', context_file, '--'] + list(command)
+        return ['rez-env'] + list(packages) + ['--'] + list(command)
+
+    def context_file(self, packages, processes=None):
+        """
+        Return a saved context for a package request, resolving and saving it
+        if there is no valid one yet.
+
+        :param packages:    List of rez package requests
+        :param processes:   Optional ProcessGroup the resolve runs in, so it
+                            is killed if its job is cancelled
+        :returns:           Path to the saved context, or None if the request
+                            couldn't be resolved
+        """
+        key = self._key(packages)
+        path = os.path.join(self.cache_dir, key + ".rxt")
+        lock = self._get_key_lock(key)
+        lock.acquire()
+        try:
+            if os.path.exists(path):
+                return path
+            return self._resolve(packages, path, processes)
+        finally:
+            lock.release()
+
+    def _resolve(self, packages, path, processes=None):
+        """
+        Resolve a package request and save the context.
+
+        :returns: The path to the saved context, or None if it failed
+        :raises:  CancelledError if the job of the ProcessGroup was cancelled
+        """
+        if not os.path.exists(self.cache_dir):
+            os.makedirs(self.cache_dir)
+        tmp_path = "%s.%d.%s" % (path, os.getpid(), threading.current_thread().ident)
+        try:
+            command = ['rez-env'] + list(packages) + ['--output', tmp_path]
+            if processes:
+                processes.check_call(command)
+            else:
+                subprocess.check_call(command)
+            with open(tmp_path) as f:
+                # failed resolves are saved too
+                if '"solved"' not in f.read():
+                    raise Exception("failed resolve")
+            os.rename(tmp_path, path)
+        except CancelledError:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+        except Exception as e:
+            logger.warning("Can't cache rez context for %s: %s" % (" ".join(packages), e))
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            return None
+        return path
+
+    def _key(self, packages):
+        """
+        :returns: A key identifying a package request and the state of the
+                  package families it requests
+        """
+        items = list(packages)
+        for packages_path in self._get_packages_paths():
+            items.append(_mtime(packages_path))
+            for package in packages:
+                family = package.lstrip("~!").split("-")[0].split("==")[0]
+                items.extend(_family_state(os.path.join(packages_path, family)))
+        return hashlib.sha1("|".join(str(x) for x in items).encode("utf-8")).hexdigest()
+
+    def _get_packages_paths(self):
+        """
+        :returns: The package repository folders, from REZ_PACKAGES_PATH or
+                  from the rez configuration
+        """
+        if self._packages_paths is None:
+            paths = os.environ.get("REZ_PACKAGES_PATH")
+            if paths:
+                self._packages_paths = paths.split(os.pathsep)
+            else:
+                try:
+                    output = subprocess.check_output(['rez-config', 'packages_path'])
+                    self._packages_paths = [
+                        line.strip()[2:] for line in output.decode("utf-8").splitlines()
+                        if line.strip().startswith("- ")
+                    ]
+                except Exception:
+                    self._packages_paths = []
+        return self._packages_paths
+
+    @Threaded.exclusive
+    def _get_key_lock(self, key):
+        """
+        :returns: The lock serializing the resolves of a context
+        """
+        return self._key_locks.setdefault(key, threading.Lock())
+
+    def clear(self):
+        """
+        Forget the package repositories and remove the saved contexts, so
+        both are looked up and resolved again.
+        """
+        self._packages_paths = None
+        try:
+            names = os.listdir(self.cache_dir)
+        except OSError:
+            return
+        for name in names:
+            if name.endswith(".rxt"):
+                try:
+                    os.remove(os.path.join(self.cache_dir, name))
+                except OSError:
+                    pass
+
+
+def _family_state(path):
+    """
+    :returns: The modification times of a package family folder, of its
+              version folders and of their package definitions
+    """
+    items = [_mtime(path)]
+    try:
+        versions = sorted(os.listdir(path))
+    except OSError:
+        return items
+    for version in versions:
+        version_path = os.path.join(path, version)
+        items.append(version)
+        items.append(_mtime(version_path))
+        for definition in ("package.py", "package.yaml"):
+            items.append(_mtime(os.path.join(version_path, definition)))
+    return items
+
+
+def _mtime(path):
+    """
+    :returns: The modification time of a path, or 0 if it doesn't exist
+    """
+    try:
+        return os.stat(path).st_mtime
+    except OSError:
+        return 0
+
+
+# single global instance of the rez context cache
+g_rez_cache = RezContextCache()
+
+
+def rez_command(packages, command, processes=None):
+    """
+    Build the command running a program in a rez environment, reusing a
+    saved context when the cache is enabled.
+
+    :param packages:    List of rez package requests, e.g. ['ffmpeg']
+    :param command:     The command to run in the environment
+    :param processes:   Optional ProcessGroup the package resolve runs in
+    :returns:           The full command as a list of arguments
+    """
+    return g_rez_cache.command(packages, command, processes)
@@ -0,0 +1,105 @@
+# -*- coding: utf-8 -*-
+# Copyright (c) 2015 Shotgun Software Inc.
+#
+# CONFIDENTIAL AND PROPRIETARY
+#
+# This work is provided "AS IS" and subject to the Shotgun Pipeline Toolkit
+# Source Code License included in this distribution package. See LICENSE.
+# By accessing, using, copying or modifying this work you indicate your
+# agreement to the Shotgun Pipeline Toolkit Source Code License. All rights
+# not expressly granted therein are reserved by Shotgun Software Inc.
+
+"""
+Local scratch space for the intermediate files of the upload jobs (render
+scripts, movs for the webm, webms, thumbnails, render chunks...), so that only
+the media which must persist are written to shared storage.
+"""
+import os
+import shutil
+import getpass
+import tempfile
+
+import sgtk
+
+from .process import pid_is_alive
+
+logger = sgtk.platform.get_logger(__name__)
+
+
+class ScratchSpace(object):
+    """
+    A local folder holding one sub folder per running upload job. Job
+    folders are removed when the job ends, and folders left behind by dead
+    processes are removed the next time the scratch space is used.
+    """
+
+    def __init__(self, root=None, min_free_space=0):
+        """
+        Construction
+
+        :param root:            The scratch folder, a folder in the system
+                                temp folder if None
+        :param min_free_space:  Free space in MB below which the scratch
+                                space isn't used
+        """
+        self.root = root or os.path.join(
+            tempfile.gettempdir(), "tk_desktop_version_scratch_%s" % getpass.getuser())
+        self.min_free_space = min_free_space
+
+    def create(self):
+        """
+        Create the scratch folder of a job.
+
+        :returns: The path of the folder, or None if there isn't enough free
+                  space left, in which case the job writes its intermediate
+                  files to shared storage
+        """
+        try:
+            if not os.path.exists(self.root):
+                os.makedirs(self.root)
+            self.remove_stale()
+            free_space = _free_space(self.root)
+            if free_space < self.min_free_space:
+                logger.warning("Only %d MB free in %s, not using it as scratch space"
+                               % (free_space, self.root))
+                return None
+            return tempfile.mkdtemp(prefix="%d_" % os.getpid(), dir=self.root)
+        except (IOError, OSError) as e:
+            logger.warning("Can't create scratch folder in %s: %s" % (self.root, e))
+            return None
+
+    def remove(self, path):
+        """
+        Remove the scratch folder of a job and everything in it.
+
+        :param path: The path returned by create()
+        """
+        shutil.rmtree(path, ignore_errors=True)
+
+    def remove_stale(self):
+        """
+        Remove the job folders of processes which are not running anymore.
+        """
+        for name in os.listdir(self.root):
+            try:
+                pid = int(name.split("_")[0])
+            except ValueError:
+                continue
+            if not pid_is_alive(pid):
+                shutil.rmtree(os.path.join(self.root, name), ignore_errors=True)
+
+
+def _free_space(path):
+    """
+    :returns: The free space in MB of the file system of a path
+    """
+    if hasattr(os, "statvfs"):
+        stat = os.statvfs(path)
+        return stat.f_bavail * stat.f_frsize // (1024 * 1024)
+    # Windows, shutil.disk_usage only exists on python 3
+    import ctypes
+    free = ctypes.c_ulonglong(0)
+    if not ctypes.windll.kernel32.GetDiskFreeSpaceExW(
+            ctypes.c_wchar_p(path), ctypes.byref(free), None, None):
+        raise OSError("Can't read the free space of %s" % path)
+    return free.value // (1024 * 1024)
@@ -0,0 +1,104 @@
+# -*- coding: utf-8 -*-
+# Copyright (c) 2015 Shotgun Software Inc.
+#
+# CONFIDENTIAL AND PROPRIETARY
+#
+# This work is provided "AS IS" and subject to the Shotgun Pipeline Toolkit
+# Source Code License included in this distribution package. See LICENSE.
+# By accessing, using, copying or modifying this work you indicate your
+# agreement to the Shotgun Pipeline Toolkit Source Code License. All rights
+# not expressly granted therein are reserved by Shotgun Software Inc.
+
+"""
+Read-through cache of Shotgun records which rarely change, like the output
+settings of the projects, so that setting up a transcode doesn't query the
+site for them every time.
+"""
+import copy
+import json
+import time
+
+from .util import Threaded
+
+
+class ShotgunCache(Threaded):
+    """
+    Results of Shotgun queries, kept for ttl seconds and keyed by the query.
+    Every result is copied in and out, so callers can modify them.
+    """
+
+    def __init__(self, ttl=600):
+        """
+        Construction
+
+        :param ttl: Seconds a result is kept, 0 to disable the cache
+        """
+        Threaded.__init__(self)
+        self.ttl = ttl
+        self._results = {}
+
+    def find_one(self, sg, entity_type, filters, fields=None):
+        """
+        Cached equivalent of Shotgun.find_one.
+
+        :param sg:          The Shotgun connection queried on a miss
+        :param entity_type: The entity type to find
+        :param filters:     The query filters
+        :param fields:      The fields to return
+        :returns:           The entity dictionary, or None
+        """
+        return self._get(sg, "find_one", entity_type, filters, fields)
+
+    def find(self, sg, entity_type, filters, fields=None):
+        """
+        Cached equivalent of Shotgun.find.
+
+        :param sg:          The Shotgun connection queried on a miss
+        :param entity_type: The entity type to find
+        :param filters:     The query filters
+        :param fields:      The fields to return
+        :returns:           List of entity dictionaries
+        """
+        return self._get(sg, "find", entity_type, filters, fields)
+
+    def clear(self):
+        """
+        Forget every result, e.g. when the user refreshes the dialog.
+        """
+        self._clear()
+
+    def _get(self, sg, method, entity_type, filters, fields):
+        """
+        :returns: A copy of the cached result of a query, running it if it
+                  isn't cached or expired
+        """
+        if not self.ttl:
+            return getattr(sg, method)(entity_type, filters, fields)
+        key = json.dumps([method, entity_type, filters, fields], sort_keys=True, default=str)
+        cached = self._get_cached(key)
+        if cached is None:
+            result = getattr(sg, method)(entity_type, filters, fields)
+            self._set_cached(key, result)
+        else:
+            result = cached[0]
+        return copy.deepcopy(result)
+
+    @Threaded.exclusive
+    def _get_cached(self, key):
+        cached = self._results.get(key)
+        if cached is None or time.time() - cached[1] > self.ttl:
+            return None
+        # a cached None result isn't a miss
+        return cached
+
+    @Threaded.exclusive
+    def _set_cached(self, key, result):
+        self._results[key] = (copy.deepcopy(result), time.time())
+
+    @Threaded.exclusive
+    def _clear(self):
+        self._results = {}
+
+
+# single global instance of the Shotgun cache
+g_shotgun_cache = ShotgunCache()
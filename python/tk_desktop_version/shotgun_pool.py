@@ -0,0 +1,124 @@
+# -*- coding: utf-8 -*-
+# Copyright (c) 2015 Shotgun Software Inc.
+#
+# CONFIDENTIAL AND PROPRIETARY
+#
+# This work is provided "AS IS" and subject to the Shotgun Pipeline Toolkit
+# Source Code License included in this distribution package. See LICENSE.
+# By accessing, using, copying or modifying this work you indicate your
+# agreement to the Shotgun Pipeline Toolkit Source Code License. All rights
+# not expressly granted therein are reserved by Shotgun Software Inc.
+
+"""
+Pool of Shotgun API connections shared by the uploads of every job, so that
+media uploads, which are bound by the latency of the site, run in parallel
+over connections which are reused from one request to the next.
+"""
+import threading
+import contextlib
+
+import sgtk
+
+logger = sgtk.platform.get_logger(__name__)
+
+
+class ShotgunConnectionPool(object):
+    """
+    At most max_connections Shotgun connections, each used by a single thread
+    at a time. Idle connections are kept and handed to the next request.
+    """
+
+    # seconds between two checks for cancellation while waiting
+    poll_interval = 0.5
+
+    def __init__(self, max_connections=4):
+        """
+        Construction
+
+        :param max_connections: Maximum number of connections in use at the
+                                same time
+        """
+        self.max_connections = max(1, max_connections)
+        self._condition = threading.Condition()
+        self._idle = []
+        self._count = 0
+
+    @contextlib.contextmanager
+    def connection(self, check_cancelled=None):
+        """
+        Context manager blocking until a connection is available and holding
+        it until it exits.
+
+        :param check_cancelled: Optional callable raising an exception if the
+                                work was cancelled while waiting
+        """
+        sg = self._acquire(check_cancelled)
+        try:
+            yield sg
+        except Exception:
+            # the connection may be left in the middle of a request
+            self._discard(sg)
+            raise
+        else:
+            self._release(sg)
+
+    def clear(self):
+        """
+        Close the idle connections, new ones are created on demand.
+        """
+        with self._condition:
+            idle = self._idle
+            self._idle = []
+            self._count -= len(idle)
+            self._condition.notify_all()
+        for sg in idle:
+            _close(sg)
+
+    def _acquire(self, check_cancelled):
+        """
+        :returns: An idle connection, or a new one if there are fewer than
+                  max_connections
+        """
+        with self._condition:
+            while not self._idle and self._count >= self.max_connections:
+                if check_cancelled:
+                    check_cancelled()
+                self._condition.wait(self.poll_interval)
+            if self._idle:
+                return self._idle.pop()
+            self._count += 1
+        try:
+            return sgtk.util.shotgun.create_sg_connection()
+        except Exception:
+            self._discard()
+            raise
+
+    def _release(self, sg):
+        """
+        Put a connection back in the pool.
+        """
+        with self._condition:
+            self._idle.append(sg)
+            self._condition.notify()
+
+    def _discard(self, sg=None):
+        """
+        Close and forget a connection which won't be put back in the pool.
+
+        :param sg: The connection, None if it couldn't be created
+        """
+        if sg is not None:
+            _close(sg)
+        with self._condition:
+            self._count -= 1
+            self._condition.notify()
+
+
+def _close(sg):
+    """
+    Close the http connection of a Shotgun connection.
+    """
+    try:
+        sg.close()
+    except Exception as e:
+        logger.debug("Can't close Shotgun connection: %s" % e)
@@ -0,0 +1,191 @@
+# -*- coding: utf-8 -*-
+# Copyright (c) 2015 Shotgun Software Inc.
+#
+# CONFIDENTIAL AND PROPRIETARY
+#
+# This work is provided "AS IS" and subject to the Shotgun Pipeline Toolkit
+# Source Code License included in this distribution package. See LICENSE.
+# By accessing, using, copying or modifying this work you indicate your
+# agreement to the Shotgun Pipeline Toolkit Source Code License. All rights
+# not expressly granted therein are reserved by Shotgun Software Inc.
+
+"""
+Dependency graph of the stages of an upload job, executed by bounded pools of
+worker threads which start every stage as soon as the stages it requires are
+finished.
+"""
+import threading
+
+
+class Stage(object):
+    """
+    A single unit of work in a StageGraph.
+    """
+
+    def __init__(self, name, func, args=None, kwargs=None, requires=None, pool=None):
+        """
+        Construction
+
+        :param name:        Unique name of the stage in its graph
+        :param func:        Callable running the stage
+        :param args:        Positional arguments for func
+        :param kwargs:      Keyword arguments for func
+        :param requires:    Names of the stages which must be finished before
+                            this stage can start
+        :param pool:        Name of the worker pool running the stage, None
+                            for the default pool
+        """
+        self.name = name
+        self.func = func
+        self.args = args or []
+        self.kwargs = kwargs or {}
+        self.requires = list(requires or [])
+        self.pool = pool
+
+
+class StageGraph(object):
+    """
+    A set of stages and their dependencies.
+
+    Stages must be added after the stages they require, which guarantees the
+    graph has no cycle.
+    """
+
+    def __init__(self):
+        """
+        Construction
+        """
+        self._stages = []
+        self._stages_by_name = {}
+
+    @property
+    def stages(self):
+        """
+        :returns: The list of stages, in the order they were added
+        """
+        return list(self._stages)
+
+    def add(self, name, func, args=None, kwargs=None, requires=None, pool=None):
+        """
+        Add a stage to the graph.
+
+        :param name:        Unique name of the stage
+        :param func:        Callable running the stage
+        :param args:        Positional arguments for func
+        :param kwargs:      Keyword arguments for func
+        :param requires:    Names of the stages which must be finished before
+                            this stage can start
+        :param pool:        Name of the worker pool running the stage, None
+                            for the default pool
+        :returns:           The added Stage
+        :raises ValueError: If the name is already used or if a required stage
+                            is unknown
+        """
+        if name in self._stages_by_name:
+            raise ValueError("Stage %s is already in the graph" % name)
+        for required in requires or []:
+            if required not in self._stages_by_name:
+                raise ValueError("Stage %s requires unknown stage %s" % (name, required))
+        stage = Stage(name, func, args, kwargs, requires, pool)
+        self._stages.append(stage)
+        self._stages_by_name[name] = stage
+        return stage
+
+    def run(self, max_workers=1, on_start=None, on_finish=None, check_cancelled=None,
+            pool_workers=None):
+        """
+        Run every stage of the graph, at most max_workers at a time in the
+        default pool, and wait for all of them to finish. Stages of other
+        pools run alongside, each pool with its own limit, so stages bound by
+        different resources don't wait for each other's workers.
+
+        If a stage fails, no new stage is started and the first error is
+        re-raised once the running stages are finished.
+
+        :param max_workers:     Maximum number of stages of the default pool
+                                running at the same time
+        :param on_start:        Optional callable called with a Stage when it starts
+        :param on_finish:       Optional callable called with a Stage when it
+                                finished successfully
+        :param check_cancelled: Optional callable raising an exception if the
+                                work was cancelled, called before starting a stage
+        :param pool_workers:    Optional dictionary of pool name to maximum
+                                number of stages of the pool running at the
+                                same time, 1 for pools which aren't in it
+        """
+        limits = dict((pool, max(1, workers))
+                      for pool, workers in (pool_workers or {}).items())
+        limits[None] = max(1, max_workers)
+        condition = threading.Condition()
+        waiting_for = dict(
+            (stage.name, set(stage.requires)) for stage in self._stages
+        )
+        ready = [stage for stage in self._stages if not stage.requires]
+        state = {"running": 0, "finished": 0, "error": None}
+        running_in_pool = {}
+
+        def next_ready():
+            # the first ready stage whose pool has a free worker
+            for stage in ready:
+                if running_in_pool.get(stage.pool, 0) < limits.get(stage.pool, 1):
+                    ready.remove(stage)
+                    return stage
+            return None
+
+        def worker(stage):
+            error = None
+            try:
+                stage.func(*stage.args, **stage.kwargs)
+            except Exception as e:
+                error = e
+            condition.acquire()
+            try:
+                state["running"] -= 1
+                running_in_pool[stage.pool] -= 1
+                if error is not None:
+                    if state["error"] is None:
+                        state["error"] = error
+                else:
+                    state["finished"] += 1
+                    if on_finish:
+                        on_finish(stage)
+                    for other in self._stages:
+                        required = waiting_for[other.name]
+                        if stage.name in required:
+                            required.discard(stage.name)
+                            if not required:
+                                ready.append(other)
+                condition.notify()
+            finally:
+                condition.release()
+
+        condition.acquire()
+        try:
+            while True:
+                while ready and not state["error"]:
+                    stage = next_ready()
+                    if stage is None:
+                        break
+                    try:
+                        if check_cancelled:
+                            check_cancelled()
+                    except Exception as e:
+                        state["error"] = e
+                        break
+                    if on_start:
+                        on_start(stage)
+                    state["running"] += 1
+                    running_in_pool[stage.pool] = running_in_pool.get(stage.pool, 0) + 1
+                    thread = threading.Thread(target=worker, args=(stage,),
+                                              name="stage %s" % stage.name)
+                    thread.daemon = True
+                    thread.start()
+
+                if not state["running"] and (state["error"] or not ready):
+                    break
+                condition.wait()
+        finally:
+            condition.release()
+
+        if state["error"]:
+            raise state["error"]
@@ -0,0 +1,233 @@
+# -*- coding: utf-8 -*-
+# Copyright (c) 2015 Shotgun Software Inc.
+#
+# CONFIDENTIAL AND PROPRIETARY
+#
+# This work is provided "AS IS" and subject to the Shotgun Pipeline Toolkit
+# Source Code License included in this distribution package. See LICENSE.
+# By accessing, using, copying or modifying this work you indicate your
+# agreement to the Shotgun Pipeline Toolkit Source Code License. All rights
+# not expressly granted therein are reserved by Shotgun Software Inc.
+
+"""
+Thumbnails of still images decoded in-process, with Qt for the formats it has
+a plugin for, with a minimal reader for DPX files, and with OpenImageIO or
+OpenEXR for EXR files when either is installed. EXR files are left to ffmpeg
+otherwise.
+"""
+import os
+import array
+import struct
+
+import sgtk
+from sgtk.platform.qt import QtCore, QtGui
+
+# optional EXR readers, OpenImageIO is preferred
+try:
+    import OpenImageIO as oiio
+except ImportError:
+    oiio = None
+try:
+    import OpenEXR
+    import Imath
+except ImportError:
+    OpenEXR = None
+
+logger = sgtk.platform.get_logger(__name__)
+
+# longest side of the thumbnails
+THUMBNAIL_SIZE = 1024
+
+# 8 bit sRGB code value of linear values from 0 to 1, in 4096 steps
+SRGB_LUT = bytearray(
+    int(round(255 * (12.92 * v if v <= 0.0031308 else 1.055 * v ** (1 / 2.4) - 0.055)))
+    for v in (i / 4095.0 for i in range(4096)))
+
+
+def load_still_thumbnail(path, max_size=THUMBNAIL_SIZE):
+    """
+    Decode a still image downsized to fit a square, reading only what is
+    needed when the format allows it.
+
+    :param path:        Path to the image
+    :param max_size:    Longest side of the thumbnail
+    :returns:           A QImage, or None if the format can't be read
+                        in-process
+    """
+    reader = QtGui.QImageReader(path)
+    if reader.canRead():
+        size = reader.size()
+        if size.isValid() and max(size.width(), size.height()) > max_size:
+            # decoders supporting it decode straight to the scaled size
+            reader.setScaledSize(size.scaled(max_size, max_size,
+                                              QtCore.Qt.KeepAspectRatio))
+        image = reader.read()
+        if not image.isNull():
+            return image
+
+    extension = os.path.splitext(path)[1].lower()
+    if extension == ".dpx":
+        try:
+            return read_dpx_thumbnail(path, max_size)
+        except (IOError, OSError, ValueError, struct.error):
+            return None
+    if extension == ".exr":
+        try:
+            return read_exr_thumbnail(path, max_size)
+        except Exception as e:
+            logger.debug("Can't read EXR thumbnail of %s: %s" % (path, e))
+            return None
+    return None
+
+
+def read_exr_thumbnail(path, max_size=THUMBNAIL_SIZE):
+    """
+    Read a downsized EXR file, with its linear values converted to sRGB.
+    OpenImageIO is used if it's installed, else OpenEXR decoding only the
+    sampled lines.
+
+    :param path:        Path to the EXR file
+    :param max_size:    Longest side of the thumbnail
+    :returns:           A QImage, or None if neither module is installed
+    """
+    if oiio is not None:
+        return _read_exr_oiio(path, max_size)
+    if OpenEXR is not None:
+        return _read_exr_openexr(path, max_size)
+    logger.debug("Neither OpenImageIO nor OpenEXR is installed, "
+                 "the thumbnail of %s is made by ffmpeg" % path)
+    return None
+
+
+def _read_exr_oiio(path, max_size):
+    """
+    Read a downsized EXR file with OpenImageIO.
+    """
+    source = oiio.ImageBuf(path)
+    spec = source.spec()
+    if spec.nchannels < 1:
+        return None
+    # grey images are shown in grey
+    source = oiio.ImageBufAlgo.channels(
+        source, (0, 1, 2) if spec.nchannels >= 3 else (0, 0, 0))
+    scale = min(1.0, float(max_size) / max(spec.width, spec.height))
+    width = max(1, int(round(spec.width * scale)))
+    height = max(1, int(round(spec.height * scale)))
+    thumb = oiio.ImageBufAlgo.resize(source, roi=oiio.ROI(0, width, 0, height, 0, 1, 0, 3))
+    thumb = oiio.ImageBufAlgo.colorconvert(thumb, "linear", "sRGB")
+    data = thumb.get_pixels(oiio.UINT8).tobytes()
+    image = QtGui.QImage(data, width, height, width * 3, QtGui.QImage.Format_RGB888)
+    # copy, the QImage doesn't own the buffer it is created from
+    return image.copy()
+
+
+def _read_exr_openexr(path, max_size):
+    """
+    Read a downsized EXR file with OpenEXR, decoding only the sampled lines.
+    """
+    exr = OpenEXR.InputFile(path)
+    try:
+        header = exr.header()
+        window = header["dataWindow"]
+        width = window.max.x - window.min.x + 1
+        height = window.max.y - window.min.y + 1
+        channels = [name for name in ("R", "G", "B") if name in header["channels"]]
+        if len(channels) < 3:
+            if "Y" not in header["channels"]:
+                return None
+            channels = ["Y", "Y", "Y"]
+
+        step = max(1, -(-max(width, height) // max_size))
+        columns = range(0, width, step)
+        rows = range(0, height, step)
+        pixel_type = Imath.PixelType(Imath.PixelType.FLOAT)
+        data = bytearray()
+        for y in rows:
+            line = window.min.y + y
+            planes = [array.array("f", plane) for plane in
+                      exr.channels(channels, pixel_type, line, line)]
+            for x in columns:
+                for plane in planes:
+                    value = plane[x]
+                    if not value > 0:
+                        # negative and NaN values are black
+                        data.append(0)
+                    elif value >= 1:
+                        data.append(255)
+                    else:
+                        data.append(SRGB_LUT[int(value * 4095)])
+    finally:
+        exr.close()
+
+    thumb_width = len(columns)
+    image = QtGui.QImage(bytes(data), thumb_width, len(rows), thumb_width * 3,
+                         QtGui.QImage.Format_RGB888)
+    return image.copy()
+
+
+def read_dpx_thumbnail(path, max_size=THUMBNAIL_SIZE):
+    """
+    Read a downsized 8 or 10 bit RGB DPX file, decoding only the sampled
+    lines and pixels. The code values are mapped to 8 bits as they are,
+    without any color conversion, like ffmpeg does.
+
+    :param path:        Path to the DPX file
+    :param max_size:    Longest side of the thumbnail
+    :returns:           A QImage, or None if the DPX flavor isn't supported
+    """
+    with open(path, "rb") as f:
+        header = f.read(816)
+        magic = header[:4]
+        if magic == b"SDPX":
+            endian = ">"
+        elif magic == b"XPDS":
+            endian = "<"
+        else:
+            raise ValueError("Not a DPX file: %s" % path)
+
+        width, height = struct.unpack(endian + "II", header[772:780])
+        descriptor, bit_depth = struct.unpack("BB", header[800:801] + header[803:804])
+        packing, encoding, data_offset, eol_padding = struct.unpack(
+            endian + "HHII", header[804:816])
+        if descriptor != 50 or encoding != 0:
+            # only uncompressed RGB
+            return None
+        if eol_padding == 0xffffffff:
+            eol_padding = 0
+
+        if bit_depth == 10 and packing == 1:
+            stride = width * 4
+        elif bit_depth == 8:
+            stride = (width * 3 + 3) // 4 * 4
+        else:
+            return None
+        stride += eol_padding
+
+        step = max(1, -(-max(width, height) // max_size))
+        columns = range(0, width, step)
+        rows = range(0, height, step)
+        data = bytearray()
+        for y in rows:
+            f.seek(data_offset + y * stride)
+            line = f.read(stride)
+            if len(line) < stride:
+                raise ValueError("Truncated DPX file: %s" % path)
+            if bit_depth == 8:
+                for x in columns:
+                    data += line[x * 3:x * 3 + 3]
+                continue
+            words = array.array("I", line[:width * 4])
+            if (endian == ">") != (struct.pack("=I", 1) == struct.pack(">I", 1)):
+                words.byteswap()
+            for x in columns:
+                # filled method A: 10 bit R, G, B in the upper 30 bits
+                word = words[x]
+                data.append((word >> 24) & 0xff)
+                data.append((word >> 14) & 0xff)
+                data.append((word >> 4) & 0xff)
+
+    thumb_width = len(columns)
+    image = QtGui.QImage(bytes(data), thumb_width, len(rows), thumb_width * 3,
+                         QtGui.QImage.Format_RGB888)
+    # copy, the QImage doesn't own the buffer it is created from
+    return image.copy()
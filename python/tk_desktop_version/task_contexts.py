@@ -0,0 +1,129 @@
+# -*- coding: utf-8 -*-
+# Copyright (c) 2015 Shotgun Software Inc.
+#
+# CONFIDENTIAL AND PROPRIETARY
+#
+# This work is provided "AS IS" and subject to the Shotgun Pipeline Toolkit
+# Source Code License included in this distribution package. See LICENSE.
+# By accessing, using, copying or modifying this work you indicate your
+# agreement to the Shotgun Pipeline Toolkit Source Code License. All rights
+# not expressly granted therein are reserved by Shotgun Software Inc.
+
+"""
+Context and initial folder of the tasks selected in My Tasks, resolved in the
+background and kept for the most recently used tasks, so selecting a task
+again doesn't query the path cache and the site.
+"""
+import os
+import collections
+
+from .util import Threaded
+
+
+def resolve_task(tk, sg, entity):
+    """
+    Resolve the context of a task and the folder its files are browsed from.
+
+    :param tk:      The Toolkit API instance
+    :param sg:      The Shotgun connection
+    :param entity:  The task entity dictionary
+    :returns:       Tuple (context, init_path)
+    """
+    context = tk.context_from_entity_dictionary(entity)
+    root_path = [x for x in context.filesystem_locations if x.find("_3d") == -1]
+    if root_path:
+        return context, os.path.join(root_path[0], context.step['name'])
+
+    # no folders were created for the task, guess the folder of its entity
+    entity_query = [['code', 'is', context.entity['name']],
+                    ['id', 'is', context.entity['id']]]
+    if context.entity['type'] == 'Asset':
+        asset = sg.find_one('Asset', entity_query, ['sg_asset_type', 'code'])
+        init_path = os.path.join(
+            tk.project_path,
+            "assets",
+            asset['sg_asset_type'],
+            asset['code']
+        )
+    else:
+        shot = sg.find_one('Shot', entity_query, ['sg_sequence', 'code'])
+        init_path = os.path.join(
+            tk.project_path,
+            "seq",
+            shot['sg_sequence']['name'],
+            shot['code']
+        )
+    return context, init_path
+
+
+class TaskContexts(Threaded):
+    """
+    Least recently used cache of the context and initial folder of tasks.
+    """
+
+    def __init__(self, max_entries=64):
+        """
+        Construction
+
+        :param max_entries: Number of tasks kept, 0 to disable the cache
+        """
+        Threaded.__init__(self)
+        self.max_entries = max_entries
+        self._entries = collections.OrderedDict()
+
+    def get(self, entity):
+        """
+        :param entity:  The task entity dictionary
+        :returns:       Tuple (context, init_path) of a task, or None if it
+                        isn't cached
+        """
+        return self._get(self._key(entity))
+
+    def resolve(self, tk, sg, entity):
+        """
+        Return the context and initial folder of a task, resolving them if
+        they aren't cached. May be called from a background thread.
+
+        :param tk:      The Toolkit API instance
+        :param sg:      The Shotgun connection queried on a miss
+        :param entity:  The task entity dictionary
+        :returns:       Tuple (context, init_path)
+        """
+        key = self._key(entity)
+        cached = self._get(key)
+        if cached is not None:
+            return cached
+        # resolved outside of the lock, so tasks are resolved concurrently
+        result = resolve_task(tk, sg, entity)
+        self._set(key, result)
+        return result
+
+    def clear(self):
+        """
+        Forget every task, e.g. when the path cache is synchronized.
+        """
+        self._clear()
+
+    def _key(self, entity):
+        return (entity["type"], entity["id"])
+
+    @Threaded.exclusive
+    def _get(self, key):
+        result = self._entries.pop(key, None)
+        if result is not None:
+            # most recently used last
+            self._entries[key] = result
+        return result
+
+    @Threaded.exclusive
+    def _set(self, key, result):
+        if not self.max_entries:
+            return
+        self._entries.pop(key, None)
+        self._entries[key] = result
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    @Threaded.exclusive
+    def _clear(self):
+        self._entries = collections.OrderedDict()
@@ -0,0 +1,52 @@
+# -*- coding: utf-8 -*-
+# Copyright (c) 2015 Shotgun Software Inc.
+#
+# CONFIDENTIAL AND PROPRIETARY
+#
+# This work is provided "AS IS" and subject to the Shotgun Pipeline Toolkit
+# Source Code License included in this distribution package. See LICENSE.
+# By accessing, using, copying or modifying this work you indicate your
+# agreement to the Shotgun Pipeline Toolkit Source Code License. All rights
+# not expressly granted therein are reserved by Shotgun Software Inc.
+
+"""
+Time logged on the tasks of an upload batch, summed by Shotgun and kept for
+the duration of the batch.
+"""
+from .util import Threaded
+
+
+def logged_minutes(sg, task):
+    """
+    :param sg:      The Shotgun connection
+    :param task:    The task entity dictionary
+    :returns:       The minutes logged on a task, summed by Shotgun
+    """
+    result = sg.summarize("TimeLog", [["entity", "is", task]],
+                          [{"field": "duration", "type": "sum"}])
+    return result["summaries"].get("duration") or 0
+
+
+class Timecards(Threaded):
+    """
+    Minutes logged on each task of an upload batch, summed once per task.
+    """
+
+    def __init__(self):
+        """
+        Construction
+        """
+        Threaded.__init__(self)
+        self._minutes = {}
+
+    @Threaded.exclusive
+    def get(self, sg, task):
+        """
+        :param sg:      The Shotgun connection queried on a miss
+        :param task:    The task entity dictionary
+        :returns:       The minutes logged on a task
+        """
+        key = task["id"] if task else None
+        if key not in self._minutes:
+            self._minutes[key] = logged_minutes(sg, task)
+        return self._minutes[key]
@@ -0,0 +1,216 @@
+# -*- coding: utf-8 -*-
+# Copyright (c) 2015 Shotgun Software Inc.
+#
+# CONFIDENTIAL AND PROPRIETARY
+#
+# This work is provided "AS IS" and subject to the Shotgun Pipeline Toolkit
+# Source Code License included in this distribution package. See LICENSE.
+# By accessing, using, copying or modifying this work you indicate your
+# agreement to the Shotgun Pipeline Toolkit Source Code License. All rights
+# not expressly granted therein are reserved by Shotgun Software Inc.
+
+"""
+Cache of the media transcoded for an item, so that submitting the same frames
+with the same settings again doesn't render and encode everything again.
+"""
+import os
+import json
+import errno
+import shutil
+import getpass
+import hashlib
+import tempfile
+
+import sgtk
+
+logger = sgtk.platform.get_logger(__name__)
+
+# bump to invalidate every cached entry when the transcode itself changes
+CACHE_VERSION = 1
+
+MANIFEST = "outputs.json"
+
+
+def fingerprint(frames, settings):
+    """
+    Compute the fingerprint of a transcode.
+
+    :param frames:      The source frames, as a list of pyseq Items
+    :param settings:    Dictionary of every setting affecting the output
+    :returns:           A hexadecimal digest
+    """
+    digest = hashlib.sha1()
+    digest.update(("%d\n" % CACHE_VERSION).encode("utf-8"))
+    for frame in frames:
+        # don't use the stat pyseq caches, the frames may have been
+        # rendered again since the sequence was listed
+        stat = os.stat(frame.path)
+        digest.update(("%s %d %r\n" % (frame.path, stat.st_size, stat.st_mtime)).encode("utf-8"))
+    digest.update(json.dumps(settings, sort_keys=True, default=str).encode("utf-8"))
+    return digest.hexdigest()
+
+
+class TranscodeCache(object):
+    """
+    Keeps the transcoded media of recent transcodes, one folder per
+    fingerprint. Files are hard linked in and out of the cache when it is on
+    the same file system as the media, and copied otherwise, so uploads
+    removing the media once they are sent don't empty the cache.
+    """
+
+    def __init__(self, root=None, max_entries=8):
+        """
+        Construction
+
+        :param root:        Folder the entries are kept in, a folder of the
+                            local temp folder by default, like the scratch
+                            space the media are transcoded in
+        :param max_entries: Number of entries kept
+        """
+        self.root = root or os.path.join(
+            tempfile.gettempdir(), "tk_desktop_version_transcode_cache_%s" % getpass.getuser())
+        self.max_entries = max_entries
+
+    def restore(self, key, outputs):
+        """
+        Put the cached media of a transcode in place.
+
+        :param key:     The transcode fingerprint
+        :param outputs: Dictionary of output name to the path it is
+                        expected at
+        :returns:       True if every cached output was restored, False if
+                        the transcode has to run
+        """
+        entry = self._entry_path(key)
+        try:
+            with open(os.path.join(entry, MANIFEST)) as f:
+                manifest = json.load(f)
+        except (IOError, OSError, ValueError):
+            self.release(outputs)
+            return False
+
+        try:
+            if any(name not in manifest for name in outputs):
+                raise IOError("missing %s" % ", ".join(
+                    name for name in outputs if name not in manifest))
+            for name in outputs:
+                _link_or_copy(os.path.join(entry, manifest[name]), outputs[name])
+        except (IOError, OSError) as e:
+            logger.warning("Can't restore cached transcode %s: %s" % (key, e))
+            self.release(outputs)
+            return False
+
+        # entries are evicted least recently used first
+        os.utime(entry, None)
+        logger.debug("Reused cached transcode %s" % key)
+        return True
+
+    def release(self, outputs):
+        """
+        Unlink media which are hard linked to a cache entry, so that writing
+        them again doesn't change the cached copy.
+
+        :param outputs: Dictionary of output name to path
+        """
+        cached = None
+        for path in outputs.values():
+            try:
+                stat = os.stat(path)
+                if stat.st_nlink < 2:
+                    continue
+                if cached is None:
+                    cached = self._cached_files()
+                # other hard links, e.g. of the user's own, are left alone
+                if (stat.st_dev, stat.st_ino) in cached:
+                    os.remove(path)
+            except OSError:
+                pass
+
+    def store(self, key, outputs):
+        """
+        Add the media of a finished transcode to the cache.
+
+        :param key:     The transcode fingerprint
+        :param outputs: Dictionary of output name to path, outputs which
+                        don't exist are skipped
+        """
+        outputs = dict((name, path) for name, path in outputs.items()
+                       if path and os.path.isfile(path))
+        if "mov" not in outputs:
+            return
+        entry = self._entry_path(key)
+        tmp_entry = "%s.%d.tmp" % (entry, os.getpid())
+        try:
+            if os.path.exists(entry):
+                shutil.rmtree(entry)
+            if os.path.exists(tmp_entry):
+                shutil.rmtree(tmp_entry)
+            os.makedirs(tmp_entry)
+            manifest = {}
+            for name, path in outputs.items():
+                manifest[name] = name + os.path.splitext(path)[1]
+                _link_or_copy(path, os.path.join(tmp_entry, manifest[name]))
+            with open(os.path.join(tmp_entry, MANIFEST), "w") as f:
+                json.dump(manifest, f)
+            os.rename(tmp_entry, entry)
+        except (IOError, OSError) as e:
+            logger.warning("Can't cache transcode %s: %s" % (key, e))
+            shutil.rmtree(tmp_entry, ignore_errors=True)
+            return
+        self._evict(os.path.dirname(entry))
+
+    def _cached_files(self):
+        """
+        :returns: The set of (device, inode) of the files of every entry
+        """
+        files = set()
+        try:
+            names = os.listdir(self.root)
+        except OSError:
+            return files
+        for name in names:
+            entry = os.path.join(self.root, name)
+            try:
+                # entries may be evicted meanwhile
+                for file_name in os.listdir(entry):
+                    stat = os.stat(os.path.join(entry, file_name))
+                    files.add((stat.st_dev, stat.st_ino))
+            except OSError:
+                continue
+        return files
+
+    def _entry_path(self, key):
+        """
+        :returns: The folder of the cache entry for a fingerprint
+        """
+        return os.path.join(self.root, key)
+
+    def _evict(self, root):
+        """
+        Remove the least recently used entries of a cache folder.
+        """
+        entries = []
+        for name in os.listdir(root):
+            path = os.path.join(root, name)
+            if name.endswith(".tmp") or not os.path.isdir(path):
+                continue
+            entries.append((os.path.getmtime(path), path))
+        entries.sort(reverse=True)
+        for _, path in entries[self.max_entries:]:
+            shutil.rmtree(path, ignore_errors=True)
+
+
+def _link_or_copy(source, destination):
+    """
+    Hard link a file, or copy it if it can't be linked.
+    """
+    if os.path.exists(destination):
+        if os.path.samefile(source, destination):
+            return
+        os.remove(destination)
+    try:
+        os.link(source, destination)
+    except (OSError, AttributeError) as e:
+        if isinstance(e, OSError) and e.errno == errno.ENOENT:
+            raise
+        shutil.copy2(source, destination)
@@ -82,9 +82,14 @@ class Ui_Dialog(object):
 
         self.upload_btn = QtGui.QPushButton()
         self.upload_btn.setObjectName("upload_btn")
+
+        self.cancel_btn = QtGui.QPushButton()
+        self.cancel_btn.setObjectName("cancel_btn")
+        self.cancel_btn.setEnabled(False)
         self.horizontalLayout_2.addItem(spacerItem)
         self.horizontalLayout_2.addWidget(self.delete_btn)
         self.horizontalLayout_2.addWidget(self.upload_btn)
+        self.horizontalLayout_2.addWidget(self.cancel_btn)
 
         self.verticalLayout.addLayout( self.horizontalLayout )
         self.verticalLayout.addLayout( self.horizontalLayout_2 )
@@ -101,6 +106,7 @@ class Ui_Dialog(object):
         Dialog.setWindowTitle(QtGui.QApplication.translate("Dialog", "The Current Sgtk Environment", None, QtGui.QApplication.UnicodeUTF8))
         self.delete_btn.setText(QtGui.QApplication.translate("Dialog", "Delete", None, QtGui.QApplication.UnicodeUTF8))
         self.upload_btn.setText(QtGui.QApplication.translate("Dialog", "Upload", None, QtGui.QApplication.UnicodeUTF8))
+        self.cancel_btn.setText(QtGui.QApplication.translate("Dialog", "Cancel", None, QtGui.QApplication.UnicodeUTF8))
 
 
 from . import resources_rc
@@ -14,14 +14,15 @@ class Ui_SelectedFilesWidget( object ):
         # self.widget.horizontalHeader().setResizeMode( QtGui.QHeaderView.Stretch )
         # self.widget.resizeColumnToContents( 0 )
         self.widget.verticalHeader().hide()
-        self.widget.setColumnCount( 6 )
-        self.widget.setHorizontalHeaderLabels( [ 'Project', 'Version' ,'Seq_colorspace' ,'Description' ,'Mov_colorspace', 'fps'] )
+        self.widget.setColumnCount( 7 )
+        self.widget.setHorizontalHeaderLabels( [ 'Project', 'Version' ,'Seq_colorspace' ,'Description' ,'Mov_colorspace', 'fps', 'Status'] )
         self.widget.horizontalHeader().resizeSection( 0, 70 )
         self.widget.horizontalHeader().resizeSection( 1, 180 )
         self.widget.horizontalHeader().resizeSection( 2, 90 )
         self.widget.horizontalHeader().resizeSection( 3, 275 )
         self.widget.horizontalHeader().resizeSection( 4, 90 )
         self.widget.horizontalHeader().resizeSection( 5, 15 )
+        self.widget.horizontalHeader().resizeSection( 6, 90 )
         if pyside_version == 'PySide2':
             self.widget.horizontalHeader().setSectionResizeMode( 0, QtGui.QHeaderView.Fixed )
             self.widget.horizontalHeader().setSectionResizeMode( 1, QtGui.QHeaderView.Fixed )
@@ -29,6 +30,7 @@ class Ui_SelectedFilesWidget( object ):
             self.widget.horizontalHeader().setSectionResizeMode( 3, QtGui.QHeaderView.Fixed )
             self.widget.horizontalHeader().setSectionResizeMode( 4, QtGui.QHeaderView.Fixed )
             self.widget.horizontalHeader().setSectionResizeMode( 5, QtGui.QHeaderView.Fixed )
+            self.widget.horizontalHeader().setSectionResizeMode( 6, QtGui.QHeaderView.Fixed )
         else:
             self.widget.horizontalHeader().setResizeMode( 0, QtGui.QHeaderView.Fixed )
             self.widget.horizontalHeader().setResizeMode( 1, QtGui.QHeaderView.Fixed )
@@ -36,6 +38,7 @@ class Ui_SelectedFilesWidget( object ):
             self.widget.horizontalHeader().setResizeMode( 3, QtGui.QHeaderView.Fixed )
             self.widget.horizontalHeader().setResizeMode( 4, QtGui.QHeaderView.Fixed )
             self.widget.horizontalHeader().setResizeMode( 5, QtGui.QHeaderView.Fixed )
+            self.widget.horizontalHeader().setResizeMode( 6, QtGui.QHeaderView.Fixed )
         self.widget.horizontalHeader().setStretchLastSection( True )
 
         self.widget.setDragDropOverwriteMode( False )
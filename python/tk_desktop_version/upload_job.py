@@ -0,0 +1,643 @@
+# -*- coding: utf-8 -*-
+# Copyright (c) 2015 Shotgun Software Inc.
+#
+# CONFIDENTIAL AND PROPRIETARY
+#
+# This work is provided "AS IS" and subject to the Shotgun Pipeline Toolkit
+# Source Code License included in this distribution package. See LICENSE.
+# By accessing, using, copying or modifying this work you indicate your
+# agreement to the Shotgun Pipeline Toolkit Source Code License. All rights
+# not expressly granted therein are reserved by Shotgun Software Inc.
+
+"""
+Upload job engine: runs the transcode and upload of every queued item off the
+GUI thread and reports per-item, per-stage progress back to the dialog.
+"""
+import sgtk
+from sgtk.platform.qt import QtCore
+
+from .framework_qtwidgets import task_manager
+from .job_journal import journal_key, file_records, files_unchanged
+from .process import ProcessGroup
+from .retry import RetryPolicy
+from .stage_graph import StageGraph
+from .upload_settings import UploadSettings, UploadServices
+from .upload_shotgun import Transcoding, UploadVersion
+
+logger = sgtk.platform.get_logger(__name__)
+
+try:
+    STRING_TYPES = (basestring,)
+except NameError:
+    # python 3
+    STRING_TYPES = (str,)
+
+# job states
+JOB_QUEUED = "queued"
+JOB_RUNNING = "running"
+JOB_DONE = "done"
+JOB_FAILED = "failed"
+JOB_CANCELLED = "cancelled"
+
+# worker pool of the stages talking to Shotgun
+UPLOAD_POOL = "upload"
+
+# transcode stages recorded in the job journal, with the attributes of the
+# Transcoding they set
+JOURNALED_TRANSCODES = {
+    "mov": ["mov_path", "mov_webm_path", "hdr_path"],
+    "mp4": ["mp4_path"],
+    "webm": ["webm_path"],
+    "thumbnail": ["thumbnail_file", "filmstream_file"],
+    "image thumbnail": ["thumbnail_file"],
+    "review media": ["mp4_path", "webm_path", "thumbnail_file", "filmstream_file"],
+}
+
+
+class UploadJob(object):
+    """
+    Transcode and upload of a single item of the Upload Lists.
+    """
+
+    def __init__(self, name, selected_type, item, context, seq_colorspace,
+                 desc, mov_colorspace, fps_is_checked, qc=False,
+                 settings=None, services=None):
+        """
+        Construction
+
+        :param name:            The item name, as displayed in the Upload Lists
+        :param selected_type:   One of "seq", "mov" or "image"
+        :param item:            The SeqItem or QFileInfo to upload
+        :param context:         The context the Version is created for
+        :param seq_colorspace:  The colorspace override for the source frames
+        :param desc:            The Version description
+        :param mov_colorspace:  The colorspace override for the mov
+        :param fps_is_checked:  True if the mov should be rendered at 23.976
+        :param qc:              True if a QC Version should be uploaded as well
+        :param settings:        UploadSettings of the job, the defaults if None
+        :param services:        UploadServices shared by the jobs of the batch
+        """
+        self.name = name
+        self.selected_type = selected_type
+        self.item = item
+        self.context = context
+        self.seq_colorspace = seq_colorspace
+        self.desc = desc
+        self.mov_colorspace = mov_colorspace
+        self.fps_is_checked = fps_is_checked
+        self.qc = qc
+        self.settings = settings or UploadSettings()
+        self.services = services or UploadServices()
+        self.task_id = None
+        self.state = JOB_QUEUED
+        self.error = None
+        self.processes = ProcessGroup()
+
+    @property
+    def cancelled(self):
+        """
+        :returns: True if the job was cancelled
+        """
+        return self.processes.cancelled
+
+    def cancel(self):
+        """
+        Cancel the job, killing any child process tree it is running.
+        """
+        self.processes.cancel()
+
+    def version_codes(self):
+        """
+        :returns: The codes of the Versions the job creates or updates
+        """
+        version = UploadVersion(self.item, self.context, self.selected_type)
+        codes = [version.version_code()]
+        if self.qc:
+            codes.append(version.version_code(qc=True))
+        return codes
+
+    def run(self, report):
+        """
+        Run every stage of the job. Called from a worker thread.
+
+        :param report: Callable taking a stage name and a state, called when
+                       a stage starts and when it finishes.
+        """
+        scratch = self.services.scratch
+        scratch_dir = scratch.create() if scratch else None
+        try:
+            transcoding = Transcoding(self.item, self.context, self.selected_type,
+                                      self.seq_colorspace, self.desc,
+                                      self.mov_colorspace, self.fps_is_checked,
+                                      processes=self.processes,
+                                      settings=self.settings,
+                                      services=self.services,
+                                      scratch_dir=scratch_dir)
+            # the media are cached once encoded and removed once uploaded
+            # by a later stage, so the uploads don't wait for the cache
+            version = UploadVersion(self.item, self.context, self.selected_type,
+                                    connections=self.services.connections,
+                                    check_cancelled=self.processes.check_cancelled,
+                                    version_batch=self.services.version_batch,
+                                    remove_media=not self.services.transcode_cache)
+            qc_version = None
+            if self.qc:
+                qc_version = UploadVersion(self.item, self.context, self.selected_type,
+                                           connections=self.services.connections,
+                                           check_cancelled=self.processes.check_cancelled,
+                                           version_batch=self.services.version_batch,
+                                           remove_media=not self.services.transcode_cache)
+
+            graph = self.build_graph(transcoding, version, qc_version)
+            if self.services.retry_policy:
+                self._retry_stages(graph, transcoding)
+            key = None
+            if self.services.journal:
+                key = self.journal_key()
+                self._resume(graph, key, transcoding, version, qc_version)
+            graph.run(
+                max_workers=self.settings.max_stage_workers,
+                on_start=lambda stage: report(stage.name, JOB_RUNNING),
+                on_finish=lambda stage: report(stage.name, JOB_DONE),
+                check_cancelled=self.processes.check_cancelled,
+                pool_workers={UPLOAD_POOL: self.settings.upload_workers},
+            )
+            if key:
+                # submitting the item again uploads it again
+                self.services.journal.remove(key)
+        finally:
+            if scratch_dir:
+                # the intermediate files of failed and cancelled jobs as well
+                scratch.remove(scratch_dir)
+
+    def journal_key(self):
+        """
+        :returns: The key of the journal of the job, identifying its source
+                  files and settings
+        """
+        if self.selected_type == "seq":
+            paths = [frame.path for frame in self.item.seq_info]
+        else:
+            paths = [self.item.absoluteFilePath()]
+        settings = {
+            "codes": self.version_codes(),
+            "selected_type": self.selected_type,
+            "entity": self.context.entity,
+            "task": self.context.task,
+            "seq_colorspace": self.seq_colorspace,
+            "desc": self.desc,
+            "mov_colorspace": self.mov_colorspace,
+            "fps_is_checked": self.fps_is_checked,
+            "qc": self.qc,
+            "stream_frames": self.settings.stream_frames,
+            "stream_mov": self.settings.stream_mov,
+        }
+        return journal_key(paths, settings)
+
+    def _retry_stages(self, graph, transcoding):
+        """
+        Wrap the stages of a graph so they're retried by the retry policy.
+        A stage only retries itself, so a transient error doesn't run again
+        the stages it requires.
+
+        :param graph:       The StageGraph of the job
+        :param transcoding: The Transcoding instance for the item
+        """
+        for stage in graph.stages:
+            base = stage.name[3:] if stage.name.startswith("qc ") else stage.name
+            if transcoding.stream_frames and base in ("mov", "review media"):
+                # the render and the encode of the streamed frames can only
+                # run again together
+                continue
+            stage.func = self._retrying(stage.name, stage.func)
+
+    def _retrying(self, name, func):
+        """
+        :returns: A callable calling func through the retry policy
+        """
+        def wrapper(*args, **kwargs):
+            return self.services.retry_policy.call("%s %s" % (self.name, name),
+                                                   func, args, kwargs,
+                                                   self.processes.check_cancelled)
+        return wrapper
+
+    def _resume(self, graph, key, transcoding, version, qc_version):
+        """
+        Wrap the stages of a graph so they're recorded in the journal when
+        they complete, and skip the stages completed by a previous run of
+        the job. A completed stage runs again only if a stage needing it
+        runs and its outputs were removed or written again since.
+
+        :param graph:       The StageGraph of the job
+        :param key:         The journal key of the job
+        :param transcoding: The Transcoding instance for the item
+        :param version:     The UploadVersion instance for the item
+        :param qc_version:  The UploadVersion instance for the QC Version
+        """
+        done = self.services.journal.load(key)
+        dependents = {}
+        for stage in graph.stages:
+            for required in stage.requires:
+                dependents.setdefault(required, []).append(stage.name)
+
+        # stages were added after the stages they require
+        needed = {}
+        for stage in reversed(graph.stages):
+            needed_by_dependents = any(needed[name] for name in dependents.get(stage.name, []))
+            outputs = self._journaled_outputs(stage.name, transcoding, version, qc_version)
+            if outputs is None:
+                # chunks only make the mov, the other stages always run
+                needed[stage.name] = needed_by_dependents if " chunk " in stage.name else True
+            else:
+                record = done.get(stage.name)
+                needed[stage.name] = record is None or (
+                    needed_by_dependents and not files_unchanged(record["files"]))
+        if transcoding.stream_frames:
+            # the streamed review media are encoded while the movs render
+            streamed = [name for name in ("mov", "review media", "qc review media")
+                        if name in needed]
+            if len(streamed) > 1:
+                run = any(needed[name] for name in streamed)
+                for name in streamed:
+                    needed[name] = run
+
+        for stage in graph.stages:
+            outputs = self._journaled_outputs(stage.name, transcoding, version, qc_version)
+            if needed[stage.name] and outputs is None:
+                continue
+            if needed[stage.name]:
+                logger.debug("%s: running %s" % (self.name, stage.name))
+            else:
+                logger.debug("%s: %s done by a previous upload" % (self.name, stage.name))
+            stage.func = self._journaled(key, stage.name, stage.func, outputs,
+                                         None if needed[stage.name] else done.get(stage.name, {}))
+
+    def _journaled(self, key, name, func, outputs, record):
+        """
+        Wrap a stage callable so it's recorded in the journal once it
+        completes, or skipped.
+
+        :param key:     The journal key of the job
+        :param name:    The stage name
+        :param func:    The stage callable
+        :param outputs: The (object, attribute names) the stage sets, or None
+        :param record:  The journal record of the stage if it's skipped, None
+                        if it runs
+        :returns:       The wrapped callable
+        """
+        def wrapper(*args, **kwargs):
+            if record is not None:
+                # put back the paths the skipped stage would have set
+                if outputs:
+                    for attr, value in record.get("attrs", {}).items():
+                        setattr(outputs[0], attr, value)
+                return None
+            result = func(*args, **kwargs)
+            obj, attrs = outputs
+            values = dict((attr, getattr(obj, attr, None)) for attr in attrs)
+            paths = [value for value in values.values() if isinstance(value, STRING_TYPES)]
+            self.services.journal.record(key, name, {"attrs": values,
+                                                     "files": file_records(paths)})
+            return result
+        return wrapper
+
+    def _journaled_outputs(self, name, transcoding, version, qc_version):
+        """
+        :returns: The object and the names of its attributes set by a stage
+                  recorded in the journal, or None if the stage isn't
+        """
+        qc = name.startswith("qc ")
+        base = name[3:] if qc else name
+        if name == "mov" and self.qc:
+            # the QC movs are rendered in the same pass
+            return (transcoding, JOURNALED_TRANSCODES["mov"] + ["qc_mov_path", "qc_mov_webm_path"])
+        if base in JOURNALED_TRANSCODES:
+            return (transcoding, [("qc_" + attr) if qc else attr
+                                  for attr in JOURNALED_TRANSCODES[base]])
+        if base == "version":
+            return (qc_version if qc else version, ["version"])
+        if base.startswith("upload "):
+            return (qc_version if qc else version, [])
+        return None
+
+    def build_graph(self, transcoding, version, qc_version=None):
+        """
+        Build the dependency graph of the stages of the job.
+
+        The movs, the HDR mov and the QC movs are rendered in a single Nuke
+        pass, then the mp4, webm and filmstrip of each Version are encoded
+        concurrently. The Version is created once its mov is rendered, and
+        each media is uploaded as soon as it is encoded, in the upload pool,
+        while the other transcodes go on.
+
+        :param transcoding: The Transcoding instance for the item
+        :param version:     The UploadVersion instance for the item
+        :param qc_version:  The UploadVersion instance for the QC Version
+        :returns:           A StageGraph
+        """
+        graph = StageGraph()
+        self._add_render_stages(graph, transcoding)
+        self._add_transcode_stages(graph, transcoding, False)
+        if self.qc:
+            self._add_transcode_stages(graph, transcoding, True)
+
+        if self.services.transcode_cache:
+            # each Version's media are saved once they are all encoded, the
+            # QC encodes don't hold the main ones back
+            for qc in ([False, True] if self.qc else [False]):
+                transcodes = [stage.name for stage in graph.stages
+                              if stage.name.startswith("qc ") == qc]
+                if qc:
+                    # the QC movs are rendered with the main ones
+                    transcodes.append("mov")
+                graph.add("qc cache" if qc else "cache", transcoding.store_cached_media,
+                          kwargs={"qc": qc}, requires=transcodes)
+        if self.qc:
+            self._add_upload_stages(graph, transcoding, qc_version, True)
+        self._add_upload_stages(graph, transcoding, version, False)
+        return graph
+
+    def _add_render_stages(self, graph, transcoding):
+        """
+        Add the stages writing and running the Nuke render of the movs of
+        both Versions to a graph.
+
+        :param graph:       The StageGraph to add the stages to
+        :param transcoding: The Transcoding instance for the item
+        """
+        graph.add("script", transcoding.create_nuke_script,
+                  kwargs={"with_qc": self.qc})
+        chunks = len(transcoding.chunk_ranges())
+        if chunks > 1:
+            # the chunks are rendered concurrently and the mov stage only
+            # joins them
+            mov_requires = []
+            for index in range(chunks):
+                name = "mov chunk %d" % (index + 1)
+                graph.add(name, self._reserving("render", transcoding.render_mov_chunk),
+                          kwargs={"index": index}, requires=["script"])
+                mov_requires.append(name)
+            graph.add("mov", transcoding.create_mov, requires=mov_requires)
+        else:
+            graph.add("mov", self._reserving("render", transcoding.create_mov),
+                      requires=["script"])
+
+    def _add_transcode_stages(self, graph, transcoding, qc):
+        """
+        Add the stages encoding the media of the main or QC Version from the
+        rendered movs to a graph.
+
+        :param graph:       The StageGraph to add the stages to
+        :param transcoding: The Transcoding instance for the item
+        :param qc:          True to add the QC stages
+        """
+        prefix = "qc " if qc else ""
+        kwargs = {"qc": qc}
+
+        if transcoding.stream_frames:
+            # encoded while the mov stage renders, under its reservation:
+            # waiting for another one could starve the render feeding it
+            graph.add(prefix + "review media", transcoding.create_review_media,
+                      kwargs=kwargs, requires=["script"])
+        elif self.settings.fan_out:
+            graph.add(prefix + "review media",
+                      self._reserving("encode", transcoding.create_review_media),
+                      kwargs=kwargs, requires=["mov"])
+        else:
+            graph.add(prefix + "mp4", self._reserving("encode", transcoding.create_mp4),
+                      kwargs=kwargs, requires=["mov"])
+            graph.add(prefix + "webm", self._reserving("encode", transcoding.create_webm),
+                      kwargs=kwargs, requires=["mov"])
+            thumbnail_requires = ["mov"]
+            if self.selected_type == "mov":
+                # frames of ogv movies are counted on the mp4
+                thumbnail_requires.append(prefix + "mp4")
+            graph.add(prefix + "thumbnail", self._reserving("encode", transcoding.create_thumbnail),
+                      kwargs=kwargs, requires=thumbnail_requires)
+        graph.add(prefix + "image thumbnail",
+                  self._reserving("encode", transcoding.create_thumbnail_for_image),
+                  kwargs=kwargs, requires=["script"])
+
+    def _reserving(self, kind, func):
+        """
+        Wrap a stage callable so it runs while holding the resources of its
+        kind of stage in the host budget.
+
+        :param kind:    "render" or "encode"
+        :param func:    The stage callable
+        :returns:       The wrapped callable
+        """
+        cost = self.settings.stage_resources.get(kind)
+        if not self.services.budget or not cost:
+            return func
+
+        def wrapper(*args, **kwargs):
+            with self.services.budget.reserve(cost.get("cores", 1),
+                                              cost.get("memory", 0),
+                                              self.processes.check_cancelled):
+                return func(*args, **kwargs)
+        return wrapper
+
+    def _add_upload_stages(self, graph, transcoding, version, qc):
+        """
+        Add the stages creating the main or QC Version and uploading its
+        media to a graph. Each upload only waits for the Version and for the
+        stages encoding its media, and runs in the upload pool so the
+        network bound uploads don't take the workers of the transcodes.
+        With the transcode cache, the uploaded media are removed once they
+        are both uploaded and cached.
+
+        :param graph:       The StageGraph to add the stages to
+        :param transcoding: The Transcoding instance for the item
+        :param version:     The UploadVersion instance for the Version
+        :param qc:          True to add the QC stages
+        """
+        prefix = "qc " if qc else ""
+        attr = "qc_%s" if qc else "%s"
+        names = set(stage.name for stage in graph.stages)
+
+        def existing(*stages):
+            return [prefix + stage for stage in stages if prefix + stage in names]
+
+        # the QC movs are rendered with the main ones
+        version_requires = [stage for stage in ("script", "mov") if stage in names]
+
+        stages = [
+            (prefix + "version", version.create_version,
+             ["read_path", attr % "mov_path", "desc", attr % "hdr_path"],
+             version_requires),
+            (prefix + "upload thumbnail", version.upload_thumbnail,
+             [attr % "thumbnail_file"],
+             existing("thumbnail", "image thumbnail", "review media")),
+            (prefix + "upload filmstrip", version.upload_filmstrip_thumbnail,
+             [attr % "filmstream_file"],
+             existing("thumbnail", "image thumbnail", "review media")),
+            (prefix + "upload mp4", version.upload_mp4,
+             [attr % "mp4_path"],
+             existing("mp4", "review media")),
+            (prefix + "upload webm", version.upload_webm,
+             [attr % "webm_path", attr % "mov_webm_path"],
+             existing("webm", "review media")),
+        ]
+        for name, func, attrs, requires in stages:
+            kwargs = {"qc": True} if qc and func == version.create_version else None
+            if func != version.create_version:
+                requires = [prefix + "version"] + requires
+            graph.add(name, _call_with_attrs, args=[func, transcoding, attrs, kwargs],
+                      requires=requires, pool=UPLOAD_POOL)
+        if self.services.transcode_cache:
+            graph.add(prefix + "remove media", _call_with_attrs,
+                      args=[version.remove_uploaded_media, transcoding,
+                            [attr % "thumbnail_file", attr % "filmstream_file",
+                             attr % "webm_path", attr % "mov_webm_path"]],
+                      requires=[prefix + "cache", prefix + "upload thumbnail",
+                                prefix + "upload filmstrip", prefix + "upload webm"],
+                      pool=UPLOAD_POOL)
+
+
+def _call_with_attrs(func, obj, attrs, kwargs=None):
+    """
+    Call a function with attributes of an object which are only known once
+    the stages it depends on are finished.
+
+    :param func:    The callable to call
+    :param obj:     The object to read the attributes from
+    :param attrs:   List of attribute names, passed as positional arguments
+    :param kwargs:  Optional keyword arguments for func
+    """
+    return func(*[getattr(obj, attr) for attr in attrs], **(kwargs or {}))
+
+
+class UploadJobEngine(QtCore.QObject):
+    """
+    Runs UploadJobs on a dedicated background task manager, so that a long
+    upload batch neither freezes the dialog nor starves the task manager used
+    by the rest of the UI.
+    """
+
+    # Signal emitted when a job enters or leaves a stage.
+    stage_changed = QtCore.Signal(object, object, object)# job, stage, state
+
+    # Signal emitted when a job is finished, failed or cancelled.
+    job_finished = QtCore.Signal(object)# job
+
+    # Signal emitted when every submitted job is finished.
+    batch_finished = QtCore.Signal(object)# list of jobs
+
+    def __init__(self, parent=None, max_jobs=1):
+        """
+        Construction
+
+        :param parent:      The parent QObject
+        :param max_jobs:    Maximum number of jobs running at the same time
+        """
+        QtCore.QObject.__init__(self, parent)
+        self._jobs = []
+        self._jobs_by_task_id = {}
+        self._batch_finished = True
+        self._task_manager = task_manager.BackgroundTaskManager(
+            self,
+            start_processing=True,
+            max_threads=max_jobs
+        )
+        self._task_manager.task_completed.connect(self._on_task_completed)
+        self._task_manager.task_failed.connect(self._on_task_failed)
+
+    @property
+    def jobs(self):
+        """
+        :returns: The jobs of the current, or last, batch
+        """
+        return list(self._jobs)
+
+    @property
+    def is_running(self):
+        """
+        :returns: True if some submitted jobs are not finished yet
+        """
+        return any(job.state in (JOB_QUEUED, JOB_RUNNING) for job in self._jobs)
+
+    def submit(self, jobs):
+        """
+        Queue a batch of jobs.
+
+        :param jobs: List of UploadJob instances
+        """
+        self._jobs = list(jobs)
+        self._jobs_by_task_id = {}
+        self._batch_finished = False
+        for job in self._jobs:
+            job.task_id = self._task_manager.add_task(
+                self._run_job, task_args=[job])
+            self._jobs_by_task_id[job.task_id] = job
+            self.stage_changed.emit(job, "", JOB_QUEUED)
+
+    def cancel(self, jobs=None):
+        """
+        Cancel some jobs, or every job if None.
+
+        :param jobs: List of UploadJob instances to cancel
+        """
+        if jobs is None:
+            jobs = self._jobs
+        for job in jobs:
+            if job.state == JOB_QUEUED:
+                # not started yet, just drop it
+                self._task_manager.stop_task(job.task_id)
+                job.cancel()
+                self._finish_job(job, JOB_CANCELLED)
+            elif job.state == JOB_RUNNING:
+                job.cancel()
+
+    def shut_down(self):
+        """
+        Cancel every job and stop the background task manager.
+        """
+        for job in self._jobs:
+            job.cancel()
+        self._task_manager.shut_down()
+
+    def _run_job(self, job):
+        """
+        Run a job. Called from a background thread.
+
+        :param job: The UploadJob instance to run
+        """
+        job.processes.check_cancelled()
+        job.state = JOB_RUNNING
+        job.run(lambda stage, state: self.stage_changed.emit(job, stage, state))
+
+    def _on_task_completed(self, task_id, group, result):
+        """
+        Slot triggered when a job task is completed.
+        """
+        job = self._jobs_by_task_id.get(task_id)
+        if job:
+            self._finish_job(job, JOB_DONE)
+
+    def _on_task_failed(self, task_id, group, msg, stack_trace):
+        """
+        Slot triggered when a job task raised an exception.
+        """
+        job = self._jobs_by_task_id.get(task_id)
+        if not job:
+            return
+        if job.cancelled:
+            self._finish_job(job, JOB_CANCELLED)
+            return
+        logger.error("Upload of %s failed: %s\n%s" % (job.name, msg, stack_trace))
+        job.error = msg
+        self._finish_job(job, JOB_FAILED)
+
+    def _finish_job(self, job, state):
+        """
+        Record the final state of a job and report it.
+        """
+        if job.state in (JOB_DONE, JOB_FAILED, JOB_CANCELLED):
+            return
+        job.state = state
+        self.stage_changed.emit(job, "", state)
+        self.job_finished.emit(job)
+        if not self.is_running and not self._batch_finished:
+            self._batch_finished = True
+            self.batch_finished.emit(self._jobs)
@@ -0,0 +1,122 @@
+# -*- coding: utf-8 -*-
+# Copyright (c) 2015 Shotgun Software Inc.
+#
+# CONFIDENTIAL AND PROPRIETARY
+#
+# This work is provided "AS IS" and subject to the Shotgun Pipeline Toolkit
+# Source Code License included in this distribution package. See LICENSE.
+# By accessing, using, copying or modifying this work you indicate your
+# agreement to the Shotgun Pipeline Toolkit Source Code License. All rights
+# not expressly granted therein are reserved by Shotgun Software Inc.
+
+"""
+Tuning settings of the uploads, and the objects shared by the upload jobs of
+a batch, handed to every job and to its Transcoding.
+"""
+
+
+class UploadSettings(object):
+    """
+    How the media of an item are transcoded and uploaded.
+    """
+
+    def __init__(self, max_stage_workers=1, stage_resources=None,
+                 fan_out=False, render_chunks=1, chunk_frames=0,
+                 stream_frames=False, stream_mov=True, staging_threads=0,
+                 staging_lookahead=32, upload_workers=1):
+        """
+        Construction
+
+        :param max_stage_workers: Maximum number of stages of a job running
+                                  at the same time
+        :param stage_resources: Dictionary with the "cores" and "memory"
+                                reserved by "render" and "encode" stages
+        :param fan_out:         True to encode the mp4, webm, thumbnail and
+                                filmstrip with a single ffmpeg decoding the mov
+        :param render_chunks:   Maximum number of chunks the mov of a sequence
+                                is rendered in, by parallel Nuke processes
+        :param chunk_frames:    Minimum number of frames of a chunk
+        :param stream_frames:   True to encode the review media of sequences
+                                from frames streamed by the render
+        :param stream_mov:      False to skip the mov of streamed sequences
+        :param staging_threads: Number of threads copying the frames of a
+                                sequence locally ahead of its render, 0 to
+                                read them from shared storage
+        :param staging_lookahead: Maximum number of frames staged ahead of
+                                  the render
+        :param upload_workers:  Maximum number of uploads of a job running
+                                at the same time, alongside the transcodes
+        """
+        self.max_stage_workers = max_stage_workers
+        self.stage_resources = stage_resources or {}
+        self.fan_out = fan_out
+        self.render_chunks = render_chunks
+        self.chunk_frames = chunk_frames
+        self.stream_frames = stream_frames
+        self.stream_mov = stream_mov
+        self.staging_threads = staging_threads
+        self.staging_lookahead = staging_lookahead
+        self.upload_workers = upload_workers
+
+    @classmethod
+    def from_app(cls, app):
+        """
+        :param app: The app whose settings are read
+        :returns:   The UploadSettings set in the app configuration
+        """
+        return cls(
+            max_stage_workers=app.get_setting("max_stage_workers"),
+            stage_resources=app.get_setting("stage_resources"),
+            fan_out=app.get_setting("ffmpeg_fan_out"),
+            render_chunks=app.get_setting("render_chunks"),
+            chunk_frames=app.get_setting("render_chunk_frames"),
+            stream_frames=app.get_setting("stream_review_media"),
+            stream_mov=app.get_setting("stream_write_mov"),
+            staging_threads=app.get_setting("input_staging_threads"),
+            staging_lookahead=app.get_setting("input_staging_lookahead"),
+            upload_workers=app.get_setting("upload_workers"),
+        )
+
+
+class UploadServices(object):
+    """
+    Optional objects shared by the upload jobs, each left to None when the
+    feature it backs is disabled.
+    """
+
+    def __init__(self, budget=None, nuke_service=None, transcode_cache=None,
+                 scratch=None, connections=None, version_batch=None,
+                 journal=None, retry_policy=None, plate_colorspaces=None,
+                 timecards=None):
+        """
+        Construction
+
+        :param budget:          HostBudget the render and encode stages
+                                reserve resources from
+        :param nuke_service:    NukeRenderService running the renders
+        :param transcode_cache: TranscodeCache reused media are restored from
+        :param scratch:         ScratchSpace the intermediate files are
+                                written to
+        :param connections:     ShotgunConnectionPool the uploads are sent
+                                through
+        :param version_batch:   VersionBatch of the batch the Versions are
+                                created through
+        :param journal:         JobJournal the completed stages are recorded
+                                in, and resumed from
+        :param retry_policy:    RetryPolicy of the stages, failing stages
+                                aren't retried if None
+        :param plate_colorspaces: PlateColorspaces of the batch the plate of
+                                  the shot is read from
+        :param timecards:       Timecards of the batch the time logged on the
+                                task is read from
+        """
+        self.budget = budget
+        self.nuke_service = nuke_service
+        self.transcode_cache = transcode_cache
+        self.scratch = scratch
+        self.connections = connections
+        self.version_batch = version_batch
+        self.journal = journal
+        self.retry_policy = retry_policy
+        self.plate_colorspaces = plate_colorspaces
+        self.timecards = timecards
@@ -7,10 +7,24 @@ import platform
 import subprocess
 from .ext_packages import pyseq
 import shutil
-import datetime
+import contextlib
 
 import logging
 
+from .process import ProcessGroup, kill_process_tree, stage_error
+from .rez_env import rez_command
+from .media_info import g_media_info
+from .shotgun_cache import g_shotgun_cache
+from .timecards import logged_minutes
+from .filmstrip import FilmstripBuilder, read_ppm_frames
+from .still_thumbnail import load_still_thumbnail
+from .transcode_cache import fingerprint
+from .frame_stream import FrameStream
+from .input_staging import InputStaging
+from .upload_settings import UploadSettings, UploadServices
+
+logger = sgtk.platform.get_logger(__name__)
+
 codecs = {
     "Apple ProRes 4444":"ap4h",
     "Apple ProRes 422 HQ":"apch",
@@ -85,7 +99,8 @@ class Output(object):
 
 class Transcoding(object):
 
-    def __init__(self,fileinfo,context,selected_type,seq_colorspace, desc,mov_colorspace,fps_is_checked):
+    def __init__(self,fileinfo,context,selected_type,seq_colorspace, desc,mov_colorspace,fps_is_checked,
+                 processes = None, settings = None, services = None, scratch_dir = None):
 
         
         if selected_type in ["mov","image"]:
@@ -99,159 +114,238 @@ class Transcoding(object):
         self.mov_colorspace = mov_colorspace
         self.seq_colorspace = seq_colorspace
         self.fps_checked = fps_is_checked
+        # every child process goes through this group so a job can be cancelled
+        self.processes = processes or ProcessGroup()
+        settings = settings or UploadSettings()
+        services = services or UploadServices()
+        # optional NukeRenderService keeping warm Nuke processes
+        self.nuke_service = services.nuke_service
+        # optional TranscodeCache the media are restored from and saved to
+        self.transcode_cache = services.transcode_cache
+        self.cache_key = None
+        self.qc_cache_key = None
+        self.cached = False
+        self.qc_cached = False
+        # long sequences are rendered in up to render_chunks chunks of at
+        # least chunk_frames frames
+        self.render_chunks = settings.render_chunks
+        self.chunk_frames = settings.chunk_frames
+        self.chunks = []
+        # the main and QC movs rendered by the Nuke pass, with their outputs
+        self.render_branches = []
+        # review media of sequences encoded from the frames streamed by the
+        # render, the mov only being rendered if stream_mov is set
+        self.stream_frames = settings.stream_frames and selected_type == "seq"
+        self.stream_mov = settings.stream_mov
+        self.frame_stream = None
+        self.qc_frame_stream = None
+        # optional local folder the intermediate files are written to
+        self.scratch_dir = scratch_dir
+        # frames of the sequence copied locally by staging_threads threads,
+        # staging_lookahead frames ahead of the render of the mov
+        self.staging_threads = settings.staging_threads
+        self.staging_lookahead = settings.staging_lookahead
+        self.input_staging = None
+        # optional PlateColorspaces of the batch the plate is read from
+        self.plate_colorspaces = services.plate_colorspaces
+        # optional Timecards of the batch the logged time is read from
+        self.timecards = services.timecards
             
 
-    def create_mov(self, qc = False ):
+    def _scratch_path(self, path ):
+        """
+        :returns: The path an intermediate file is written to, in the
+                  scratch folder if there is one
+        """
+        if not self.scratch_dir:
+            return path
+        return os.path.join( self.scratch_dir, os.path.basename( path ) )
+
+    def create_mov(self):
+        """
+        Render the movs of the item, the HDR mov and the QC movs included,
+        in a single Nuke pass, or join the rendered chunks.
+        """
         if self.selected_type == "image":
             return
         if self.selected_type == "mov":
             return
-        
-        nuke_ver = 'nuke-13' if qc else 'nuke-12.2.2'
-        command = ['rez-env', nuke_ver,'--','nuke','-ix']
-
-        if not self.output_info['sg_colorspace'].find("ACES") == -1 and self.fileinfo.tail() in ['.dpx','.exr']:
-            command = ['rez-env', nuke_ver ,'ocio_config','--','nuke','-ix']
-        if not self.output_info['sg_colorspace'].find("Alexa") == -1 and self.fileinfo.tail() in ['.dpx','.exr']:
-            command = ['rez-env', nuke_ver,'alexa_config','--','nuke','-ix']
-        if not self.output_info['sg_colorspace'].find("legacy") == -1 and self.fileinfo.tail() in ['.dpx','.exr']:
-            command = ['rez-env', nuke_ver,'legacy_config','--','nuke','-ix']
-        if not self.output_info['sg_colorspace'].find("Sony") == -1 and self.fileinfo.tail() in ['.dpx','.exr']:
-            command = ['rez-env', nuke_ver,'sony_config','--','nuke','-ix']
-        if not self.output_info['sg_colorspace'].find("Arri4") == -1 and self.fileinfo.tail() in ['.dpx','.exr']:
-            command = ['rez-env', nuke_ver,'alexa4_config','--','nuke','-ix']
-            
-        nuke_script_file = self.qc_tmp_nuke_script_file if qc else self.tmp_nuke_script_file
+        if not self.render_branches:
+            # every mov was restored from the transcode cache
+            return
+        if self.chunks:
+            self._concat_mov_chunks()
+            return
 
-        command.append( nuke_script_file )
+        frame_streams = [ branch["frame_stream"] for branch in self.render_branches
+                          if branch["frame_stream"] ]
+        input_staging = self.input_staging
 
+        if input_staging:
+            input_staging.start( self.processes.check_cancelled )
         try:
-            print(command)
-            mov_p = subprocess.check_call(command)
+            self._render_nuke_script( self._render_packages(), self.tmp_nuke_script_file )
         except Exception as e:
-            raise Exception("make mov {}".format(e))
-
-    def create_hdr_mov( self, qc = False ):
-        if self.selected_type == "image" or self.selected_type == "mov":
-            return
-        if self.setting.colorspace.find('ACES') == -1:
+            for frame_stream in frame_streams:
+                frame_stream.remove()
+            if input_staging and input_staging.error:
+                raise stage_error("make mov", input_staging.error)
+            raise stage_error("make mov", e)
+        finally:
+            for frame_stream in frame_streams:
+                frame_stream.render_finished()
+            if input_staging:
+                input_staging.stop()
+                input_staging.remove()
+
+    def chunk_ranges(self):
+        """
+        Split the frame range of the sequence in the chunks rendered by
+        separate Nuke processes.
+
+        :returns: List of (first, last) frame ranges, a single one if the
+                  sequence isn't rendered in chunks
+        """
+        if self.selected_type != "seq":
+            return []
+        first = self.fileinfo.start()
+        last = self.fileinfo.end()
+        length = last - first + 1
+        count = min( self.render_chunks, length // max( self.chunk_frames, 1 ) )
+        if count < 2 or self.context.project['name'] in ['westworld','asd2']:
+            # h264 movs are long-GOP, only intra-frame movs are concatenated
+            return [ ( first, last ) ]
+        if self.stream_frames:
+            # streamed frames have to be rendered in order
+            return [ ( first, last ) ]
+        size = -( -length // count )
+        return [ ( x, min( x + size - 1, last ) ) for x in range( first, last + 1, size ) ]
+
+    def _create_chunk_scripts(self, branches, timecard ):
+        """
+        Write the Nuke scripts rendering the chunks of the movs, if the
+        sequence is long enough to be rendered in chunks.
+
+        :param branches:    The branches of the render
+        :param timecard:    The hours burnt in the movs
+        :returns:           The list of chunks, empty if the movs are
+                            rendered at once
+        """
+        ranges = self.chunk_ranges()
+        chunks = []
+        if len( ranges ) > 1:
+            chunk_dir = self._scratch_path( os.path.splitext( self.mov_path )[0] + "_chunks" )
+            for index, ( first, last ) in enumerate( ranges ):
+                chunk = {
+                    "script"  : os.path.join( chunk_dir, "%03d.py" % index ),
+                    # chunk of each mov, by the path of the joined mov
+                    "outputs" : {},
+                }
+                chunk_branches = []
+                for branch in branches:
+                    chunk_branch = dict( branch )
+                    for name in ( "mov", "mov_webm", "hdr" ):
+                        if branch[name]:
+                            chunk_branch[name] = os.path.join( chunk_dir, "%03d_%s%s.mov" % (
+                                index, "qc_" if branch["qc"] else "", name ) )
+                            chunk["outputs"][ branch[name] ] = chunk_branch[name]
+                    chunk_branches.append( chunk_branch )
+                nk = self._build_render_script( chunk_branches, timecard, first, last,
+                                                chunk["script"] )
+                self._write_render_script( chunk["script"], nk )
+                chunks.append( chunk )
+        self.chunks = chunks
+        return chunks
+
+    def render_mov_chunk(self, index ):
+        """
+        Render a chunk of the movs.
+
+        :param index:   Index of the chunk in chunk_ranges()
+        """
+        if not self.chunks:
+            # every mov was restored from the transcode cache
             return
-        hdr_nuke_script = self.create_hdr_nuke_script( qc )
-
-        if hdr_nuke_script:
-            nuke_ver = 'nuke-13' if qc else 'nuke-12.2.2'
-            command = ['rez-env', nuke_ver ,'hdr_config','--','nuke','-ix']
-            command.append( hdr_nuke_script )
-
+        try:
+            self._render_nuke_script( self._render_packages(), self.chunks[index]["script"] )
+        except Exception as e:
+            raise stage_error("make mov chunk {}".format(index), e)
+
+    def _concat_mov_chunks(self):
+        """
+        Join the rendered chunks into the movs, copying the streams so the
+        result is the same as a single render.
+        """
+        chunk_dir = os.path.dirname( self.chunks[0]["script"] )
+        for index, mov_path in enumerate( sorted( self.chunks[0]["outputs"] ) ):
+            list_file = os.path.join( chunk_dir, "%d.txt" % index )
+            with open( list_file, 'w' ) as f:
+                for chunk in self.chunks:
+                    f.write( "file '{}'\n".format( chunk["outputs"][mov_path].replace("\\","/") ) )
+
+            command = rez_command( ['ffmpeg'], ['ffmpeg','-y'], self.processes )
+            command.extend(["-f", "concat", "-safe", "0"])
+            command.append("-i")
+            command.append( _native_path( list_file ) )
+            command.extend(["-map", "0", "-c", "copy"])
+            command.append( _native_path( mov_path ) )
             try:
-                hdr_p = subprocess.check_call(command)
+                self.processes.check_call(command)
             except Exception as e:
-                raise Exception("make hdr mov {}".format(e))
-    
-    def create_hdr_nuke_script( self, qc = False ):
-        if qc:
-            tmp_hdr_nuke_script_file = os.path.join(os.path.abspath(
-                                os.path.join(self.fileinfo.path(),"../..")),
-                                 self.fileinfo.format("%h")+ "hdr" + ".py")
-        else:
-            tmp_hdr_nuke_script_file = os.path.join(os.path.abspath(
-                                os.path.join(self.fileinfo.path(),"../..")),
-                                 self.fileinfo.format("%h")+ "hdr" + ".py")
-        qc_prefix = 'qc_' if qc else '' 
-        print( "=======HDR settting info============"   )
-        print(    "color space : ACES - ACES2065-1"     )
-        print(   "mov color space : Output - Rec.709"   )
-        print(   "mov codec : Apple ProRes 4444 "   )
-        print( "=======HDR settting info============"   )
-        if qc :
-            hdr_path = self.qc_hdr_path
-        else :
-            hdr_path = self.hdr_path
-        
-        if platform.system() in ('Windows',"Microsoft"):
-            return 
-            hdr_log_path = '\\\\10.0.40.12\\user\\user\\pipeline\\kyoungmin\\work\\toolkit\\tk-multi-version\\log_HDR.log'
-        else:
-            hdr_log_path = '/storenext/user/pipeline/kyoungmin/work/toolkit/tk-multi-version/log_HDR.log'
-        now = datetime.datetime.now()
-        temp = sys.stdout
-        with open( hdr_log_path, 'a+') as sys.stdout:
-            print( now.strftime('%Y-%m-%d %H:%M:%S') + ' - [PATH] : {0}'.format(hdr_path))
-        sys.stdout = temp
+                raise stage_error("concat mov chunks", e)
 
-        nk = ''
-        nk += '#-*- coding: utf-8 -*-\n'
-        nk += 'import nuke\n'
-        nk += 'import os\n'
-        nk += 'nuke.knob("root.first_frame", "{}" )\n'.format(self.fileinfo.start())
-        nk += 'nuke.knob("root.last_frame", "{}" )\n'.format(self.fileinfo.end() )
+        shutil.rmtree( chunk_dir, ignore_errors = True )
 
-        if platform.system() in ('Windows',"Microsoft"):
-            nk += 'read = nuke.nodes.Read( name="Read1",file="{}" )\n'.format( self.read_path.replace("\\","/") )
-        else:
-            nk += 'read = nuke.nodes.Read( name="Read1",file="{}" )\n'.format( self.read_path )
-        nk += 'read["first"].setValue( {} )\n'.format(self.fileinfo.start() )
-        nk += 'read["last"].setValue( {} )\n'.format(self.fileinfo.end())
-        nk += 'read["colorspace"].setValue( "{}")\n'.format("ACES - ACES2065-1")
-        if platform.system() in ('Windows',"Microsoft"):
-            nk += 'output = "{}"\n'.format( self.hdr_path.replace("\\","/") )
-        else:
-            nk += 'output = "{}"\n'.format( self.hdr_path )
-            
-        nk += 'write = nuke.nodes.Write(name="hdr_write", inputs = [read],file=output )\n'
-        nk += 'write["file_type"].setValue( "mov" )\n'
-        nk += 'write["create_directories"].setValue(True)\n'
-        nk += 'write["mov64_codec"].setValue("{}")\n'.format("ap4h")
-        nk += 'write["mov64_fps"].setValue({})\n'.format(self.setting.mov_fps)
-        nk += 'write["colorspace"].setValue( "{}")\n'.format("Output - Rec.709")
-        nk += 'nuke.execute(write,{0},{1},1)\n'.format(self.fileinfo.start(),
-                                                     self.fileinfo.end())
-        if not platform.system() in ('Windows',"Microsoft"):
-            nk += 'os.remove("{}")\n'.format( tmp_hdr_nuke_script_file )
-        nk += 'exit()\n'
-
-        if not os.path.exists( os.path.dirname( tmp_hdr_nuke_script_file) ):
-            cur_umask = os.umask(0)
-            os.makedirs(os.path.dirname( tmp_hdr_nuke_script_file), 0o777 )
-            os.umask(cur_umask)
-
-        with open( tmp_hdr_nuke_script_file, 'w' ) as f:
-            f.write( nk )
-        
-        os.chmod(tmp_hdr_nuke_script_file, 0o777)
-        
-        return tmp_hdr_nuke_script_file 
+    def _nuke_packages(self, qc = False ):
+        """
+        :returns: The rez packages of the Nuke environment rendering the mov,
+                  with the OCIO config matching the project colorspace
+        """
+        nuke_ver = 'nuke-13' if qc else 'nuke-12.2.2'
+        packages = [nuke_ver]
 
+        if not self.output_info['sg_colorspace'].find("ACES") == -1 and self.fileinfo.tail() in ['.dpx','.exr']:
+            packages = [nuke_ver ,'ocio_config']
+        if not self.output_info['sg_colorspace'].find("Alexa") == -1 and self.fileinfo.tail() in ['.dpx','.exr']:
+            packages = [nuke_ver,'alexa_config']
+        if not self.output_info['sg_colorspace'].find("legacy") == -1 and self.fileinfo.tail() in ['.dpx','.exr']:
+            packages = [nuke_ver,'legacy_config']
+        if not self.output_info['sg_colorspace'].find("Sony") == -1 and self.fileinfo.tail() in ['.dpx','.exr']:
+            packages = [nuke_ver,'sony_config']
+        if not self.output_info['sg_colorspace'].find("Arri4") == -1 and self.fileinfo.tail() in ['.dpx','.exr']:
+            packages = [nuke_ver,'alexa4_config']
+        return packages
+
+    def _render_packages(self):
+        """
+        :returns: The rez packages of the Nuke environment of the render,
+                  the QC node requiring a newer Nuke
+        """
+        return self._nuke_packages( any( branch["qc"] for branch in self.render_branches ) )
+
+    def _render_nuke_script(self, packages, nuke_script_file ):
+        """
+        Run a render script in Nuke, in a warm Nuke of the render service if
+        there is one.
+
+        :param packages:            The rez packages of the Nuke environment
+        :param nuke_script_file:    Path to the render script
+        """
+        if self.nuke_service:
+            self.nuke_service.render( packages, nuke_script_file,
+                                      self.processes.check_cancelled )
+            return
+        command = rez_command( packages, ['nuke','-ix'], self.processes )
+        command.append( nuke_script_file )
+        logger.debug( "Rendering %s" % " ".join( command ) )
+        self.processes.check_call(command)
 
     def create_mp4(self, qc = False ):
         qc_prefix = 'qc_' if qc else '' 
-        if self.selected_type == "image":
-            if qc:
-                self.qc_mp4_path = self.qc_mov_path
-            else:
-                self.mp4_path = self.mov_path
+        if not self._init_mp4_path( qc ):
+            return
+        if self._is_cached( qc ):
             return
-        if self.selected_type == "mov":
-            if self.fileinfo.suffix() == "mp4":
-                if qc:
-                    self.qc_mp4_path = self.qc_mov_path
-                else:
-                    self.mp4_path = self.mov_path
-                return 
-            if qc:
-                self.qc_mp4_path = self.qc_mov_path.replace(self.fileinfo.suffix(),"mp4")
-            else:
-                self.mp4_path = self.mov_path.replace(self.fileinfo.suffix(),"mp4")
-        else:
-            if qc:
-                self.qc_mp4_path = os.path.join(os.path.abspath(
-                                os.path.join(self.fileinfo.path(),"../..")),
-                                 qc_prefix + self.fileinfo.format("%h")+"mp4")
-            else:
-                self.mp4_path = os.path.join(os.path.abspath(
-                                os.path.join(self.fileinfo.path(),"../..")),
-                                 self.fileinfo.format("%h")+"mp4")
-
 
         if qc :
             mov_path = os.path.dirname( self.mov_path ) + os.sep + qc_prefix + os.path.basename( self.mov_path )
@@ -260,7 +354,7 @@ class Transcoding(object):
             mov_path = self.mov_path 
             mp4_path = self.mp4_path
         
-        command = ['rez-env','ffmpeg','--','ffmpeg','-y']
+        command = rez_command( ['ffmpeg'], ['ffmpeg','-y'], self.processes )
         command.append("-i")
         command.append( mov_path )
         command.append("-vcodec")
@@ -280,29 +374,50 @@ class Transcoding(object):
         
 
         try:
-            mp4_p = subprocess.check_call(command)
+            mp4_p = self.processes.check_call(command)
         except Exception as e:
-            raise Exception("make mp4 {}".format(e))
+            raise stage_error("make mp4", e)
 
-    def create_webm(self, qc = False ):
+    def _init_mp4_path(self, qc = False ):
+        """
+        Set the mp4 path of the item.
+
+        :returns: False if the mp4 doesn't need to be encoded
+        """
         qc_prefix = 'qc_' if qc else '' 
         if self.selected_type == "image":
-            self.webm_path = ""
-            return
+            if qc:
+                self.qc_mp4_path = self.qc_mov_path
+            else:
+                self.mp4_path = self.mov_path
+            return False
         if self.selected_type == "mov":
+            if self.fileinfo.suffix() == "mp4":
+                if qc:
+                    self.qc_mp4_path = self.qc_mov_path
+                else:
+                    self.mp4_path = self.mov_path
+                return False
             if qc:
-                self.qc_webm_path = self.qc_mov_path.replace(self.fileinfo.suffix(),"webm")
+                self.qc_mp4_path = self.qc_mov_path.replace(self.fileinfo.suffix(),"mp4")
             else:
-                self.webm_path = self.mov_path.replace(self.fileinfo.suffix(),"webm")
+                self.mp4_path = self.mov_path.replace(self.fileinfo.suffix(),"mp4")
         else:
             if qc:
-                self.qc_webm_path = os.path.join(os.path.abspath(
+                self.qc_mp4_path = os.path.join(os.path.abspath(
                                 os.path.join(self.fileinfo.path(),"../..")),
-                                 qc_prefix + self.fileinfo.format("%h")+"webm")
+                                 qc_prefix + self.fileinfo.format("%h")+"mp4")
             else:
-                self.webm_path = os.path.join(os.path.abspath(
+                self.mp4_path = os.path.join(os.path.abspath(
                                 os.path.join(self.fileinfo.path(),"../..")),
-                                 self.fileinfo.format("%h")+"webm")
+                                 self.fileinfo.format("%h")+"mp4")
+        return True
+
+    def create_webm(self, qc = False ):
+        if not self._init_webm_path( qc ):
+            return
+        if self._is_cached( qc ):
+            return
 
         if qc:
             webm_path     = self.qc_webm_path
@@ -315,7 +430,7 @@ class Transcoding(object):
 
         if platform.system() == "Linux":
 
-            command = ['rez-env','ffmpeg','--','ffmpeg','-y']
+            command = rez_command( ['ffmpeg'], ['ffmpeg','-y'], self.processes )
             command.append("-i")
             if mov_webm_path :
                 command.append( mov_webm_path )
@@ -343,7 +458,7 @@ class Transcoding(object):
 
         else:
         
-            command = ['rez-env','ffmpeg','--','ffmpeg','-y']
+            command = rez_command( ['ffmpeg'], ['ffmpeg','-y'], self.processes )
             command.append("-i")
             if mov_webm_path :
                 command.append(mov_webm_path.replace("/","\\"))
@@ -368,38 +483,67 @@ class Transcoding(object):
             command.append(webm_path.replace("/","\\"))
 
         try:
-            webm_p = subprocess.check_call(command)
+            webm_p = self.processes.check_call(command)
         except Exception as e:
-            raise Exception("make webm {}".format(e))
+            raise stage_error("make webm", e)
 
-    def create_nuke_script(self, qc = False ):
+    def _init_webm_path(self, qc = False ):
+        """
+        Set the webm path of the item.
 
-        if qc:
-            self.qc_mov_webm_path = None
-        else:
-            self.mov_webm_path = None
+        :returns: False if the webm doesn't need to be encoded
+        """
         qc_prefix = 'qc_' if qc else '' 
-
+        if self.selected_type == "image":
+            self.webm_path = ""
+            return False
         if self.selected_type == "mov":
             if qc:
+                self.qc_webm_path = self._scratch_path( self.qc_mov_path.replace(self.fileinfo.suffix(),"webm") )
+            else:
+                self.webm_path = self._scratch_path( self.mov_path.replace(self.fileinfo.suffix(),"webm") )
+        else:
+            if qc:
+                self.qc_webm_path = self._scratch_path( os.path.join(os.path.abspath(
+                                os.path.join(self.fileinfo.path(),"../..")),
+                                 qc_prefix + self.fileinfo.format("%h")+"webm") )
+            else:
+                self.webm_path = self._scratch_path( os.path.join(os.path.abspath(
+                                os.path.join(self.fileinfo.path(),"../..")),
+                                 self.fileinfo.format("%h")+"webm") )
+        return True
+
+    def create_nuke_script(self, with_qc = False ):
+        """
+        Set the paths of the media of the item, and write the Nuke script
+        rendering its movs. The mov, the mov for the webm, the HDR mov and
+        the QC movs all hang off a single Read and render in one pass, so
+        every frame is read once.
+
+        :param with_qc: True to render the QC movs too
+        :returns:       The path of the script
+        """
+        self.mov_webm_path = None
+        self.qc_mov_webm_path = None
+        qcs = [ False, True ] if with_qc else [ False ]
+
+        if self.selected_type == "mov":
+            self.read_path = ""
+            self.hdr_path = ""
+            self.mov_path = self.fileinfo.absoluteFilePath()
+            if with_qc:
                 self.qc_read_path = ""
                 self.qc_mov_path = self.fileinfo.absoluteFilePath()
                 self.qc_hdr_path = ""
-            else:
-                self.read_path = ""
-                self.hdr_path = ""
-                self.mov_path = self.fileinfo.absoluteFilePath()
             return
         if self.selected_type == "image":
-            if qc:
+            self.read_path = self.fileinfo.absoluteFilePath()
+            self.hdr_path = ""
+            self.mov_path = self.fileinfo.absoluteFilePath()
+            if with_qc:
                 self.qc_read_path = self.fileinfo.absoluteFilePath()
                 self.qc_hdr_path = ""
                 self.qc_mov_path = self.fileinfo.absoluteFilePath()
-            else:
-                self.read_path = self.fileinfo.absoluteFilePath()
-                self.hdr_path = ""
-                self.mov_path = self.fileinfo.absoluteFilePath()
-
             return
 
         engine = sgtk.platform.current_engine()
@@ -408,24 +552,26 @@ class Transcoding(object):
         check_tag = None
         shotgun = engine.shotgun
         entity_ent = self.context.entity
-        plate_ent = shotgun.find_one("PublishedFileType",[['id','is',54]]) # id 54 => Plate
+        plate_ent = g_shotgun_cache.find_one(shotgun,"PublishedFileType",[['id','is',54]]) # id 54 => Plate
         # print( "=======entity_ent============"   )
         # print(entity_ent)
         if entity_ent['type'] == "Shot":
-            filter_pub = [
-                ['entity','is',entity_ent],
-                ['published_file_type','is',plate_ent]
-            ]
-            publishfile_ents = shotgun.find("PublishedFile",filter_pub,['sg_colorspace'])
-            if publishfile_ents : 
-                shot_info = publishfile_ents[-1]
+            if self.plate_colorspaces:
+                shot_info = self.plate_colorspaces.get( shotgun, entity_ent, plate_ent )
+            else:
+                filter_pub = [
+                    ['entity','is',entity_ent],
+                    ['published_file_type','is',plate_ent]
+                ]
+                publishfile_ents = shotgun.find("PublishedFile",filter_pub,['sg_colorspace'])
+                if publishfile_ents : 
+                    shot_info = publishfile_ents[-1]
             
-            shot_ent = shotgun.find_one("Shot",[['id','is',entity_ent['id']]],['tags'])
             #check_tag = [ x['id'] for x in shot_ent['tags'] if x['id'] in [4591,4830]] 
         
         
         
-        self.output_info = shotgun.find_one("Project",[['id','is',project['id']]],
+        self.output_info = g_shotgun_cache.find_one(shotgun,"Project",[['id','is',project['id']]],
                                ['sg_colorspace','sg_mov_codec',
                                'sg_out_format','sg_fps','sg_mov_colorspace'])
         
@@ -451,6 +597,72 @@ class Transcoding(object):
         print( self.setting.mov_colorspace          )
         print( "=======settting info============"   )
 
+        for qc in qcs:
+            self._init_render_paths( qc )
+
+        # only the ww_burnin shows the timecard, and some projects blank it
+        if self.context.project['name'] in ['westworld','asd2','sweethome']:
+            timecard = 0
+        elif self.timecards:
+            timecard = self.timecards.get( shotgun, self.context.task )
+        else:
+            timecard = logged_minutes( shotgun, self.context.task )
+        
+        if not timecard :
+            timecard = 0
+        else:
+            timecard = timecard / 60
+
+        # each Version's movs are cached on their own, the render only
+        # writes the ones which weren't restored
+        packages = self._nuke_packages( with_qc )
+        first = self.fileinfo.start()
+        last = self.fileinfo.end()
+        script_file = self.tmp_nuke_script_file
+        branches = []
+        for qc in qcs:
+            branch = self._render_branch( qc )
+            if self.transcode_cache and branch["mov"]:
+                nk = self._build_render_script( [ branch ], timecard, first, last, script_file )
+                self._restore_cached_media( qc, nk, timecard, packages )
+                if self._is_cached( qc ):
+                    continue
+            if self.stream_frames:
+                branch["frame_stream"] = FrameStream( self.scratch_dir )
+                if qc:
+                    self.qc_frame_stream = branch["frame_stream"]
+                else:
+                    self.frame_stream = branch["frame_stream"]
+            branches.append( branch )
+        self.render_branches = branches
+        if not branches:
+            return script_file
+
+        # staged frames are removed once the render is done with them
+        input_staging = None
+        if self.staging_threads and len( self.chunk_ranges() ) < 2:
+            input_staging = InputStaging( self.read_path, first, last,
+                                          root = self.scratch_dir,
+                                          threads = self.staging_threads,
+                                          lookahead = self.staging_lookahead )
+            self.input_staging = input_staging
+
+        # long sequences are rendered in chunks by several Nuke processes
+        if not self._create_chunk_scripts( branches, timecard ):
+            nk = self._build_render_script( branches, timecard, first, last,
+                                            script_file, input_staging )
+            self._write_render_script( script_file, nk )
+
+        return script_file 
+
+    def _init_render_paths(self, qc = False ):
+        """
+        Set the paths of the frames and movs of a sequence, and of the
+        script rendering them.
+
+        :param qc:  True for the QC movs
+        """
+        qc_prefix = 'qc_' if qc else '' 
         if qc :
             self.qc_read_path = os.path.join(os.path.abspath(
                                 os.path.join(self.fileinfo.path(),"..")),
@@ -464,10 +676,6 @@ class Transcoding(object):
             self.qc_hdr_path = os.path.join(os.path.abspath(
                                 os.path.join(self.fileinfo.path(),"../..")),
                                  qc_prefix + self.fileinfo.format("%h") + "hdr" + ".mov")
-
-            self.qc_tmp_nuke_script_file = os.path.join(os.path.abspath(
-                                os.path.join(self.fileinfo.path(),"../..")),
-                                 qc_prefix + self.fileinfo.format("%h")+"py")
         else:
             self.read_path = os.path.join(os.path.abspath(
                                 os.path.join(self.fileinfo.path(),"..")),
@@ -481,35 +689,77 @@ class Transcoding(object):
                                 os.path.join(self.fileinfo.path(),"../..")),
                                  self.fileinfo.format("%h") + "hdr" + ".mov")
 
-            self.tmp_nuke_script_file = os.path.join(os.path.abspath(
+            self.tmp_nuke_script_file = self._scratch_path( os.path.join(os.path.abspath(
                                 os.path.join(self.fileinfo.path(),"../..")),
-                                 self.fileinfo.format("%h")+"py")
+                                 self.fileinfo.format("%h")+"py") )
 
-        ## qc file path redefine
-        if qc:
-            read_path = self.qc_read_path
-            mov_path  = self.qc_mov_path
-            hdr_path  = self.qc_hdr_path
-            tmp_nuke_script_file = self.qc_tmp_nuke_script_file
-        else:
-            read_path = self.read_path
-            mov_path  = self.mov_path
-            hdr_path  = self.hdr_path
-            tmp_nuke_script_file = self.tmp_nuke_script_file
-
-
-        timecard = sum([ x['duration'] for x  in 
-                    shotgun.find("TimeLog",
-                                 [['entity','is',self.context.task]],
-                                 ['duration']) ])
-        
-        if not timecard :
-            timecard = 0
-        else:
-            timecard = timecard / 60
-        
+        if not self.setting.mov_fps == "24":
+            if qc:
+                self.qc_mov_webm_path = self._scratch_path( os.path.join(os.path.abspath(
+                                        os.path.join(self.fileinfo.path(),"../..")),
+                                        qc_prefix + self.fileinfo.format("%h").split(".")[0]+"_for_webm.mov") )
+            else:
+                self.mov_webm_path = self._scratch_path( os.path.join(os.path.abspath(
+                                        os.path.join(self.fileinfo.path(),"../..")),
+                                        self.fileinfo.format("%h").split(".")[0]+"_for_webm.mov") )
 
+        if self.stream_frames:
+            # the webm is encoded from the streamed frames too, and the mov
+            # is only needed for sg_path_to_movie
+            if qc:
+                self.qc_mov_webm_path = None
+            else:
+                self.mov_webm_path = None
+            if not self.stream_mov:
+                if qc:
+                    self.qc_mov_path = None
+                else:
+                    self.mov_path = None
+
+    def _render_branch(self, qc = False ):
+        """
+        :param qc:  True for the QC movs
+        :returns:   Dictionary of the movs the render writes for the main or
+                    the QC Version, None for those it doesn't write
+        """
+        return {
+            "qc"            : qc,
+            "mov"           : self.qc_mov_path if qc else self.mov_path,
+            "mov_webm"      : self.qc_mov_webm_path if qc else self.mov_webm_path,
+            # the HDR mov doesn't go through the QC node, the QC Version
+            # would only get the same file
+            "hdr"           : self.hdr_path if not qc and self._renders_hdr() else None,
+            "frame_stream"  : None,
+        }
 
+    def _renders_hdr(self):
+        """
+        :returns: True if the render writes the HDR mov, for sequences in an
+                  ACES colorspace read with the ACES OCIO config
+        """
+        if self.selected_type != "seq":
+            return False
+        if self.setting.colorspace.find('ACES') == -1:
+            return False
+        if platform.system() in ('Windows',"Microsoft"):
+            return False
+        return 'ocio_config' in self._nuke_packages()
+
+    def _build_render_script(self, branches, timecard, first, last, script_file, input_staging = None ):
+        """
+        Build the Nuke script rendering the movs of the main and QC Versions
+        over a range of frames of the sequence. Every Write hangs off the
+        same Read and they're rendered in a single pass.
+
+        :param branches:        The branches of the render, see _render_branch
+        :param timecard:        The hours burnt in the movs
+        :param first:           First frame to render
+        :param last:            Last frame to render
+        :param script_file:     Path the script is written to
+        :param input_staging:   Optional InputStaging the frames are read
+                                from
+        :returns:               The script
+        """
         nk = ''
         nk += '#-*- coding: utf-8 -*-\n'
         nk += 'import nuke\n'
@@ -520,29 +770,56 @@ class Transcoding(object):
         #    nk += 'nuke.root()["colorManagement"].setValue("OCIO")\n'
         #    nk += 'nuke.root()["OCIO_config"].setValue("aces_1.0.1")\n'
 
+        read_path = self.read_path
+        if input_staging:
+            read_path = input_staging.staged_read_path
+            # the format of the Read is read from its first frame
+            nk += input_staging.nuke_wait_first_frame()
         if platform.system() in ('Windows',"Microsoft"):
-            nk += 'read = nuke.nodes.Read( name="Read1",file="{}" )\n'.format( self.read_path.replace("\\","/") )
+            nk += 'read = nuke.nodes.Read( name="Read1",file="{}" )\n'.format( read_path.replace("\\","/") )
         else:
-            nk += 'read = nuke.nodes.Read( name="Read1",file="{}" )\n'.format( self.read_path )
+            nk += 'read = nuke.nodes.Read( name="Read1",file="{}" )\n'.format( read_path )
         nk += 'read["first"].setValue( {} )\n'.format(self.fileinfo.start() )
         nk += 'read["last"].setValue( {} )\n'.format(self.fileinfo.end())
-        if self.fileinfo.tail() in ['.dpx','.exr']:
-            if self.seq_colorspace != "NONE":
-                nk += 'read["colorspace"].setValue( "{}")\n'.format(self.seq_colorspace)
-            else:
-                nk += 'read["colorspace"].setValue( "{}")\n'.format(setting.colorspace)
-        else:
-            nk += 'read["colorspace"].setValue( "{}")\n'.format("rec709")
-        
-        if platform.system() in ('Windows',"Microsoft"):
-            nk += 'output = "{}"\n'.format( mov_path.replace("\\","/") )
-        else:
-            nk += 'output = "{}"\n'.format( mov_path )
+        nk += 'read["colorspace"].setValue( "{}")\n'.format( self._read_colorspace() )
 
         nk += 'width = int(nuke.tcl("expression {0}.width".format(read.name())))\n'
+        nk += 'writes = []\n'
 
+        for branch in branches:
+            nk += self._build_branch_script( branch, timecard )
+            if branch["hdr"]:
+                nk += self._build_hdr_script( branch["hdr"] )
 
-        if qc:
+        if input_staging:
+            nk += input_staging.nuke_callbacks()
+
+        # every write renders in the same pass, so each frame is read once
+        nk += 'nuke.executeMultiple(writes,(({0},{1},1),))\n'.format( first, last )
+        for branch in branches:
+            if branch["frame_stream"]:
+                nk += branch["frame_stream"].nuke_done()
+
+
+        if not platform.system() in ('Windows',"Microsoft"):
+            nk += 'os.remove("{}")\n'.format( script_file )
+        nk += 'exit()\n'
+        return nk
+
+    def _build_branch_script(self, branch, timecard ):
+        """
+        :param branch:      The branch of the render, see _render_branch
+        :param timecard:    The hours burnt in the movs
+        :returns:           The lines of the render script burning in the
+                            frames of the Read and writing the movs of a
+                            branch, with node names prefixed by qc_ for the
+                            QC branch
+        """
+        setting = self.setting
+        prefix = 'qc_' if branch["qc"] else ''
+
+        nk = ''
+        if branch["qc"]:
             nk += 'qc = nuke.nodes.SQCV(name="SQCV", inputs = [read])\n'
             nk += 'qc["which"].setValue(3)\n'
             previous_node = 'qc'
@@ -550,7 +827,7 @@ class Transcoding(object):
             previous_node = 'read'
 
         if self.context.project['name'] in ['westworld','asd2']:
-            nk += 'burnin = nuke.nodes.m83_gizmo(name="m83_gizmo", inputs = [{}])\n'.format( previous_node )
+            nk += 'burnin = nuke.nodes.m83_gizmo(name="{0}m83_gizmo", inputs = [{1}])\n'.format( prefix, previous_node )
             nk += 'burnin["seq"].setValue("{}")\n'.format(self.context.entity['name'].split("_")[0])
             nk += 'burnin["shot"].setValue("{}")\n'.format(self.context.entity['name'].split("_")[1])
             nk += 'burnin["team"].setValue("{}")\n'.format(self.context.step['name'])
@@ -561,9 +838,9 @@ class Transcoding(object):
         else:
             nk += 'if width > 3000 : \n'
             nk += '    reformat = nuke.nodes.Reformat(inputs=[{}],type=2,scale=.5)\n'.format( previous_node )
-            nk += '    burnin = nuke.nodes.ww_burnin(name="ww_burn", inputs = [reformat])\n'
+            nk += '    burnin = nuke.nodes.ww_burnin(name="{}ww_burn", inputs = [reformat])\n'.format( prefix )
             nk += 'else : \n'
-            nk += '    burnin = nuke.nodes.ww_burnin(name="ww_burn", inputs = [{}])\n'.format( previous_node )
+            nk += '    burnin = nuke.nodes.ww_burnin(name="{0}ww_burn", inputs = [{1}])\n'.format( prefix, previous_node )
 
             nk += 'burnin["project_name"].setValue("{}")\n'.format(self.context.project['name'])
             nk += 'burnin["file_name"].setValue("{}")\n'.format(self.fileinfo.format("%h").split(".")[0])
@@ -574,62 +851,37 @@ class Transcoding(object):
             else:
                 nk += 'burnin["timecard"].setValue("{}hrs")\n'.format(timecard)
             nk += 'burnin["description"].setValue("{}")\n'.format(self.desc.replace("\n","_"))
-        nk += 'write = nuke.nodes.Write(name="mov_write", inputs = [burnin],file=output )\n'
-        if self.context.project['name'] in ['westworld','asd2']:
-            nk += 'write["raw"].setValue(True)\n'
-        nk += 'write["file_type"].setValue( "mov" )\n'
-        nk += 'write["create_directories"].setValue(True)\n'
-        if self.context.project['name'] in ['westworld','asd2']:
-            nk += 'write["mov64_codec"].setValue("h264")\n'
-            nk += 'write["mov64_quality"].setValue(2)\n'
-        else:
-            nk += 'write["mov64_codec"].setValue("{}")\n'.format(setting.mov_codec)
-        if self.setting.dnxhd_profile:
-            nk += 'write["mov64_dnxhd_codec_profile"].setValue( "{}")\n'.format(self.setting.dnxhd_profile )
-        #nk += 'write["mov64_fps"].setValue( {})\n'.format(setting.mov_fps)
-        if self.context.project['name'] in ['voice4', 'robin', 'westworld']:
-            nk += 'write["mov64_fps"].setValue({})\n'.format(setting.mov_fps)
-        else:
-            if self.context.project['name'] in ['westworld','asd2'] or self.fps_checked:
-                nk += 'write["mov64_fps"].setValue(23.976)\n'
-            else:
-                nk += 'write["mov64_fps"].setValue(24)\n'
-        if self.fileinfo.tail() in ['.dpx','.exr']:
-            if self.mov_colorspace != "NONE":
-                nk += 'write["colorspace"].setValue( "{}")\n'.format(self.mov_colorspace)
+        if branch["mov"]:
+            if platform.system() in ('Windows',"Microsoft"):
+                nk += 'output = "{}"\n'.format( branch["mov"].replace("\\","/") )
             else:
-                nk += 'write["colorspace"].setValue( "{}")\n'.format(self.setting.mov_colorspace)
-        else:
-            nk += 'write["colorspace"].setValue( "{}")\n'.format("rec709")
-        nk += 'nuke.execute(write,{0},{1},1)\n'.format(self.fileinfo.start(),
-                                                     self.fileinfo.end())
-        #fix play webm in chrome and firefox 
-        
-
-        if not setting.mov_fps == "24":
-            if qc:
-                self.qc_mov_webm_path = os.path.join(os.path.abspath(
-                                        os.path.join(self.fileinfo.path(),"../..")),
-                                        qc_prefix + self.fileinfo.format("%h").split(".")[0]+"_for_webm.mov")
+                nk += 'output = "{}"\n'.format( branch["mov"] )
+            nk += 'write = nuke.nodes.Write(name="{}mov_write", inputs = [burnin],file=output )\n'.format( prefix )
+            if self.context.project['name'] in ['westworld','asd2']:
+                nk += 'write["raw"].setValue(True)\n'
+            nk += 'write["file_type"].setValue( "mov" )\n'
+            nk += 'write["create_directories"].setValue(True)\n'
+            if self.context.project['name'] in ['westworld','asd2']:
+                nk += 'write["mov64_codec"].setValue("h264")\n'
+                nk += 'write["mov64_quality"].setValue(2)\n'
             else:
-                self.mov_webm_path = os.path.join(os.path.abspath(
-                                        os.path.join(self.fileinfo.path(),"../..")),
-                                        self.fileinfo.format("%h").split(".")[0]+"_for_webm.mov")
-
+                nk += 'write["mov64_codec"].setValue("{}")\n'.format(setting.mov_codec)
+            if self.setting.dnxhd_profile:
+                nk += 'write["mov64_dnxhd_codec_profile"].setValue( "{}")\n'.format(self.setting.dnxhd_profile )
+            #nk += 'write["mov64_fps"].setValue( {})\n'.format(setting.mov_fps)
+            nk += 'write["mov64_fps"].setValue({})\n'.format( self._mov_fps() )
+            nk += 'write["colorspace"].setValue( "{}")\n'.format( self._mov_write_colorspace() )
+            nk += 'writes.append(write)\n'
+        #fix play webm in chrome and firefox
 
-            if qc:
-                mov_webm_path = self.qc_mov_webm_path
-            else:
-                mov_webm_path = self.mov_webm_path
-            
-            
+        if branch["mov_webm"]:
             if platform.system() in ('Windows',"Microsoft"):
-                nk += 'webm_output = "{}"\n'.format( mov_webm_path.replace("\\","/") )
+                nk += 'webm_output = "{}"\n'.format( branch["mov_webm"].replace("\\","/") )
             else:
-                nk += 'webm_output = "{}"\n'.format( mov_webm_path )
+                nk += 'webm_output = "{}"\n'.format( branch["mov_webm"] )
 
             
-            nk += 'write = nuke.nodes.Write(name="mov_write", inputs = [burnin],file=webm_output )\n'
+            nk += 'write = nuke.nodes.Write(name="{}webm_write", inputs = [burnin],file=webm_output )\n'.format( prefix )
             nk += 'write["file_type"].setValue( "mov" )\n'
             nk += 'write["create_directories"].setValue(True)\n'
             if self.context.project['name'] in ['westworld','asd2']:
@@ -641,12 +893,7 @@ class Transcoding(object):
             if self.setting.dnxhd_profile:
                 nk += 'write["mov64_dnxhd_codec_profile"].setValue( "{}")\n'.format(self.setting.dnxhd_profile )
 
-            if self.context.project['name'] in ['voice4','robin', 'westworld']:
-                nk += 'write["mov64_fps"].setValue({})\n'.format(setting.mov_fps)
-            elif self.fps_checked:
-                nk += 'write["mov64_fps"].setValue(23.976)\n'
-            else:
-                nk += 'write["mov64_fps"].setValue(24)\n'
+            nk += 'write["mov64_fps"].setValue({})\n'.format( self._webm_fps() )
             if self.fileinfo.tail() in ['.dpx','.exr']:
                 if self.mov_colorspace != "NONE":
                     nk += 'write["colorspace"].setValue( "{}")\n'.format(setting.mov_colorspace)
@@ -655,26 +902,193 @@ class Transcoding(object):
                 
             else:
                 nk += 'write["colorspace"].setValue( "{}")\n'.format("rec709")
-            nk += 'nuke.execute(write,{0},{1},1)\n'.format(self.fileinfo.start(),
-                                                     self.fileinfo.end())
-
+            nk += 'writes.append(write)\n'
+
+        if branch["frame_stream"]:
+            nk += branch["frame_stream"].nuke_write( 'burnin', self._mov_write_colorspace(),
+                                                     prefix + 'stream' )
+            nk += 'writes.append({}stream)\n'.format( prefix )
+        return nk
+
+    def _build_hdr_script(self, hdr_path ):
+        """
+        :param hdr_path:    The HDR mov to write
+        :returns:           The lines of the render script writing the HDR
+                            mov from the Read, with its frames read as
+                            ACES2065-1 and written in Output - Rec.709 by the
+                            ACES OCIO config of the render
+        """
+        read_colorspace = self._read_colorspace()
+        source_node = 'read'
+        nk = ''
+        if read_colorspace != "ACES - ACES2065-1":
+            # back to the code values of the frames, then from ACES2065-1
+            nk += 'hdr_source = nuke.nodes.OCIOColorSpace(name="hdr_source", inputs = [read])\n'
+            nk += 'hdr_source["in_colorspace"].setValue( "scene_linear" )\n'
+            nk += 'hdr_source["out_colorspace"].setValue( "{}" )\n'.format( read_colorspace )
+            nk += 'hdr_aces = nuke.nodes.OCIOColorSpace(name="hdr_aces", inputs = [hdr_source])\n'
+            nk += 'hdr_aces["in_colorspace"].setValue( "ACES - ACES2065-1" )\n'
+            nk += 'hdr_aces["out_colorspace"].setValue( "scene_linear" )\n'
+            source_node = 'hdr_aces'
+        nk += 'hdr_output = "{}"\n'.format( hdr_path )
+        nk += 'write = nuke.nodes.Write(name="hdr_write", inputs = [{}],file=hdr_output )\n'.format( source_node )
+        nk += 'write["file_type"].setValue( "mov" )\n'
+        nk += 'write["create_directories"].setValue(True)\n'
+        nk += 'write["mov64_codec"].setValue("{}")\n'.format("ap4h")
+        nk += 'write["mov64_fps"].setValue({})\n'.format(self.setting.mov_fps)
+        nk += 'write["colorspace"].setValue( "{}")\n'.format("Output - Rec.709")
+        nk += 'writes.append(write)\n'
+        return nk
 
-        if not platform.system() in ('Windows',"Microsoft"):
-            nk += 'os.remove("{}")\n'.format( tmp_nuke_script_file)
-        nk += 'exit()\n'
-        
-        if not os.path.exists( os.path.dirname( tmp_nuke_script_file) ):
+    def _read_colorspace(self):
+        """
+        :returns: The colorspace of the Read of the render
+        """
+        if self.fileinfo.tail() in ['.dpx','.exr']:
+            if self.seq_colorspace != "NONE":
+                return self.seq_colorspace
+            return self.setting.colorspace
+        return "rec709"
+
+    def _mov_fps(self):
+        """
+        :returns: The frame rate of the mov
+        """
+        if self.context.project['name'] in ['voice4', 'robin', 'westworld']:
+            return self.setting.mov_fps
+        if self.context.project['name'] in ['westworld','asd2'] or self.fps_checked:
+            return 23.976
+        return 24
+
+    def _webm_fps(self):
+        """
+        :returns: The frame rate of the webm
+        """
+        if self.context.project['name'] in ['voice4','robin', 'westworld']:
+            return self.setting.mov_fps
+        if self.fps_checked:
+            return 23.976
+        return 24
+
+    def _mov_write_colorspace(self):
+        """
+        :returns: The colorspace of the mov Write
+        """
+        if self.fileinfo.tail() in ['.dpx','.exr']:
+            if self.mov_colorspace != "NONE":
+                return self.mov_colorspace
+            return self.setting.mov_colorspace
+        return "rec709"
+
+    def _write_render_script(self, script_file, nk ):
+        """
+        Write a Nuke script, creating its folder if needed.
+        """
+        if not os.path.exists( os.path.dirname( script_file) ):
             cur_umask = os.umask(0)
-            os.makedirs(os.path.dirname( tmp_nuke_script_file),0o777 )
+            os.makedirs(os.path.dirname( script_file),0o777 )
             os.umask(cur_umask)
 
-
-        with open( tmp_nuke_script_file, 'w' ) as f:
+        with open( script_file, 'w' ) as f:
             f.write( nk )
         
-        os.chmod( tmp_nuke_script_file, 0o777 )
-
-        return tmp_nuke_script_file 
+        os.chmod( script_file, 0o777 )
+
+    def _is_cached(self, qc = False ):
+        """
+        :returns: True if the media of the item were restored from the
+                  transcode cache
+        """
+        return self.qc_cached if qc else self.cached
+
+    def _restore_cached_media(self, qc, nk, timecard, packages ):
+        """
+        Fingerprint the source frames and the transcode settings, and restore
+        the media from the transcode cache if they were already transcoded.
+
+        :param qc:          True for the QC media
+        :param nk:          The render script of the movs of the Version
+        :param timecard:    The hours burnt in the mov
+        :param packages:    The rez packages of the render
+        """
+        # the scratch folder is created for every job, so the paths of the
+        # intermediate files in it don't change the output
+        script = nk
+        if self.scratch_dir:
+            for scratch_dir in set( [ self.scratch_dir, self.scratch_dir.replace("\\","/") ] ):
+                script = script.replace( scratch_dir, "<scratch>" )
+
+        settings = {
+            "qc"                : qc,
+            "packages"          : packages,
+            "output_info"       : self.output_info,
+            "colorspace"        : self.setting.colorspace,
+            "mov_colorspace"    : self.setting.mov_colorspace,
+            "mov_codec"         : self.setting.mov_codec,
+            "dnxhd_profile"     : self.setting.dnxhd_profile,
+            "seq_colorspace"    : self.seq_colorspace,
+            "mov_colorspace_override" : self.mov_colorspace,
+            "fps_checked"       : self.fps_checked,
+            "stream_frames"     : self.stream_frames,
+            "burnin"            : [ self.context.project, self.context.entity,
+                                    self.context.step, self.context.user,
+                                    self.context.task, self.desc, timecard ],
+            # whatever else ends up in the render
+            "script"            : script,
+        }
+        key = fingerprint( self.fileinfo, settings )
+        outputs = self._transcoded_media( qc )
+        cached = self.transcode_cache.restore( key, outputs )
+        if qc:
+            self.qc_cache_key = key
+            self.qc_cached = cached
+            if cached:
+                self.qc_thumbnail_file = outputs["thumbnail"]
+        else:
+            self.cache_key = key
+            self.cached = cached
+            if cached:
+                self.thumbnail_file = outputs["thumbnail"]
+
+    def store_cached_media(self, qc = False ):
+        """
+        Save the transcoded media of the item to the transcode cache, before
+        the uploads remove them.
+        """
+        key = self.qc_cache_key if qc else self.cache_key
+        if not self.transcode_cache or not key or self._is_cached( qc ):
+            return
+        self.transcode_cache.store( key, self._transcoded_media( qc ) )
+
+    def _transcoded_media(self, qc = False ):
+        """
+        Set the paths of the media transcoded from a sequence.
+
+        :returns: Dictionary of media name to path
+        """
+        self._init_mp4_path( qc )
+        self._init_webm_path( qc )
+        thumbnail_file = self._init_thumbnail_path( qc ) + ".jpg"
+        filmstream_file = self._init_filmstream_file( qc )
+        if qc:
+            outputs = {
+                "mov"       : self.qc_mov_path,
+                "mov_webm"  : self.qc_mov_webm_path,
+                "mp4"       : self.qc_mp4_path,
+                "webm"      : self.qc_webm_path,
+            }
+        else:
+            outputs = {
+                "mov"       : self.mov_path,
+                "mov_webm"  : self.mov_webm_path,
+                "mp4"       : self.mp4_path,
+                "webm"      : self.webm_path,
+            }
+        outputs["thumbnail"] = thumbnail_file
+        outputs["filmstrip"] = filmstream_file
+        if not qc and self._renders_hdr():
+            outputs["hdr"] = self.hdr_path
+        return dict( (name, path) for name, path in outputs.items() if path )
 
     
     def create_thumbnail_for_image(self , qc = False ):
@@ -684,18 +1098,23 @@ class Transcoding(object):
             return
 
         if qc:
-            self.qc_thumbnail_file = self.fileinfo.absoluteFilePath().replace(
-                self.fileinfo.suffix(),"qc_thumb.jpg")
+            self.qc_thumbnail_file = self._scratch_path( self.fileinfo.absoluteFilePath().replace(
+                self.fileinfo.suffix(),"qc_thumb.jpg") )
 
             thumbnail_file = self.qc_thumbnail_file
             read_path = self.qc_read_path
         else:
-            self.thumbnail_file = self.fileinfo.absoluteFilePath().replace(
-                self.fileinfo.suffix(),"thumb.jpg")
+            self.thumbnail_file = self._scratch_path( self.fileinfo.absoluteFilePath().replace(
+                self.fileinfo.suffix(),"thumb.jpg") )
             thumbnail_file = self.thumbnail_file
             read_path = self.read_path
 
-        command = ['rez-env',"ffmpeg","--","ffmpeg","-y"]
+        # stills Qt or our DPX and EXR readers can decode don't need ffmpeg
+        image = load_still_thumbnail( read_path )
+        if image is not None and image.save( thumbnail_file, "JPG", 92 ):
+            return
+
+        command = rez_command( ["ffmpeg"], ["ffmpeg","-y"], self.processes )
         command.append("-i")
         command.append(read_path)
         command.append("-f")
@@ -703,197 +1122,307 @@ class Transcoding(object):
         command.append( thumbnail_file )
 
         try:
-            webm_p = subprocess.check_call(command)
+            webm_p = self.processes.check_call(command)
         except Exception as e:
-            raise Exception("make webm {}".format(e))
+            raise stage_error("make image thumbnail", e)
 
 
     def _get_mov_frame(self,mov_file):
         
+        if self.selected_type == "seq":
+            # the mov is rendered over the whole frame range of the sequence
+            return self.fileinfo.end() - self.fileinfo.start() + 1
+
         if self.selected_type == "mov":
             if self.fileinfo.suffix() in ['ogv']:
                 mov_file = self.mp4_path
 
-        command = ['rez-env',"ffmpeg","--","ffprobe"]
-        command.append(mov_file)
-        command.append("-select_streams")
-        command.append("v")
-        command.append("-show_entries")
-        command.append("stream=nb_frames")
-        command.append("-of")
-        command.append("default=nk=1:nw=1")
-        command.append("-v")
-        command.append("quiet")
-
         try:
-            webm_p = subprocess.Popen(command,stdout=subprocess.PIPE)
-            output,err = webm_p.communicate()
-            return int(output)
+            return int( g_media_info.get( mov_file, self.processes )["frames"] )
         except Exception as e:
-            raise Exception("make webm {}".format(e))
+            raise stage_error("count frames of {}".format(mov_file), e)
         
         
 
     def create_thumbnail(self, qc = False ):
-        qc_prefix = 'qc_' if qc else ''
 
         if self.selected_type == "image":
             self.filmstream_file = ""
             return
-        if self.selected_type == "mov":
-            self.thumbnail_path = self.mov_path.replace(
-                self.fileinfo.suffix(), "thumb")
-        else:
-            self.thumbnail_path = os.path.join(os.path.abspath(
-                                os.path.join(self.fileinfo.path(),"../..")),
-                                 self.fileinfo.format("%h")+"_thumb")
-        
-        ## qc folder 변경
-        if qc:
-            if self.selected_type == "mov":
-                self.qc_thumbnail_path = self.qc_mov_path.replace(
-                    self.fileinfo.suffix(), "qc_thumb")
-            else:
-                self.qc_thumbnail_path = os.path.join(os.path.abspath(
-                                    os.path.join(self.fileinfo.path(),"../..")),
-                                     qc_prefix + self.fileinfo.format("%h")+"qc_thumb")
-
-            thumbnail_path = self.qc_thumbnail_path 
-        else:
-            thumbnail_path = self.thumbnail_path
-
-
-        if not os.path.exists( thumbnail_path ):
-            cur_umask = os.umask(0)
-            os.makedirs( thumbnail_path, 0o777 )
-            os.umask(cur_umask)
-        if self.selected_type == "mov":
-            thumb_template = os.path.join( thumbnail_path,
-                                      qc_prefix + self.fileinfo.fileName()+".%04d.jpg")
-        else:
-            thumb_template = os.path.join( thumbnail_path,
-                                      qc_prefix + self.fileinfo.format("%h%p")+".jpg")
+        if self._is_cached( qc ):
+            return
+        thumbnail_file = self._init_thumbnail_path( qc ) + ".jpg"
+        filmstream_file = self._init_filmstream_file( qc )
 
         ## 인스턴스 멤버변수로 사용되는 함수는 메소드 내에서 qc_prefix를 
         ## 파일명앞에 붙여서 로컬 변수로 다시 정의 해서 사용
         mov_path = self.qc_mov_path if qc else self.mov_path
         
 
-        select_code = self._get_mov_frame( mov_path )
-        select_code /= 30
+        frame_count = self._get_mov_frame( mov_path )
+        select_code = frame_count // 30
         if select_code == 0:
             select_code = 1
+        # the poster is the middle one of the sampled frames
+        samples = len( range( select_code, frame_count, select_code ) ) or 1
+        builder = FilmstripBuilder( poster_index = samples // 2 )
+
+        # the sampled frames are piped to us instead of written to disk
+        command = rez_command( ["ffmpeg"], ["ffmpeg","-y"], self.processes )
+        command.append("-r")
+        command.append("24")
+        command.append("-i")
+        command.append( _native_path( mov_path ) )
+        command.append("-vf")
         if platform.system() == "Linux":
-            command = ['rez-env',"ffmpeg","--","ffmpeg","-y"]
-            command.append("-r")
-            command.append("24")
-            command.append("-i")
-            command.append(mov_path)
-            command.append("-vf")
             command.append("select='gte(n\,{0})*not(mod(n\,{0}))'".format(select_code))
-            command.append("-vsync")
-            command.append("0")
-            command.append("-f")
-            command.append("image2")
-            command.append(thumb_template)
-        
         else:
-            command = ['rez-env',"ffmpeg","--","ffmpeg","-y"]
-            command.append("-r")
-            command.append("24")
-            command.append("-i")
-            command.append(mov_path.replace("/","\\"))
-            command.append("-vf")
             command.append("select=gte(n\,{0})*not(mod(n\,{0}))".format(select_code))
-            command.append("-vsync")
-            command.append("0")
-            command.append("-f")
-            command.append("image2")
-            thumb_template =  thumb_template.replace("%","%%")
-            command.append(thumb_template.replace("/","\\"))
+        command.append("-vsync")
+        command.append("0")
+        command.append("-f")
+        command.append("image2pipe")
+        command.append("-vcodec")
+        command.append("ppm")
+        command.append("-")
 
         try:
-            webm_p = subprocess.check_call(command)
+            process = self.processes.popen(command, stdout=subprocess.PIPE)
+            try:
+                for image in read_ppm_frames( process.stdout ):
+                    builder.add_frame( image )
+            finally:
+                self.processes.wait( process )
+            if process.returncode:
+                raise subprocess.CalledProcessError(process.returncode, command)
         except Exception as e:
-            raise Exception("make images {}".format(e))
-        
+            raise stage_error("make images", e)
 
-        if self.selected_type == "mov":
-            thumb_template = os.path.join( thumbnail_path,
-                                      qc_prefix + self.fileinfo.fileName()+"*")
-        else:
-            thumb_template = os.path.join( thumbnail_path,
-                                      qc_prefix + self.fileinfo.format("%h")+"*")
+        try:
+            builder.save( filmstream_file, thumbnail_file )
+        except Exception as e:
+            raise stage_error("make filmstrip", e)
 
-        if self.selected_type == "mov":
-            self.filmstream_file = mov_path.replace(self.fileinfo.suffix(),"_film-0.jpg")
+        if qc:
+            self.qc_thumbnail_file = thumbnail_file
         else:
-            self.filmstream_file = os.path.join(os.path.abspath(
-                                os.path.join(self.fileinfo.path(),"../..")),
-                                 self.fileinfo.format("%h")+"_film_-0.jpg")
+            self.thumbnail_file    = thumbnail_file
+
+    def create_review_media(self, qc = False ):
+        """
+        Decode the mov once and write the mp4, the webm, the thumbnail and the
+        filmstrip with a single ffmpeg filter graph, instead of running one
+        ffmpeg per output. Sets the same paths as create_mp4, create_webm and
+        create_thumbnail.
+
+        When the frames are streamed, they are encoded while the mov stage
+        renders them instead of being read back from the mov.
+        """
+        if self.selected_type == "image" or \
+            ( self.selected_type == "mov" and self.fileinfo.suffix() == "ogv" ):
+            # nothing to decode for images, and ogv movies don't store their
+            # frame count so it is read from the encoded mp4.
+            self.create_mp4( qc )
+            self.create_webm( qc )
+            self.create_thumbnail( qc )
+            return
+        if self._is_cached( qc ):
+            return
+
+        need_mp4 = self._init_mp4_path( qc )
+        self._init_webm_path( qc )
+        thumbnail_path = self._init_thumbnail_path( qc )
+        filmstream_file = self._init_filmstream_file( qc )
+        thumbnail_file = thumbnail_path + ".jpg"
 
         if qc:
-            self.qc_filmstream_file = os.path.dirname( self.filmstream_file ) + os.sep + qc_prefix + os.path.basename( self.filmstream_file )
-            filmstream_file = self.qc_filmstream_file
+            mov_path      = self.qc_mov_path
+            mp4_path      = self.qc_mp4_path
+            webm_path     = self.qc_webm_path
+            mov_webm_path = self.qc_mov_webm_path
         else:
-            filmstream_file = self.filmstream_file
+            mov_path      = self.mov_path
+            mp4_path      = self.mp4_path
+            webm_path     = self.webm_path
+            mov_webm_path = self.mov_webm_path
+        frame_stream = self.qc_frame_stream if qc else self.frame_stream
+
+        # same sampling as create_thumbnail: every n-th frame, ~30 frames
+        frame_count = self._get_mov_frame( mov_path )
+        step = max( 1, frame_count // 30 )
+        samples = list( range( step, frame_count, step ) ) or [0]
+        if samples == [0]:
+            sample_select = "select='eq(n\,0)'"
+        else:
+            sample_select = "select='gte(n\,{0})*not(mod(n\,{0}))'".format(step)
+        poster_select = "select='eq(n\,{0})'".format( samples[len(samples)//2] )
 
         if platform.system() == "Linux":
-            command = ['montage']
-            command.append(thumb_template)
-            command.append("-geometry")
-            command.append("240x+0+0")
-            command.append("-tile")
-            command.append("x1")
-            command.append("-format")
-            command.append("jpeg")
-            command.append("-quality")
-            command.append("92")
-            command.append( filmstream_file )
-        else:
-            command = ['magick','montage']
-            command.append(thumb_template.replace("/","\\"))
-            command.append("-geometry")
-            command.append("240x+0+0")
-            command.append("-tile")
-            command.append("x1")
-            command.append("-format")
-            command.append("jpeg")
-            command.append("-quality")
-            command.append("92")
-            command.append( filmstream_file.replace("/","\\"))
+            pad = "pad=ceil(iw/2)*2:ceil(ih/2)*2"
+        else:
+            pad = "null"
+
+        webm_filter = pad
+        webm_rate = []
+        command = rez_command( ['ffmpeg'], ['ffmpeg','-y'], self.processes )
+        if frame_stream:
+            command.extend(["-framerate", str( self._mov_fps() )])
+            command.extend( frame_stream.ffmpeg_input )
+            if self._webm_fps() != self._mov_fps():
+                webm_filter = "setpts=N/({0}*TB),{1}".format( self._webm_fps(), pad )
+                webm_rate = ["-r", str( self._webm_fps() )]
+        else:
+            command.append("-i")
+            command.append( _native_path( mov_path ) )
+        # webm is encoded from the _for_webm mov when there is one
+        branches = ["thumb", "film"]
+        if need_mp4:
+            branches.append("mp4")
+        if mov_webm_path:
+            command.append("-i")
+            command.append( _native_path( mov_webm_path ) )
+            webm_input = "1"
+        else:
+            branches.append("webm")
+            webm_input = "0"
+
+        filters = []
+        filters.append( "[0:v]split={0}{1}".format(
+            len(branches), "".join( "[%s_in]" % x for x in branches ) ) )
+        filters.append( "[thumb_in]{0}[thumb]".format( poster_select ) )
+        filters.append( "[film_in]{0},scale=240:-1,tile={1}x1[film]".format(
+            sample_select, len(samples) ) )
+        if need_mp4:
+            filters.append( "[mp4_in]{0}[mp4]".format( pad ) )
+        if mov_webm_path:
+            filters.append( "[1:v]{0}[webm]".format( pad ) )
+        else:
+            filters.append( "[webm_in]{0}[webm]".format( webm_filter ) )
+        command.append("-filter_complex")
+        command.append( ";".join( filters ) )
+
+        if need_mp4:
+            command.extend(["-map", "[mp4]", "-map", "0:a?"])
+            command.extend(["-vcodec", "libx264", "-pix_fmt", "yuv420p", "-crf", "18"])
+            command.append( _native_path( mp4_path ) )
+
+        command.extend(["-map", "[webm]", "-map", webm_input + ":a?"])
+        command.extend(["-vcodec", "libvpx", "-pix_fmt", "yuv420p", "-g", "30",
+                        "-b:v", "2000k", "-quality", "realtime", "-cpu-used", "0",
+                        "-qmin", "10", "-qmax", "42"] + webm_rate)
+        command.append( _native_path( webm_path ) )
+
+        command.extend(["-map", "[thumb]", "-frames:v", "1", "-q:v", "2",
+                        "-f", "image2", "-update", "1"])
+        command.append( _native_path( thumbnail_file ) )
+
+        command.extend(["-map", "[film]", "-frames:v", "1", "-q:v", "2",
+                        "-f", "image2", "-update", "1"])
+        command.append( _native_path( filmstream_file ) )
 
         try:
-            webm_p = subprocess.check_call(command)
+            if frame_stream:
+                self._encode_frame_stream( command, frame_stream )
+            else:
+                self.processes.check_call(command)
         except Exception as e:
-            raise Exception("make montage {}".format(e))
-        
-        thumbnail_files = os.listdir(thumbnail_path)
-        thumbnail_file = os.path.join(
-                            thumbnail_path,
-                            thumbnail_files[len(thumbnail_files)/2]
-                            )
+            raise stage_error("make review media", e)
+        finally:
+            if frame_stream:
+                frame_stream.remove()
+
+        if qc:
+            self.qc_thumbnail_file = thumbnail_file
+        else:
+            self.thumbnail_file    = thumbnail_file
+
+    def _encode_frame_stream(self, command, frame_stream ):
+        """
+        Run ffmpeg, feeding it the frames of a FrameStream as they are
+        rendered.
+
+        :param command:         The ffmpeg command, reading from stdin
+        :param frame_stream:    The FrameStream of the render
+        """
+        process = self.processes.popen( command, stdin = subprocess.PIPE )
+        try:
+            frame_stream.feed( process.stdin, self.processes.check_cancelled )
+            process.stdin.close()
+        except Exception:
+            # don't leave half encoded media behind a failed render
+            kill_process_tree( process )
+            raise
+        finally:
+            self.processes.wait( process )
+        if process.returncode:
+            raise subprocess.CalledProcessError(process.returncode, command)
+
+    def _init_thumbnail_path(self, qc = False ):
+        """
+        Set the thumbnail path of the item, the thumbnail file being that
+        path with a .jpg extension.
+
+        :returns: The thumbnail path
+        """
+        qc_prefix = 'qc_' if qc else ''
+        if self.selected_type == "mov":
+            self.thumbnail_path = self._scratch_path( self.mov_path.replace(
+                self.fileinfo.suffix(), "thumb") )
+        else:
+            self.thumbnail_path = self._scratch_path( os.path.join(os.path.abspath(
+                                os.path.join(self.fileinfo.path(),"../..")),
+                                 self.fileinfo.format("%h")+"_thumb") )
         
-            
-        shutil.copyfile(thumbnail_file , thumbnail_path+".jpg")
+        ## qc folder 변경
+        if qc:
+            if self.selected_type == "mov":
+                self.qc_thumbnail_path = self._scratch_path( self.qc_mov_path.replace(
+                    self.fileinfo.suffix(), "qc_thumb") )
+            else:
+                self.qc_thumbnail_path = self._scratch_path( os.path.join(os.path.abspath(
+                                    os.path.join(self.fileinfo.path(),"../..")),
+                                     qc_prefix + self.fileinfo.format("%h")+"qc_thumb") )
+
+            thumbnail_path = self.qc_thumbnail_path 
+        else:
+            thumbnail_path = self.thumbnail_path
+        return thumbnail_path
+
+    def _init_filmstream_file(self, qc = False ):
+        """
+        Set the filmstrip file of the item.
+
+        :returns: The filmstrip file path
+        """
+        qc_prefix = 'qc_' if qc else ''
+        mov_path = self.qc_mov_path if qc else self.mov_path
+
+        if self.selected_type == "mov":
+            self.filmstream_file = self._scratch_path( mov_path.replace(self.fileinfo.suffix(),"_film-0.jpg") )
+        else:
+            self.filmstream_file = self._scratch_path( os.path.join(os.path.abspath(
+                                os.path.join(self.fileinfo.path(),"../..")),
+                                 self.fileinfo.format("%h")+"_film_-0.jpg") )
 
         if qc:
-            self.qc_thumbnail_file = thumbnail_path + ".jpg"
+            self.qc_filmstream_file = os.path.dirname( self.filmstream_file ) + os.sep + qc_prefix + os.path.basename( self.filmstream_file )
+            filmstream_file = self.qc_filmstream_file
         else:
-            self.thumbnail_file    = thumbnail_path + ".jpg"
+            filmstream_file = self.filmstream_file
+        return filmstream_file
+
+def _native_path(path):
+    """
+    :returns: The path with the separators of the current platform
+    """
+    if platform.system() in ('Windows',"Microsoft"):
+        return path.replace("/","\\")
+    return path
 
-        if platform.system() == "Linux":
-            command = ['rm','-rf', thumbnail_path]
-        #else:
-            #command = ['rd','/S','/Q',self.thumbnail_path.replace("/","\\")]
-            try:
-                webm_p = subprocess.check_call(command)
-            except Exception as e:
-                raise Exception("rm thumbnail_path {0},{1}".format(e,command))
 
 class UploadVersion(object):
     
-    def __init__(self,fileinfo,context,selected_type):
+    def __init__(self,fileinfo,context,selected_type, connections = None, check_cancelled = None, version_batch = None, remove_media = True):
         
         if selected_type in ["mov","image"]:
             self.fileinfo = fileinfo
@@ -902,10 +1431,32 @@ class UploadVersion(object):
 
         self.selected_type = selected_type
         self.context = context
-        self.sg = self.context.sgtk.shotgun
 
+        # optional ShotgunConnectionPool the requests are sent through
+        self.connections = connections
+        self.check_cancelled = check_cancelled
+        # optional VersionBatch the Version is created or updated through
+        self.version_batch = version_batch
+        # False to keep the uploaded media, e.g. until they're cached, and
+        # remove them with remove_uploaded_media
+        self.remove_media = remove_media
+
+    @contextlib.contextmanager
+    def _shotgun(self):
+        """
+        Context manager giving a connection of the pool, or the Shotgun
+        connection of the calling thread if there's no pool.
+        """
+        if not self.connections:
+            yield self.context.sgtk.shotgun
+            return
+        with self.connections.connection( self.check_cancelled ) as sg:
+            yield sg
 
-    def create_version(self, frame_path, mov_path, desc, hdr_path, qc = False):
+    def version_code(self, qc = False ):
+        """
+        :returns: The code of the Version, or of the QC Version
+        """
         qc_prefix = 'qc_' if qc else ''
         
         if self.selected_type in ["mov","image"]:
@@ -914,7 +1465,10 @@ class UploadVersion(object):
         else:
             code = self.fileinfo.format("%h").split(".")[0]
 
-        code = qc_prefix + code
+        return qc_prefix + code
+
+    def create_version(self, frame_path, mov_path, desc, hdr_path, qc = False):
+        code = self.version_code( qc )
 
         data = {
             "project" : self.context.project,
@@ -928,6 +1482,18 @@ class UploadVersion(object):
             "sg_first_frame" :1,
             "description" :desc
         }
+
+        if self.version_batch:
+            update_data = {
+            "sg_path_to_movie" :mov_path,
+            "sg_path_to_frames" :frame_path,
+            "sg_path_to_hdr" : hdr_path,
+            "description" :desc
+                }
+            self.version = self.version_batch.submit( self._shotgun, code,
+                                                      self.context.project, self.context.task,
+                                                      data, update_data )
+            return
         
         search_filter = [
             ['code','is',code],
@@ -935,53 +1501,75 @@ class UploadVersion(object):
             ['sg_task','is',self.context.task]
             ]
 
-        current_version = self.sg.find("Version",search_filter)
-        if current_version:
-            self.version = current_version[0]
-            data = {
-            "sg_path_to_movie" :mov_path,
-            "sg_path_to_frames" :frame_path,
-            "sg_path_to_hdr" : hdr_path,
-            "description" :desc
-                }
-            self.sg.update("Version",self.version['id'],data)
-        else:
-            self.version = self.sg.create("Version",data)
+        with self._shotgun() as sg:
+            current_version = sg.find("Version",search_filter)
+            if current_version:
+                self.version = current_version[0]
+                data = {
+                "sg_path_to_movie" :mov_path,
+                "sg_path_to_frames" :frame_path,
+                "sg_path_to_hdr" : hdr_path,
+                "description" :desc
+                    }
+                sg.update("Version",self.version['id'],data)
+            else:
+                self.version = sg.create("Version",data)
 
     
     def upload_thumbnail(self,thumbnail_file):
 
-        self.sg.upload_thumbnail("Version",self.version['id'],thumbnail_file)
-        os.remove(thumbnail_file)
+        with self._shotgun() as sg:
+            sg.upload_thumbnail("Version",self.version['id'],thumbnail_file)
+        if self.remove_media:
+            os.remove(thumbnail_file)
 
     def upload_filmstrip_thumbnail(self,filmstream_file):
 
         if self.selected_type == "image":
             return
 
-        self.sg.upload_filmstrip_thumbnail("Version",self.version['id'],filmstream_file)
-        os.remove(filmstream_file)
+        with self._shotgun() as sg:
+            sg.upload_filmstrip_thumbnail("Version",self.version['id'],filmstream_file)
+        if self.remove_media:
+            os.remove(filmstream_file)
     
     def upload_mov(self,mov_file):
 
         if self.selected_type == "image":
             return
-        self.sg.upload("Version",self.version['id'],mov_file,'sg_uploaded_movie')
+        with self._shotgun() as sg:
+            sg.upload("Version",self.version['id'],mov_file,'sg_uploaded_movie')
 
     def upload_mp4(self,mp4_file):
 
         if self.selected_type == "image":
-            self.sg.upload("Version",self.version['id'],mp4_file,'sg_uploaded_movie_image')
+            with self._shotgun() as sg:
+                sg.upload("Version",self.version['id'],mp4_file,'sg_uploaded_movie_image')
             return
-        self.sg.upload("Version",self.version['id'],mp4_file,'sg_uploaded_movie_mp4')
+        with self._shotgun() as sg:
+            sg.upload("Version",self.version['id'],mp4_file,'sg_uploaded_movie_mp4')
     
     def upload_webm(self,webm_file,mov_webm_path):
 
         if self.selected_type == "image":
             return
-        self.sg.upload("Version",self.version['id'],webm_file,'sg_uploaded_movie_webm')
-        os.remove(webm_file)
-        if mov_webm_path:
-            os.remove(mov_webm_path)
+        with self._shotgun() as sg:
+            sg.upload("Version",self.version['id'],webm_file,'sg_uploaded_movie_webm')
+        if self.remove_media:
+            os.remove(webm_file)
+            if mov_webm_path:
+                os.remove(mov_webm_path)
+
+    def remove_uploaded_media(self, thumbnail_file, filmstream_file, webm_file, mov_webm_path):
+        """
+        Remove the media the uploads keep when remove_media is False, once
+        they are uploaded.
+        """
+        paths = [thumbnail_file]
+        if not self.selected_type == "image":
+            paths.extend([filmstream_file, webm_file, mov_webm_path])
+        for path in paths:
+            if path and os.path.exists(path):
+                os.remove(path)
 
 
@@ -0,0 +1,251 @@
+# -*- coding: utf-8 -*-
+# Copyright (c) 2015 Shotgun Software Inc.
+#
+# CONFIDENTIAL AND PROPRIETARY
+#
+# This work is provided "AS IS" and subject to the Shotgun Pipeline Toolkit
+# Source Code License included in this distribution package. See LICENSE.
+# By accessing, using, copying or modifying this work you indicate your
+# agreement to the Shotgun Pipeline Toolkit Source Code License. All rights
+# not expressly granted therein are reserved by Shotgun Software Inc.
+
+"""
+Creation and update of the Versions of an upload batch in as few Shotgun
+requests as possible: existing Versions are looked up with a single query per
+project, and the creates and updates requested by concurrent jobs are grouped
+in a single batch request.
+"""
+import time
+import threading
+
+
+class VersionBatch(object):
+    """
+    Versions of an upload batch, keyed by code, project and task.
+
+    The first job submitting a Version waits window seconds for the other
+    jobs to submit theirs, then sends every pending submission. The first
+    lookup includes every candidate Version of the batch, so later
+    submissions don't need one.
+    """
+
+    def __init__(self, window=0.2):
+        """
+        Construction
+
+        :param window: Seconds submissions are collected for before being
+                       sent together
+        """
+        self.window = window
+        self._lock = threading.Lock()
+        self._candidates = set()
+        # Version of each looked up key, None if there's none
+        self._versions = {}
+        self._pending = []
+        self._flushing = False
+
+    def add_candidates(self, project, task, codes):
+        """
+        Add Versions which may be submitted, so they're looked up with the
+        first submission.
+
+        :param project: The project entity dictionary
+        :param task:    The task entity dictionary, or None
+        :param codes:   List of Version codes
+        """
+        with self._lock:
+            for code in codes:
+                self._candidates.add(_key(code, project, task))
+
+    def submit(self, shotgun, code, project, task, create_data, update_data):
+        """
+        Create a Version, or update it if it exists, along with the other
+        submissions made in the meantime.
+
+        :param shotgun:     Callable returning a context manager giving a
+                            Shotgun connection
+        :param code:        The Version code
+        :param project:     The project entity dictionary
+        :param task:        The task entity dictionary, or None
+        :param create_data: Fields of the Version if it's created
+        :param update_data: Fields updated if the Version exists
+        :returns:           The Version entity dictionary
+        """
+        request = {
+            "key": _key(code, project, task),
+            "project": project,
+            "create": create_data,
+            "update": update_data,
+            "done": threading.Event(),
+            "version": None,
+            "error": None,
+        }
+        with self._lock:
+            self._pending.append(request)
+            leader = not self._flushing
+            self._flushing = True
+
+        if leader:
+            time.sleep(self.window)
+            while True:
+                with self._lock:
+                    requests = self._take_pending()
+                    if not requests:
+                        self._flushing = False
+                        break
+                self._flush(shotgun, requests)
+
+        request["done"].wait()
+        if request["error"] is not None:
+            raise request["error"]
+        return request["version"]
+
+    def _take_pending(self):
+        """
+        Remove the pending submissions sent by the next flush, one per key
+        since a Version must be created before it can be updated. Called
+        with the lock acquired.
+
+        :returns: List of submissions
+        """
+        requests = []
+        keys = set()
+        for request in list(self._pending):
+            if request["key"] not in keys:
+                keys.add(request["key"])
+                requests.append(request)
+                self._pending.remove(request)
+        return requests
+
+    def _flush(self, shotgun, requests):
+        """
+        Look up the Versions which weren't yet and send every submission in
+        a single batch request. If the batch fails, the submissions are sent
+        one by one so each one fails with its own error.
+        """
+        try:
+            with shotgun() as sg:
+                self._look_up(sg, requests)
+                try:
+                    results = sg.batch([self._batch_request(request)
+                                        for request in requests])
+                except Exception:
+                    # the batch is all or nothing
+                    if len(requests) == 1:
+                        raise
+                    self._send_each(sg, requests)
+                else:
+                    for request, result in zip(requests, results):
+                        self._set_version(request, result)
+        except Exception as e:
+            self._fail([request for request in requests
+                        if request["version"] is None and request["error"] is None], e)
+        finally:
+            for request in requests:
+                request["done"].set()
+
+    def _send_each(self, sg, requests):
+        """
+        Send the submissions of a failed batch one request at a time.
+        """
+        # the batch may have been applied before its reply was lost
+        self._forget_creates(requests)
+        self._look_up(sg, requests)
+        for request in requests:
+            batch_request = self._batch_request(request)
+            try:
+                if batch_request["request_type"] == "update":
+                    result = sg.update("Version", batch_request["entity_id"],
+                                       batch_request["data"])
+                else:
+                    result = sg.create("Version", batch_request["data"])
+            except Exception as e:
+                self._fail([request], e)
+            else:
+                self._set_version(request, result)
+
+    def _batch_request(self, request):
+        """
+        :returns: The batch request of a submission, an update if its Version
+                  exists, a create otherwise
+        """
+        with self._lock:
+            version = self._versions.get(request["key"])
+        if version:
+            return {"request_type": "update",
+                    "entity_type": "Version",
+                    "entity_id": version["id"],
+                    "data": request["update"]}
+        return {"request_type": "create",
+                "entity_type": "Version",
+                "data": request["create"]}
+
+    def _set_version(self, request, result):
+        """
+        Record the Version created or updated by a submission.
+        """
+        request["version"] = {"type": "Version", "id": result["id"]}
+        with self._lock:
+            self._versions[request["key"]] = request["version"]
+
+    def _fail(self, requests, error):
+        """
+        Record the error of failed submissions.
+        """
+        for request in requests:
+            request["error"] = error
+        # the creates may have reached the site before the error, look the
+        # Versions up again before a retry creates them again
+        self._forget_creates(requests)
+
+    def _forget_creates(self, requests):
+        """
+        Forget that the Versions of submissions didn't exist, so they're
+        looked up again.
+        """
+        with self._lock:
+            for request in requests:
+                if self._versions.get(request["key"]) is None:
+                    self._versions.pop(request["key"], None)
+
+    def _look_up(self, sg, requests):
+        """
+        Find the existing Versions of the submissions and of the candidates
+        which weren't looked up yet, with one query per project.
+        """
+        with self._lock:
+            keys = set(request["key"] for request in requests)
+            keys.update(self._candidates)
+            keys = [key for key in keys if key not in self._versions]
+            self._candidates.difference_update(keys)
+        if not keys:
+            return
+
+        projects = dict((request["key"][1], request["project"]) for request in requests)
+        by_project = {}
+        for code, project_id, task_id in keys:
+            by_project.setdefault(project_id, set()).add(code)
+
+        found = {}
+        for project_id, codes in by_project.items():
+            project = projects.get(project_id) or {"type": "Project", "id": project_id}
+            versions = sg.find("Version",
+                               [["code", "in", sorted(codes)],
+                                ["project", "is", project]],
+                               ["code", "sg_task"])
+            for version in versions:
+                task_id = version["sg_task"]["id"] if version.get("sg_task") else None
+                key = (version["code"], project_id, task_id)
+                # the first match, as a find on code, project and task
+                found.setdefault(key, {"type": "Version", "id": version["id"]})
+
+        with self._lock:
+            for key in keys:
+                self._versions.setdefault(key, found.get(key))
+
+
+def _key(code, project, task):
+    """
+    :returns: The key of a Version in the batch
+    """
+    return (code, project["id"], task["id"] if task else None)
@@ -0,0 +1,107 @@
+# Copyright (c) 2015 Shotgun Software Inc.
+#
+# CONFIDENTIAL AND PROPRIETARY
+#
+# This work is provided "AS IS" and subject to the Shotgun Pipeline Toolkit
+# Source Code License included in this distribution package. See LICENSE.
+# By accessing, using, copying or modifying this work you indicate your
+# agreement to the Shotgun Pipeline Toolkit Source Code License. All rights
+# not expressly granted therein are reserved by Shotgun Software Inc.
+
+"""
+Makes the app package importable by the tests. The modules tested only use
+the toolkit for their logger and Qt for QImage, so minimal stand-ins are
+installed when the tests run outside of a toolkit environment.
+"""
+import os
+import sys
+import types
+import logging
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "python"))
+
+
+class _Anything(object):
+    """
+    Stand-in for the Qt names which are only referenced at import time.
+    """
+
+    def __getattr__(self, name):
+        return _Anything()
+
+    def __call__(self, *args, **kwargs):
+        return _Anything()
+
+
+class FakeQImage(object):
+    """
+    Stand-in for QImage, keeping the RGB888 buffer it is created from.
+    """
+
+    Format_RGB888 = 13
+
+    def __init__(self, data, width, height, bytes_per_line, image_format):
+        self._data = bytes(data)
+        self._width = width
+        self._height = height
+        self._bytes_per_line = bytes_per_line
+
+    def copy(self):
+        return self
+
+    def width(self):
+        return self._width
+
+    def height(self):
+        return self._height
+
+    def pixel(self, x, y):
+        offset = y * self._bytes_per_line + x * 3
+        r, g, b = bytearray(self._data[offset:offset + 3])
+        return 0xff000000 | (r << 16) | (g << 8) | b
+
+
+def _install_toolkit_stand_ins():
+    sgtk = types.ModuleType("sgtk")
+    platform = types.ModuleType("sgtk.platform")
+    qt = types.ModuleType("sgtk.platform.qt")
+    util = types.ModuleType("sgtk.util")
+    shotgun = types.ModuleType("sgtk.util.shotgun")
+
+    platform.get_logger = logging.getLogger
+    platform.current_engine = lambda: None
+    platform.import_framework = lambda *args: _Anything()
+    qt.QtCore = _Anything()
+    qt.QtCore.QObject = object
+    qt.QtGui = _Anything()
+    qt.QtGui.QImage = FakeQImage
+    shotgun.create_sg_connection = lambda: None
+    sgtk.platform = platform
+    sgtk.util = util
+    platform.qt = qt
+    util.shotgun = shotgun
+
+    tank_vendor = types.ModuleType("tank_vendor")
+    shotgun_api3 = types.ModuleType("tank_vendor.shotgun_api3")
+
+    class ProtocolError(Exception):
+        pass
+
+    shotgun_api3.ProtocolError = ProtocolError
+    tank_vendor.shotgun_api3 = shotgun_api3
+
+    sys.modules.update({
+        "sgtk": sgtk,
+        "sgtk.platform": platform,
+        "sgtk.platform.qt": qt,
+        "sgtk.util": util,
+        "sgtk.util.shotgun": shotgun,
+        "tank_vendor": tank_vendor,
+        "tank_vendor.shotgun_api3": shotgun_api3,
+    })
+
+
+try:
+    import sgtk
+except ImportError:
+    _install_toolkit_stand_ins()
@@ -0,0 +1,116 @@
+# Copyright (c) 2015 Shotgun Software Inc.
+#
+# CONFIDENTIAL AND PROPRIETARY
+#
+# This work is provided "AS IS" and subject to the Shotgun Pipeline Toolkit
+# Source Code License included in this distribution package. See LICENSE.
+# By accessing, using, copying or modifying this work you indicate your
+# agreement to the Shotgun Pipeline Toolkit Source Code License. All rights
+# not expressly granted therein are reserved by Shotgun Software Inc.
+
+import os
+import sys
+import json
+import time
+import threading
+import subprocess
+
+import pytest
+
+from tk_desktop_version.host_budget import HostBudget
+from tk_desktop_version.process import CancelledError
+
+
+@pytest.fixture
+def budget(tmp_path):
+    budget = HostBudget(cores=8, memory=1000, path=str(tmp_path / "budget.json"))
+    budget.poll_interval = 0.01
+    return budget
+
+
+def _reservations(budget):
+    with open(budget.path) as f:
+        return json.load(f)
+
+
+def _dead_pid():
+    process = subprocess.Popen([sys.executable, "-c", "pass"])
+    process.wait()
+    return process.pid
+
+
+def test_reserve_records_and_releases_the_reservation(budget):
+    with budget.reserve(4, 500):
+        assert list(_reservations(budget).values()) == [{"cores": 4, "memory": 500}]
+    assert _reservations(budget) == {}
+
+
+def test_requests_larger_than_the_budget_are_clamped(budget):
+    with budget.reserve(32, 64000):
+        assert list(_reservations(budget).values()) == [{"cores": 8, "memory": 1000}]
+
+
+def test_reserve_waits_for_the_resources(budget):
+    order = []
+    first_reserved = threading.Event()
+    release_first = threading.Event()
+
+    def first():
+        with budget.reserve(6, 100):
+            order.append("first")
+            first_reserved.set()
+            release_first.wait(5)
+        order.append("first released")
+
+    def second():
+        first_reserved.wait(5)
+        with budget.reserve(4, 100):
+            order.append("second")
+
+    threads = [threading.Thread(target=first), threading.Thread(target=second)]
+    for thread in threads:
+        thread.start()
+    first_reserved.wait(5)
+    # the second reservation can't fit beside the first one
+    time.sleep(0.1)
+    assert order == ["first"]
+    release_first.set()
+    for thread in threads:
+        thread.join(5)
+    assert order == ["first", "first released", "second"]
+
+
+def test_cancellation_while_waiting(budget):
+    def check_cancelled():
+        raise CancelledError("Cancelled")
+
+    with budget.reserve(8, 100):
+        with pytest.raises(CancelledError):
+            with budget.reserve(1, 100, check_cancelled):
+                pass
+
+
+def test_reservations_of_dead_processes_are_reaped(budget):
+    with open(budget.path, "w") as f:
+        json.dump({"%d:stale" % _dead_pid(): {"cores": 8, "memory": 1000}}, f)
+
+    # doesn't wait for the reservation of the dead process
+    with budget.reserve(8, 1000):
+        reservations = _reservations(budget)
+    assert len(reservations) == 1
+    assert not any(key.endswith(":stale") for key in reservations)
+
+
+def test_reservations_of_live_processes_are_kept(budget):
+    with open(budget.path, "w") as f:
+        json.dump({"%d:other" % os.getpid(): {"cores": 2, "memory": 100}}, f)
+
+    with budget.reserve(4, 100):
+        assert len(_reservations(budget)) == 2
+    assert list(_reservations(budget)) == ["%d:other" % os.getpid()]
+
+
+def test_configure_resizes_the_budget(budget):
+    budget.configure(2, 200)
+    with budget.reserve(4, 500):
+        assert list(_reservations(budget).values()) == [{"cores": 2, "memory": 200}]
@@ -0,0 +1,165 @@
+# Copyright (c) 2015 Shotgun Software Inc.
+#
+# CONFIDENTIAL AND PROPRIETARY
+#
+# This work is provided "AS IS" and subject to the Shotgun Pipeline Toolkit
+# Source Code License included in this distribution package. See LICENSE.
+# By accessing, using, copying or modifying this work you indicate your
+# agreement to the Shotgun Pipeline Toolkit Source Code License. All rights
+# not expressly granted therein are reserved by Shotgun Software Inc.
+
+import os
+import time
+
+import pytest
+
+from tk_desktop_version.job_journal import JobJournal, journal_key, file_records, files_unchanged
+from tk_desktop_version.stage_graph import StageGraph
+from tk_desktop_version.upload_job import UploadJob
+from tk_desktop_version.upload_settings import UploadServices
+
+
+def _write(path, data):
+    with open(str(path), "w") as f:
+        f.write(data)
+    return str(path)
+
+
+class FakeTranscoding(object):
+    stream_frames = False
+
+    def __init__(self):
+        self.mov_path = None
+        self.mov_webm_path = None
+        self.hdr_path = None
+        self.mp4_path = None
+
+
+class FakeVersion(object):
+    version = None
+
+
+@pytest.fixture
+def journal(tmp_path):
+    return JobJournal(root=str(tmp_path / "journal"))
+
+
+def _run(job, root, ran, fail_upload=False):
+    """
+    Run the stages of an upload whose mov is rendered, its mp4 encoded, and
+    both uploaded, through the journal.
+    """
+    transcoding = FakeTranscoding()
+    version = FakeVersion()
+
+    def stage(name, func=None):
+        def run():
+            ran.append(name)
+            if func:
+                func()
+        return run
+
+    def mov():
+        transcoding.mov_path = _write(os.path.join(root, "sh010.mov"), "mov")
+
+    def mp4():
+        transcoding.mp4_path = _write(os.path.join(root, "sh010.mp4"), "mp4")
+
+    def create_version():
+        version.version = {"type": "Version", "id": 1}
+
+    def upload_mp4():
+        if fail_upload:
+            raise RuntimeError("upload failed")
+
+    graph = StageGraph()
+    graph.add("script", stage("script"))
+    graph.add("mov", stage("mov", mov), requires=["script"])
+    graph.add("mp4", stage("mp4", mp4), requires=["mov"])
+    graph.add("version", stage("version", create_version), requires=["mov"])
+    graph.add("upload mp4", stage("upload mp4", upload_mp4), requires=["version", "mp4"])
+    job._resume(graph, "key", transcoding, version, None)
+    graph.run()
+    return transcoding, version
+
+
+@pytest.fixture
+def job(journal):
+    return UploadJob("sh010", "seq", None, None, None, None, None, False,
+                     services=UploadServices(journal=journal))
+
+
+def test_journal_records_and_loads_stages(journal):
+    journal.record("key", "mov", {"attrs": {"mov_path": "/a.mov"}, "files": {}})
+    journal.record("key", "mp4", {"attrs": {}, "files": {}})
+    assert sorted(journal.load("key")) == ["mov", "mp4"]
+    journal.remove("key")
+    assert journal.load("key") == {}
+
+
+def test_expired_journals_are_discarded(journal):
+    journal.record("key", "mov", {"attrs": {}, "files": {}})
+    past = time.time() - journal.max_age - 10
+    os.utime(os.path.join(journal.root, "key.json"), (past, past))
+    assert journal.load("key") == {}
+
+
+def test_journal_key_changes_when_a_source_is_written_again(tmp_path):
+    frame = _write(tmp_path / "frame.1001.exr", "frame")
+    key = journal_key([frame], {"qc": False})
+    assert journal_key([frame], {"qc": False}) == key
+    assert journal_key([frame], {"qc": True}) != key
+    _write(frame, "frame rendered again")
+    assert journal_key([frame], {"qc": False}) != key
+
+
+def test_file_records_detect_changes(tmp_path):
+    mov = _write(tmp_path / "sh010.mov", "mov")
+    records = file_records([mov, None, str(tmp_path / "missing.mov")])
+    assert list(records) == [mov]
+    assert files_unchanged(records)
+    _write(mov, "another, longer mov")
+    assert not files_unchanged(records)
+    os.remove(mov)
+    assert not files_unchanged(records)
+
+
+def test_completed_stages_are_skipped_on_resume(job, tmp_path):
+    ran = []
+    with pytest.raises(RuntimeError):
+        _run(job, str(tmp_path), ran, fail_upload=True)
+    assert sorted(ran) == ["mov", "mp4", "script", "upload mp4", "version"]
+
+    ran = []
+    transcoding, version = _run(job, str(tmp_path), ran)
+
+    # only the failed upload and the stages which aren't journaled run
+    assert sorted(ran) == ["script", "upload mp4"]
+    # the skipped stages set their outputs back
+    assert transcoding.mov_path == os.path.join(str(tmp_path), "sh010.mov")
+    assert transcoding.mp4_path == os.path.join(str(tmp_path), "sh010.mp4")
+    assert version.version == {"type": "Version", "id": 1}
+
+
+def test_removed_outputs_needed_again_are_made_again(job, tmp_path):
+    with pytest.raises(RuntimeError):
+        _run(job, str(tmp_path), [], fail_upload=True)
+    os.remove(os.path.join(str(tmp_path), "sh010.mp4"))
+
+    ran = []
+    _run(job, str(tmp_path), ran)
+
+    # the upload needs the mp4 again, the mov is still there
+    assert sorted(ran) == ["mp4", "script", "upload mp4"]
+
+
+def test_removed_outputs_which_are_not_needed_are_not_made_again(job, tmp_path):
+    with pytest.raises(RuntimeError):
+        _run(job, str(tmp_path), [], fail_upload=True)
+    # the mov was uploaded and removed, only the mp4 upload is left
+    os.remove(os.path.join(str(tmp_path), "sh010.mov"))
+
+    ran = []
+    _run(job, str(tmp_path), ran)
+
+    assert sorted(ran) == ["script", "upload mp4"]
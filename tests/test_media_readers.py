@@ -0,0 +1,118 @@
+# Copyright (c) 2015 Shotgun Software Inc.
+#
+# CONFIDENTIAL AND PROPRIETARY
+#
+# This work is provided "AS IS" and subject to the Shotgun Pipeline Toolkit
+# Source Code License included in this distribution package. See LICENSE.
+# By accessing, using, copying or modifying this work you indicate your
+# agreement to the Shotgun Pipeline Toolkit Source Code License. All rights
+# not expressly granted therein are reserved by Shotgun Software Inc.
+
+import io
+import struct
+
+import pytest
+
+from tk_desktop_version.filmstrip import read_ppm_frames
+from tk_desktop_version.still_thumbnail import read_dpx_thumbnail
+
+DATA_OFFSET = 2048
+
+
+def _rgb(pixel):
+    return (pixel >> 16) & 0xff, (pixel >> 8) & 0xff, pixel & 0xff
+
+
+def _ppm(width, height, color):
+    header = ("P6\n%d %d\n255\n" % (width, height)).encode("ascii")
+    return header + bytes(bytearray(color) * (width * height))
+
+
+def _write_dpx(path, width, height, bit_depth, pixel, endian=">", packing=1,
+               descriptor=50, eol_padding=0):
+    """
+    Write an RGB DPX whose pixels are pixel(x, y) -> (r, g, b) code values.
+    """
+    header = bytearray(DATA_OFFSET)
+    header[0:4] = b"SDPX" if endian == ">" else b"XPDS"
+    header[772:780] = struct.pack(endian + "II", width, height)
+    header[800] = descriptor
+    header[803] = bit_depth
+    header[804:816] = struct.pack(endian + "HHII", packing, 0, DATA_OFFSET, eol_padding)
+    data = bytearray()
+    for y in range(height):
+        line = bytearray()
+        for x in range(width):
+            r, g, b = pixel(x, y)
+            if bit_depth == 10:
+                line += struct.pack(endian + "I", (r << 22) | (g << 12) | (b << 2))
+            else:
+                line += bytearray([r, g, b])
+        line += bytearray(-len(line) % 4 + eol_padding)
+        data += line
+    with open(str(path), "wb") as f:
+        f.write(bytes(header + data))
+    return str(path)
+
+
+def test_read_ppm_frames():
+    stream = io.BytesIO(_ppm(4, 2, [255, 0, 0]) + _ppm(4, 2, [0, 0, 255]))
+    frames = list(read_ppm_frames(stream))
+    assert [(frame.width(), frame.height()) for frame in frames] == [(4, 2), (4, 2)]
+    assert _rgb(frames[0].pixel(3, 1)) == (255, 0, 0)
+    assert _rgb(frames[1].pixel(0, 0)) == (0, 0, 255)
+
+
+def test_read_ppm_frames_stops_at_a_truncated_frame():
+    stream = io.BytesIO(_ppm(4, 2, [255, 0, 0]) + _ppm(4, 2, [0, 0, 255])[:-5])
+    assert len(list(read_ppm_frames(stream))) == 1
+
+
+def test_read_ppm_frames_rejects_other_images():
+    stream = io.BytesIO(b"P5\n4 2\n255\n" + bytes(bytearray(8)))
+    with pytest.raises(ValueError):
+        list(read_ppm_frames(stream))
+
+
+@pytest.mark.parametrize("endian", [">", "<"])
+def test_read_10_bit_dpx(tmp_path, endian):
+    path = _write_dpx(tmp_path / "frame.dpx", 3, 2, 10,
+                      lambda x, y: (1023, 512, 4 * (x + 1)), endian=endian)
+    image = read_dpx_thumbnail(path)
+    assert (image.width(), image.height()) == (3, 2)
+    assert _rgb(image.pixel(0, 0)) == (255, 128, 1)
+    assert _rgb(image.pixel(2, 1)) == (255, 128, 3)
+
+
+def test_read_8_bit_dpx_with_line_padding(tmp_path):
+    path = _write_dpx(tmp_path / "frame.dpx", 3, 2, 8,
+                      lambda x, y: (x, y, 200), eol_padding=4)
+    image = read_dpx_thumbnail(path)
+    assert _rgb(image.pixel(2, 1)) == (2, 1, 200)
+
+
+def test_dpx_thumbnails_are_downsized(tmp_path):
+    path = _write_dpx(tmp_path / "frame.dpx", 16, 8, 10,
+                      lambda x, y: (x * 64, y * 64, 0))
+    image = read_dpx_thumbnail(path, max_size=4)
+    assert (image.width(), image.height()) == (4, 2)
+    # every fourth pixel of every fourth line
+    assert _rgb(image.pixel(1, 1)) == (64, 64, 0)
+
+
+def test_unsupported_dpx_flavors(tmp_path):
+    # RGBA
+    path = _write_dpx(tmp_path / "rgba.dpx", 2, 2, 10, lambda x, y: (0, 0, 0),
+                      descriptor=51)
+    assert read_dpx_thumbnail(path) is None
+    # 10 bit without padding
+    path = _write_dpx(tmp_path / "packed.dpx", 2, 2, 10, lambda x, y: (0, 0, 0),
+                      packing=0)
+    assert read_dpx_thumbnail(path) is None
+
+
+def test_read_dpx_rejects_other_files(tmp_path):
+    path = tmp_path / "frame.exr"
+    path.write_bytes(b"\x76\x2f\x31\x01" + bytes(bytearray(1000)))
+    with pytest.raises(ValueError):
+        read_dpx_thumbnail(str(path))
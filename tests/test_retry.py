@@ -0,0 +1,146 @@
+# Copyright (c) 2015 Shotgun Software Inc.
+#
+# CONFIDENTIAL AND PROPRIETARY
+#
+# This work is provided "AS IS" and subject to the Shotgun Pipeline Toolkit
+# Source Code License included in this distribution package. See LICENSE.
+# By accessing, using, copying or modifying this work you indicate your
+# agreement to the Shotgun Pipeline Toolkit Source Code License. All rights
+# not expressly granted therein are reserved by Shotgun Software Inc.
+
+import socket
+import subprocess
+
+try:
+    import urllib.error as urlerror
+except ImportError:
+    import urllib2 as urlerror
+
+import pytest
+from tank_vendor import shotgun_api3
+
+from tk_desktop_version.process import CancelledError, ProcessError, stage_error
+from tk_desktop_version.retry import RetryPolicy, is_transient, is_process_crash
+
+
+def _http_error(code):
+    return urlerror.HTTPError("https://site.shotgunstudio.com", code, "error", {}, None)
+
+
+@pytest.mark.parametrize("error", [
+    shotgun_api3.ProtocolError("502 Bad Gateway"),
+    socket.timeout("timed out"),
+    urlerror.URLError("unreachable"),
+    _http_error(503),
+])
+def test_transient_errors(error):
+    assert is_transient(error)
+    assert not is_process_crash(error)
+
+
+@pytest.mark.parametrize("error", [
+    ValueError("invalid field"),
+    _http_error(403),
+    CancelledError("Cancelled"),
+])
+def test_permanent_errors(error):
+    assert not is_transient(error)
+    assert not is_process_crash(error)
+
+
+def test_process_crashes():
+    assert is_process_crash(ProcessError("nuke crashed", -11))
+    assert is_process_crash(subprocess.CalledProcessError(1, ["ffmpeg"]))
+    # stages wrap the errors of their processes
+    wrapped = stage_error("make mp4", subprocess.CalledProcessError(1, ["ffmpeg"]))
+    assert is_process_crash(wrapped)
+    assert wrapped.returncode == 1
+    assert not is_process_crash(stage_error("make mp4", ValueError("bad frame")))
+
+
+def test_chained_causes_are_classified():
+    try:
+        try:
+            raise socket.timeout("timed out")
+        except socket.timeout:
+            raise Exception("upload mp4 failed")
+    except Exception as e:
+        assert is_transient(e)
+
+
+class Failing(object):
+    """
+    Callable raising the given errors, then returning "done".
+    """
+
+    def __init__(self, *errors):
+        self.errors = list(errors)
+        self.calls = 0
+
+    def __call__(self):
+        self.calls += 1
+        if self.errors:
+            raise self.errors.pop(0)
+        return "done"
+
+
+@pytest.fixture
+def policy():
+    policy = RetryPolicy(retries=3, backoff=2.0, max_delay=5.0, process_retries=1)
+    policy.delays = []
+    policy._wait = lambda delay, check_cancelled: policy.delays.append(delay)
+    return policy
+
+
+def test_transient_errors_are_retried_with_an_exponential_backoff(policy):
+    func = Failing(socket.timeout(), socket.timeout(), socket.timeout())
+    assert policy.call("upload", func) == "done"
+    assert func.calls == 4
+    assert policy.delays == [2.0, 4.0, 5.0]
+
+
+def test_transient_errors_give_up_after_the_retries(policy):
+    func = Failing(*[socket.timeout("timed out %d" % i) for i in range(5)])
+    with pytest.raises(socket.timeout, match="timed out 3"):
+        policy.call("upload", func)
+    assert func.calls == 4
+
+
+def test_process_crashes_are_retried_at_once(policy):
+    func = Failing(ProcessError("nuke crashed", -11))
+    assert policy.call("mov", func) == "done"
+    assert policy.delays == [0]
+
+    func = Failing(ProcessError("nuke crashed", -11), ProcessError("nuke crashed", -11))
+    with pytest.raises(ProcessError):
+        policy.call("mov", func)
+    assert func.calls == 2
+
+
+def test_permanent_errors_are_not_retried(policy):
+    func = Failing(ValueError("invalid field"))
+    with pytest.raises(ValueError):
+        policy.call("version", func)
+    assert func.calls == 1
+
+
+def test_cancellation_is_not_retried(policy):
+    func = Failing(CancelledError("Cancelled"))
+    with pytest.raises(CancelledError):
+        policy.call("mov", func)
+    assert func.calls == 1
+
+
+def test_cancellation_stops_the_retries(policy):
+    def check_cancelled():
+        raise CancelledError("Cancelled")
+
+    func = Failing(socket.timeout())
+    with pytest.raises(CancelledError):
+        policy.call("upload", func, check_cancelled=check_cancelled)
+    assert func.calls == 1
+
+
+def test_arguments_are_passed():
+    policy = RetryPolicy()
+    assert policy.call("add", lambda x, y=0: x + y, [1], {"y": 2}) == 3
@@ -0,0 +1,181 @@
+# Copyright (c) 2015 Shotgun Software Inc.
+#
+# CONFIDENTIAL AND PROPRIETARY
+#
+# This work is provided "AS IS" and subject to the Shotgun Pipeline Toolkit
+# Source Code License included in this distribution package. See LICENSE.
+# By accessing, using, copying or modifying this work you indicate your
+# agreement to the Shotgun Pipeline Toolkit Source Code License. All rights
+# not expressly granted therein are reserved by Shotgun Software Inc.
+
+import time
+import threading
+
+import pytest
+
+from tk_desktop_version.process import CancelledError
+from tk_desktop_version.stage_graph import StageGraph
+
+
+def _recorder():
+    events = []
+    lock = threading.Lock()
+
+    def stage(name, delay=0):
+        def run():
+            with lock:
+                events.append(("start", name))
+            time.sleep(delay)
+            with lock:
+                events.append(("end", name))
+        return run
+    return events, stage
+
+
+def test_stages_start_after_their_requirements():
+    events, stage = _recorder()
+    graph = StageGraph()
+    graph.add("script", stage("script", 0.05))
+    graph.add("mov", stage("mov", 0.05), requires=["script"])
+    graph.add("mp4", stage("mp4"), requires=["mov"])
+    graph.add("thumbnail", stage("thumbnail"), requires=["script"])
+    graph.add("version", stage("version"), requires=["mp4", "thumbnail"])
+
+    graph.run(max_workers=4)
+
+    def index(event):
+        return events.index(event)
+    assert index(("end", "script")) < index(("start", "mov"))
+    assert index(("end", "script")) < index(("start", "thumbnail"))
+    assert index(("end", "mov")) < index(("start", "mp4"))
+    assert index(("end", "mp4")) < index(("start", "version"))
+    assert index(("end", "thumbnail")) < index(("start", "version"))
+    assert len(events) == 10
+
+
+def test_independent_stages_run_in_parallel_up_to_max_workers():
+    running = []
+    peak = []
+    lock = threading.Lock()
+
+    def stage():
+        with lock:
+            running.append(1)
+            peak.append(len(running))
+        time.sleep(0.05)
+        with lock:
+            running.pop()
+
+    graph = StageGraph()
+    for i in range(6):
+        graph.add("stage %d" % i, stage)
+    graph.run(max_workers=3)
+
+    assert max(peak) == 3
+
+
+def test_pools_have_their_own_limits():
+    running = {"default": 0, "upload": 0}
+    peak = {"default": 0, "upload": 0}
+    lock = threading.Lock()
+
+    def stage(pool):
+        def run():
+            with lock:
+                running[pool] += 1
+                peak[pool] = max(peak[pool], running[pool])
+            time.sleep(0.05)
+            with lock:
+                running[pool] -= 1
+        return run
+
+    graph = StageGraph()
+    for i in range(4):
+        graph.add("encode %d" % i, stage("default"))
+        graph.add("upload %d" % i, stage("upload"), pool="upload")
+    graph.run(max_workers=1, pool_workers={"upload": 2})
+
+    assert peak == {"default": 1, "upload": 2}
+
+
+def test_on_start_and_on_finish_are_called_for_every_stage():
+    started = []
+    finished = []
+    graph = StageGraph()
+    graph.add("a", lambda: None)
+    graph.add("b", lambda: None, requires=["a"])
+
+    graph.run(on_start=lambda s: started.append(s.name),
+              on_finish=lambda s: finished.append(s.name))
+
+    assert started == ["a", "b"]
+    assert finished == ["a", "b"]
+
+
+def test_stage_arguments_are_passed():
+    results = []
+    graph = StageGraph()
+    graph.add("a", lambda x, y=0: results.append(x + y), args=[1], kwargs={"y": 2})
+    graph.run()
+    assert results == [3]
+
+
+def test_first_error_is_raised_and_dependent_stages_do_not_run():
+    events, stage = _recorder()
+
+    def fail():
+        raise ValueError("encode failed")
+
+    graph = StageGraph()
+    graph.add("script", stage("script"))
+    graph.add("mp4", fail, requires=["script"])
+    graph.add("version", stage("version"), requires=["mp4"])
+
+    with pytest.raises(ValueError, match="encode failed"):
+        graph.run(max_workers=2)
+    assert ("start", "version") not in events
+
+
+def test_running_stages_finish_before_the_error_is_raised():
+    events, stage = _recorder()
+
+    def fail():
+        raise ValueError("failed")
+
+    graph = StageGraph()
+    graph.add("slow", stage("slow", 0.1))
+    graph.add("fail", fail)
+
+    with pytest.raises(ValueError):
+        graph.run(max_workers=2)
+    assert ("end", "slow") in events
+
+
+def test_cancellation_stops_starting_stages():
+    events, stage = _recorder()
+    cancelled = []
+
+    def check_cancelled():
+        if cancelled:
+            raise CancelledError("Cancelled")
+
+    def cancel():
+        cancelled.append(True)
+
+    graph = StageGraph()
+    graph.add("script", cancel)
+    graph.add("mov", stage("mov"), requires=["script"])
+
+    with pytest.raises(CancelledError):
+        graph.run(check_cancelled=check_cancelled)
+    assert events == []
+
+
+def test_add_rejects_duplicate_and_unknown_stages():
+    graph = StageGraph()
+    graph.add("a", lambda: None)
+    with pytest.raises(ValueError):
+        graph.add("a", lambda: None)
+    with pytest.raises(ValueError):
+        graph.add("b", lambda: None, requires=["c"])
+    assert [stage.name for stage in graph.stages] == ["a"]
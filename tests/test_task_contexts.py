@@ -0,0 +1,85 @@
+# Copyright (c) 2015 Shotgun Software Inc.
+#
+# CONFIDENTIAL AND PROPRIETARY
+#
+# This work is provided "AS IS" and subject to the Shotgun Pipeline Toolkit
+# Source Code License included in this distribution package. See LICENSE.
+# By accessing, using, copying or modifying this work you indicate your
+# agreement to the Shotgun Pipeline Toolkit Source Code License. All rights
+# not expressly granted therein are reserved by Shotgun Software Inc.
+
+import os
+
+from tk_desktop_version.task_contexts import TaskContexts
+
+
+class FakeContext(object):
+
+    def __init__(self, task_id):
+        self.task_id = task_id
+        self.filesystem_locations = ["/show/seq/sh%03d" % task_id]
+        self.step = {"name": "comp"}
+
+
+class FakeToolkit(object):
+    """
+    Resolves the context of a task, counting the resolutions.
+    """
+
+    def __init__(self):
+        self.resolved = []
+
+    def context_from_entity_dictionary(self, entity):
+        self.resolved.append(entity["id"])
+        return FakeContext(entity["id"])
+
+
+def _task(task_id):
+    return {"type": "Task", "id": task_id}
+
+
+def test_resolve_caches_the_context_and_folder():
+    tk = FakeToolkit()
+    contexts = TaskContexts(max_entries=4)
+    assert contexts.get(_task(1)) is None
+
+    context, init_path = contexts.resolve(tk, None, _task(1))
+
+    assert context.task_id == 1
+    assert init_path == os.path.join("/show/seq/sh001", "comp")
+    assert contexts.get(_task(1)) == (context, init_path)
+    assert contexts.resolve(tk, None, _task(1)) == (context, init_path)
+    assert tk.resolved == [1]
+
+
+def test_least_recently_used_tasks_are_evicted():
+    tk = FakeToolkit()
+    contexts = TaskContexts(max_entries=2)
+    contexts.resolve(tk, None, _task(1))
+    contexts.resolve(tk, None, _task(2))
+    # task 1 is now the most recently used
+    assert contexts.get(_task(1)) is not None
+    contexts.resolve(tk, None, _task(3))
+
+    assert contexts.get(_task(2)) is None
+    assert contexts.get(_task(1)) is not None
+    assert contexts.get(_task(3)) is not None
+
+
+def test_zero_entries_disables_the_cache():
+    tk = FakeToolkit()
+    contexts = TaskContexts(max_entries=0)
+    contexts.resolve(tk, None, _task(1))
+    contexts.resolve(tk, None, _task(1))
+    assert contexts.get(_task(1)) is None
+    assert tk.resolved == [1, 1]
+
+
+def test_clear_forgets_every_task():
+    tk = FakeToolkit()
+    contexts = TaskContexts()
+    contexts.resolve(tk, None, _task(1))
+    contexts.clear()
+    assert contexts.get(_task(1)) is None
+    contexts.resolve(tk, None, _task(1))
+    assert tk.resolved == [1, 1]
@@ -0,0 +1,123 @@
+# Copyright (c) 2015 Shotgun Software Inc.
+#
+# CONFIDENTIAL AND PROPRIETARY
+#
+# This work is provided "AS IS" and subject to the Shotgun Pipeline Toolkit
+# Source Code License included in this distribution package. See LICENSE.
+# By accessing, using, copying or modifying this work you indicate your
+# agreement to the Shotgun Pipeline Toolkit Source Code License. All rights
+# not expressly granted therein are reserved by Shotgun Software Inc.
+
+import os
+import time
+import collections
+
+import pytest
+
+from tk_desktop_version.transcode_cache import TranscodeCache, fingerprint
+
+Frame = collections.namedtuple("Frame", "path")
+
+
+def _write(path, data):
+    with open(str(path), "w") as f:
+        f.write(data)
+    return str(path)
+
+
+def _read(path):
+    with open(str(path)) as f:
+        return f.read()
+
+
+@pytest.fixture
+def frames(tmp_path):
+    return [Frame(_write(tmp_path / ("frame.%04d.exr" % i), "frame %d" % i))
+            for i in range(1, 4)]
+
+
+@pytest.fixture
+def cache(tmp_path):
+    return TranscodeCache(root=str(tmp_path / "cache"), max_entries=2)
+
+
+def test_fingerprint_is_stable(frames):
+    settings = {"fps": 24, "colorspace": "ACES - ACEScg"}
+    assert fingerprint(frames, settings) == fingerprint(frames, dict(settings))
+
+
+def test_fingerprint_changes_with_the_settings(frames):
+    assert fingerprint(frames, {"fps": 24}) != fingerprint(frames, {"fps": 25})
+
+
+def test_fingerprint_changes_when_a_frame_is_written_again(frames):
+    key = fingerprint(frames, {})
+    _write(frames[1].path, "frame 2, rendered again")
+    assert fingerprint(frames, {}) != key
+
+
+def test_fingerprint_changes_with_the_frames(frames):
+    assert fingerprint(frames[:2], {}) != fingerprint(frames, {})
+
+
+def test_restore_of_an_unknown_key_misses(cache, tmp_path):
+    assert not cache.restore("missing", {"mov": str(tmp_path / "out.mov")})
+
+
+def test_store_and_restore(cache, tmp_path):
+    mov = _write(tmp_path / "sh010.mov", "mov")
+    webm = _write(tmp_path / "sh010.webm", "webm")
+    cache.store("key", {"mov": mov, "webm": webm})
+    os.remove(mov)
+    os.remove(webm)
+
+    assert cache.restore("key", {"mov": mov, "webm": webm})
+    assert _read(mov) == "mov"
+    assert _read(webm) == "webm"
+
+
+def test_store_skips_missing_outputs(cache, tmp_path):
+    mov = _write(tmp_path / "sh010.mov", "mov")
+    cache.store("key", {"mov": mov, "mp4": str(tmp_path / "missing.mp4")})
+
+    assert cache.restore("key", {"mov": mov})
+    assert not cache.restore("key", {"mov": mov, "mp4": str(tmp_path / "sh010.mp4")})
+
+
+def test_store_without_a_mov_is_skipped(cache, tmp_path):
+    webm = _write(tmp_path / "sh010.webm", "webm")
+    cache.store("key", {"webm": webm})
+    assert not cache.restore("key", {"webm": webm})
+
+
+def test_writing_restored_media_again_does_not_change_the_cache(cache, tmp_path):
+    mov = _write(tmp_path / "sh010.mov", "mov")
+    cache.store("key", {"mov": mov})
+
+    # the render releases its outputs before writing them again
+    cache.release({"mov": mov})
+    assert not os.path.exists(mov)
+    _write(mov, "another mov")
+
+    assert cache.restore("key", {"mov": mov})
+    assert _read(mov) == "mov"
+
+
+def test_release_leaves_other_hard_links_alone(cache, tmp_path):
+    mov = _write(tmp_path / "sh010.mov", "mov")
+    os.link(mov, str(tmp_path / "backup.mov"))
+    cache.release({"mov": mov})
+    assert os.path.exists(mov)
+
+
+def test_least_recently_used_entries_are_evicted(cache, tmp_path):
+    mov = _write(tmp_path / "sh010.mov", "mov")
+    cache.store("first", {"mov": mov})
+    cache.store("second", {"mov": mov})
+    # restoring an entry marks it as recently used
+    past = time.time() - 100
+    os.utime(os.path.join(cache.root, "second"), (past, past))
+    assert cache.restore("first", {"mov": mov})
+    cache.store("third", {"mov": mov})
+
+    assert sorted(os.listdir(cache.root)) == ["first", "third"]
@@ -0,0 +1,174 @@
+# Copyright (c) 2015 Shotgun Software Inc.
+#
+# CONFIDENTIAL AND PROPRIETARY
+#
+# This work is provided "AS IS" and subject to the Shotgun Pipeline Toolkit
+# Source Code License included in this distribution package. See LICENSE.
+# By accessing, using, copying or modifying this work you indicate your
+# agreement to the Shotgun Pipeline Toolkit Source Code License. All rights
+# not expressly granted therein are reserved by Shotgun Software Inc.
+
+import threading
+import contextlib
+
+import pytest
+
+from tk_desktop_version.version_batch import VersionBatch
+
+PROJECT = {"type": "Project", "id": 1}
+TASK = {"type": "Task", "id": 10}
+
+
+class FakeShotgun(object):
+    """
+    Records the requests, with the existing Versions of project 1.
+    """
+
+    def __init__(self, versions=None, fail_batch=False, fail_codes=()):
+        self.versions = list(versions or [])
+        self.fail_batch = fail_batch
+        self.fail_codes = fail_codes
+        self.finds = []
+        self.batches = []
+        self.creates = []
+        self.updates = []
+        self._next_id = 100
+        self._lock = threading.Lock()
+
+    def connection(self):
+        @contextlib.contextmanager
+        def shotgun():
+            yield self
+        return shotgun
+
+    def find(self, entity_type, filters, fields):
+        with self._lock:
+            self.finds.append(filters)
+        codes = filters[0][2]
+        return [version for version in self.versions if version["code"] in codes]
+
+    def batch(self, requests):
+        with self._lock:
+            self.batches.append(requests)
+        if self.fail_batch:
+            raise RuntimeError("batch failed")
+        return [self._apply(request) for request in requests]
+
+    def create(self, entity_type, data):
+        self.creates.append(data)
+        return self._apply({"request_type": "create", "data": data})
+
+    def update(self, entity_type, entity_id, data):
+        self.updates.append((entity_id, data))
+        return self._apply({"request_type": "update", "entity_id": entity_id, "data": data})
+
+    def _apply(self, request):
+        if request["data"].get("code") in self.fail_codes:
+            raise ValueError("invalid %s" % request["data"]["code"])
+        if request["request_type"] == "update":
+            return {"type": "Version", "id": request["entity_id"]}
+        with self._lock:
+            self._next_id += 1
+            return {"type": "Version", "id": self._next_id}
+
+
+def _submit_all(batch, sg, codes):
+    results = {}
+    errors = {}
+
+    def submit(code):
+        try:
+            results[code] = batch.submit(sg.connection(), code, PROJECT, TASK,
+                                         {"code": code}, {"description": code})
+        except Exception as e:
+            errors[code] = e
+
+    threads = [threading.Thread(target=submit, args=(code,)) for code in codes]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join(5)
+    return results, errors
+
+
+def test_candidates_are_looked_up_with_a_single_query():
+    sg = FakeShotgun(versions=[
+        {"type": "Version", "id": 7, "code": "sh010_v001", "sg_task": TASK},
+    ])
+    batch = VersionBatch(window=0.2)
+    batch.add_candidates(PROJECT, TASK, ["sh010_v001", "sh020_v001"])
+
+    results, errors = _submit_all(batch, sg, ["sh010_v001", "sh020_v001"])
+
+    assert errors == {}
+    assert len(sg.finds) == 1
+    assert sorted(sg.finds[0][0][2]) == ["sh010_v001", "sh020_v001"]
+    assert len(sg.batches) == 1
+    requests = dict((request["request_type"], request) for request in sg.batches[0])
+    assert requests["update"]["entity_id"] == 7
+    assert requests["create"]["data"] == {"code": "sh020_v001"}
+    assert results["sh010_v001"] == {"type": "Version", "id": 7}
+
+
+def test_later_submissions_reuse_the_lookup():
+    sg = FakeShotgun()
+    batch = VersionBatch(window=0)
+    batch.add_candidates(PROJECT, TASK, ["sh010_v001", "sh020_v001"])
+
+    batch.submit(sg.connection(), "sh010_v001", PROJECT, TASK, {"code": "sh010_v001"}, {})
+    batch.submit(sg.connection(), "sh020_v001", PROJECT, TASK, {"code": "sh020_v001"}, {})
+
+    assert len(sg.finds) == 1
+    assert len(sg.batches) == 2
+
+
+def test_a_created_version_is_updated_by_the_next_submission():
+    sg = FakeShotgun()
+    batch = VersionBatch(window=0)
+
+    created = batch.submit(sg.connection(), "sh010_v001", PROJECT, TASK,
+                           {"code": "sh010_v001"}, {"description": "first"})
+    updated = batch.submit(sg.connection(), "sh010_v001", PROJECT, TASK,
+                           {"code": "sh010_v001"}, {"description": "second"})
+
+    assert updated == created
+    assert sg.batches[1][0]["request_type"] == "update"
+    assert sg.batches[1][0]["data"] == {"description": "second"}
+
+
+def test_a_failed_batch_fails_each_submission_with_its_own_error():
+    sg = FakeShotgun(fail_batch=True, fail_codes=("bad_v001",))
+    batch = VersionBatch(window=0.2)
+
+    results, errors = _submit_all(batch, sg, ["good_v001", "bad_v001"])
+
+    assert list(results) == ["good_v001"]
+    assert list(errors) == ["bad_v001"]
+    assert isinstance(errors["bad_v001"], ValueError)
+    assert sorted(data["code"] for data in sg.creates) == ["bad_v001", "good_v001"]
+
+
+def test_a_single_failed_submission_raises_the_batch_error():
+    sg = FakeShotgun(fail_batch=True)
+    batch = VersionBatch(window=0)
+
+    with pytest.raises(RuntimeError, match="batch failed"):
+        batch.submit(sg.connection(), "sh010_v001", PROJECT, TASK, {"code": "sh010_v001"}, {})
+    assert sg.creates == []
+
+
+def test_a_failed_create_is_looked_up_again_by_the_retry():
+    sg = FakeShotgun(fail_batch=True)
+    batch = VersionBatch(window=0)
+    with pytest.raises(RuntimeError):
+        batch.submit(sg.connection(), "sh010_v001", PROJECT, TASK, {"code": "sh010_v001"}, {})
+
+    # the create reached the site before the error
+    sg.fail_batch = False
+    sg.versions.append({"type": "Version", "id": 9, "code": "sh010_v001", "sg_task": TASK})
+    version = batch.submit(sg.connection(), "sh010_v001", PROJECT, TASK,
+                           {"code": "sh010_v001"}, {"description": "retry"})
+
+    assert version == {"type": "Version", "id": 9}
+    assert len(sg.finds) == 2
+    assert sg.batches[-1][0]["request_type"] == "update"